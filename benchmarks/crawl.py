@@ -0,0 +1,229 @@
+#!/usr/bin/env python3
+"""
+Crawls a synthetic tenant served by mock_confluence.py with App.find_secrets and reports the pages, versions and bytes
+crawled per second along with the time spent in each stage. The server runs in its own process. Stage times are summed
+over the worker threads of the stage, so they can exceed the elapsed time. With the async backend, the versions are
+fetched inside the scanning coroutines and the search time includes the time waiting for other coroutines.
+
+Results can be saved with --output and compared with the results of another release with --compare.
+
+usage: python benchmarks/crawl.py [--spaces 10] [--contents-per-space 50] [--backend threads] [--output results.json]
+"""
+
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from collections import Counter
+
+import dateutil.parser
+import requests
+
+from mock_confluence import add_tenant_arguments
+
+sys.path.append(os.path.join(os.path.dirname(os.path.realpath(__file__)), "../src/confluence_secret_finder"))
+
+from core.confluence import ContentFilter  # noqa: E402
+from main import App, AsyncApp, split_list  # noqa: E402
+
+MOCK_SERVER = os.path.join(os.path.dirname(os.path.realpath(__file__)), "mock_confluence.py")
+STAGES = ["search", "list versions", "fetch", "extract", "scan", "crawl history"]
+
+
+class StageTimer(object):
+    """Mixin timing the stages of an App."""
+
+    def __init__(self, *args, **kwargs):
+        super(StageTimer, self).__init__(*args, **kwargs)
+        self.stage_times = Counter()
+        self.counts = Counter()
+        self._timer_lock = threading.Lock()
+
+    def _add_time(self, stage, start, **counts):
+        with self._timer_lock:
+            self.stage_times[stage] += time.perf_counter() - start
+            self.counts.update(counts)
+
+    def _get_contents_to_crawl(self, *args, **kwargs):
+        contents = iter(super(StageTimer, self)._get_contents_to_crawl(*args, **kwargs))
+        while True:
+            start = time.perf_counter()
+            try:
+                content = next(contents)
+            except StopIteration:
+                return
+            finally:
+                self._add_time("search", start)
+            yield content
+
+    async def _get_contents_to_crawl_async(self, *args, **kwargs):
+        contents = super(StageTimer, self)._get_contents_to_crawl_async(*args, **kwargs).__aiter__()
+        while True:
+            start = time.perf_counter()
+            try:
+                content = await contents.__anext__()
+            except StopAsyncIteration:
+                return
+            finally:
+                self._add_time("search", start)
+            yield content
+
+    def _list_versions(self, task):
+        start = time.perf_counter()
+        try:
+            return super(StageTimer, self)._list_versions(task)
+        finally:
+            self._add_time("list versions", start)
+
+    def _fetch_version(self, task):
+        start = time.perf_counter()
+        try:
+            return super(StageTimer, self)._fetch_version(task)
+        finally:
+            self._add_time("fetch", start)
+
+    def _extract_version(self, task):
+        start = time.perf_counter()
+        try:
+            return super(StageTimer, self)._extract_version(task)
+        finally:
+            self._add_time("extract", start)
+
+    def _scan_version(self, task):
+        start = time.perf_counter()
+        try:
+            return super(StageTimer, self)._scan_version(task)
+        finally:
+            self._add_time("scan", start, versions=1 if task.version else 0)
+
+    def _update_crawl_history(self, content, *args, **kwargs):
+        start = time.perf_counter()
+        try:
+            return super(StageTimer, self)._update_crawl_history(content, *args, **kwargs)
+        finally:
+            self._add_time("crawl history", start, **{content.type: 1})
+
+
+class TimedApp(StageTimer, App):
+    pass
+
+
+class TimedAsyncApp(StageTimer, AsyncApp):
+    pass
+
+
+def start_server(args):
+    tenant_args = []
+    for name in vars(get_tenant_parser().parse_args([])):
+        tenant_args.extend([f"--{name.replace('_', '-')}", str(getattr(args, name))])
+    server = subprocess.Popen([sys.executable, MOCK_SERVER, "--port", "0"] + tenant_args, stdout=subprocess.PIPE, text=True)
+    return server, json.loads(server.stdout.readline())
+
+
+def get_tenant_parser():
+    parser = argparse.ArgumentParser(add_help=False)
+    add_tenant_arguments(parser)
+    return parser
+
+
+def run(args, tenant, cache_location):
+    app_kwargs = dict(domain="benchmark", api_user="user", api_token="token", blacklist_file=None, max_attachment_size=10,
+                      cache_location=cache_location, start_date=dateutil.parser.parse(tenant["start_date"]).date(),
+                      end_date=dateutil.parser.parse(tenant["end_date"]).date(), fetch_workers=args.fetch_workers,
+                      extract_workers=args.extract_workers, scan_workers=args.scan_workers, scan_processes=args.scan_processes,
+                      pool_size=args.pool_size, max_requests_per_second=args.max_requests_per_second,
+                      lazy_version_bodies=args.lazy_version_bodies, incremental_scan=args.incremental_scan,
+                      content_cache_size=args.content_cache_size, html_parser=args.html_parser, wiki_url=tenant["wiki_url"],
+                      search_window_days=args.search_window_days,
+                      content_filter=ContentFilter(types=split_list(args.types), exclude_mime_types=split_list(args.exclude_mime_types)))
+    if args.backend == "async":
+        app = TimedAsyncApp(max_concurrent_requests=args.max_concurrent_requests, **app_kwargs)
+    else:
+        app = TimedApp(**app_kwargs)
+
+    with app:
+        start = time.perf_counter()
+        secret_count = sum(len(s.secrets) for s in app.find_secrets())
+        elapsed = time.perf_counter() - start
+    return app, elapsed, secret_count
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Crawl benchmark against a local Confluence stand-in")
+    add_tenant_arguments(parser)
+    parser.add_argument("--backend", choices=["threads", "async"], default="threads", help="HTTP backend.")
+    parser.add_argument("--fetch-workers", type=int, default=4, help="Number of threads downloading versions and attachments.")
+    parser.add_argument("--extract-workers", type=int, default=2, help="Number of threads and processes extracting text.")
+    parser.add_argument("--scan-workers", type=int, default=1, help="Number of threads scanning text.")
+    parser.add_argument("--scan-processes", type=int, default=0, help="Number of processes scanning text.")
+    parser.add_argument("--pool-size", type=int, default=10, help="Number of keep-alive HTTP connections.")
+    parser.add_argument("--max-concurrent-requests", type=int, default=100, help="Max number of requests in flight with the async backend.")
+    parser.add_argument("--max-requests-per-second", type=float, default=10000, help="Upper bound of the request rate.")
+    parser.add_argument("--lazy-version-bodies", action="store_true", help="Downloads the body of each version separately.")
+    parser.add_argument("--incremental-scan", action="store_true", help="Only scans the lines changed since the previous version.")
+    parser.add_argument("--content-cache-size", type=int, default=0, help="Number of version contents cached. 0 disables the cache.")
+    parser.add_argument("--html-parser", default="html.parser", help="Parser extracting the text of pages.")
+    parser.add_argument("--search-window-days", type=int, default=1, help="Number of days searched at once.")
+    parser.add_argument("--types", help="Comma separated list of content types to crawl.")
+    parser.add_argument("--exclude-mime-types", help="Comma separated list of mime types of the attachments to skip.")
+    parser.add_argument("--output", help="Saves the results in this JSON file.")
+    parser.add_argument("--compare", help="Compares the results with those saved by another run in this JSON file.")
+    args = parser.parse_args()
+
+    server, tenant = start_server(args)
+    try:
+        with tempfile.TemporaryDirectory() as folder:
+            app, elapsed, secret_count = run(args, tenant, os.path.join(folder, "cache.sqlite"))
+        stats = requests.get(tenant["wiki_url"].replace("/wiki", "/_stats")).json()
+    finally:
+        server.terminate()
+        server.wait()
+
+    results = {
+        "elapsed": elapsed,
+        "pages_per_second": app.counts["page"] / elapsed,
+        "versions_per_second": app.counts["versions"] / elapsed,
+        "bytes_per_second": stats.get("bytes", 0) / elapsed,
+        "requests_per_second": stats.get("requests", 0) / elapsed,
+        "stage_times": {stage: app.stage_times[stage] for stage in STAGES if stage in app.stage_times},
+        "counts": {"pages": app.counts["page"], "attachments": app.counts["attachment"], "versions": app.counts["versions"],
+                   "secrets": secret_count, "requests": stats.get("requests", 0), "rate_limited": stats.get("rate_limited", 0),
+                   "bytes": stats.get("bytes", 0)},
+        "arguments": vars(args),
+    }
+
+    previous = None
+    if args.compare:
+        with open(args.compare) as f:
+            previous = json.load(f)
+
+    def change(value, key, stage=False):
+        if not previous:
+            return ""
+        old = previous["stage_times"].get(key) if stage else previous.get(key)
+        return f" ({(value / old - 1) * 100:+.1f}%)" if old else ""
+
+    counts = results["counts"]
+    print(f"tenant: {tenant['contents']} contents, {tenant['versions']} versions, {tenant['start_date']} to {tenant['end_date']}")
+    print(f"crawled: {counts['pages']} pages, {counts['attachments']} attachments, {counts['versions']} versions, "
+          f"{counts['secrets']} secrets, {counts['requests']} requests, {counts['rate_limited']} rate limited")
+    print(f"elapsed:  {elapsed:10.2f} s{change(elapsed, 'elapsed')}")
+    for key, label, unit in [("pages_per_second", "pages", "pages/s"), ("versions_per_second", "versions", "versions/s"),
+                             ("bytes_per_second", "bytes", "MB/s"), ("requests_per_second", "requests", "requests/s")]:
+        value = results[key] / 1024 / 1024 if unit == "MB/s" else results[key]
+        print(f"{label + ':':<9} {value:10.2f} {unit}{change(results[key], key)}")
+    print("stage times (summed over the threads of each stage):")
+    for stage, seconds in results["stage_times"].items():
+        print(f"  {stage:<14} {seconds:10.2f} s{change(seconds, stage, stage=True)}")
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,121 @@
+#!/usr/bin/env python3
+"""
+Compares the single pass HTML text extraction backends with the previous BeautifulSoup implementation. The pages of
+the html_corpus folder and generated Confluence pages must give the same text as BeautifulSoup with the html.parser
+backend. The lxml backend may differ, since it also reports the text outside of any tag and joins the strings around
+stray end tags, but it must not lose any word of the BeautifulSoup text.
+
+Requires beautifulsoup4 for the reference implementation.
+
+usage: python benchmarks/html_extraction.py [--pages 300] [--paragraphs 200]
+"""
+
+import argparse
+import glob
+import os
+import random
+import string
+import sys
+import time
+import warnings
+
+from bs4 import BeautifulSoup
+
+sys.path.append(os.path.join(os.path.dirname(os.path.realpath(__file__)), "../src/confluence_secret_finder"))
+
+from core.text_extractor import HTML_PARSERS, TextExtractor  # noqa: E402
+
+CORPUS_FOLDER = os.path.join(os.path.dirname(os.path.realpath(__file__)), "html_corpus")
+WORDS = ["deploy", "server", "the", "configuration", "database", "release", "notes", "team", "meeting", "backup", "&amp;", "caf&eacute;"]
+
+
+def extract_text_with_beautiful_soup(html):
+    """The implementation replaced by the single pass extraction."""
+    soup = BeautifulSoup(html, 'html.parser')
+    texts = soup.findAll(text=True)
+    visible_texts = filter(lambda tag: tag.parent.name not in ['style', 'script', 'head', 'title', 'meta', '[document]'], texts)
+    content = u"\n".join(t.strip() for t in visible_texts if not t.isspace())
+    content = content.replace(":\n", ": ")
+    return content
+
+
+def generate_page(paragraph_count, rnd):
+    def words():
+        return " ".join(rnd.choice(WORDS) for _ in range(rnd.randrange(3, 15)))
+
+    parts = ["<h1>Runbook</h1>"]
+    for _ in range(paragraph_count):
+        r = rnd.random()
+        if r < 0.5:
+            parts.append(f"<p>{words()} <strong>{words()}</strong> {words()}</p>")
+        elif r < 0.7:
+            cells = "".join(f"<td class=\"confluenceTd\">{words()}:</td><td class=\"confluenceTd\"><span>{words()}</span></td>" for _ in range(3))
+            parts.append(f"<div class=\"table-wrap\"><table class=\"confluenceTable\"><tbody><tr>{cells}</tr></tbody></table></div>")
+        elif r < 0.85:
+            parts.append(f"<ul><li>{words()}</li><li>{words()}<br />{words()}</li></ul>")
+        elif r < 0.95:
+            parts.append(f"<div class=\"code panel\"><pre class=\"syntaxhighlighter-pre\">password: {words()}\n{words()}</pre></div>")
+        else:
+            parts.append(f"<script>var x = \"{words()}\";</script><!-- {words()} -->")
+    return "".join(parts)
+
+
+def get_missing_words(text, reference_text):
+    """Returns the words of the reference text missing from the text, ignoring the punctuation around words."""
+    words = {w.strip(string.punctuation) for w in text.split()}
+    return [w for w in reference_text.split() if w.strip(string.punctuation) not in words]
+
+
+def load_corpus():
+    corpus = {}
+    for file_name in sorted(glob.glob(os.path.join(CORPUS_FOLDER, "*.html"))):
+        with open(file_name, encoding="utf-8") as f:
+            corpus[os.path.basename(file_name)] = f.read()
+    return corpus
+
+
+def time_extraction(extract, pages):
+    start = time.perf_counter()
+    texts = [extract(page) for page in pages]
+    return time.perf_counter() - start, texts
+
+
+def main():
+    parser = argparse.ArgumentParser(description="HTML text extraction benchmark")
+    parser.add_argument("--pages", type=int, default=300, help="Number of generated pages.")
+    parser.add_argument("--paragraphs", type=int, default=200, help="Number of paragraphs, tables, lists or code blocks per page.")
+    args = parser.parse_args()
+    warnings.simplefilter("ignore")  # findAll(text=True) is deprecated in recent versions of BeautifulSoup.
+
+    rnd = random.Random(42)
+    corpus = load_corpus()
+    pages = [generate_page(args.paragraphs, rnd) for _ in range(args.pages)]
+    megabytes = sum(len(p) for p in pages) / 1024 / 1024
+
+    reference_elapsed, reference_texts = time_extraction(extract_text_with_beautiful_soup, pages)
+    print(f"{'beautifulsoup':<14} {reference_elapsed:8.2f}s {megabytes / reference_elapsed:8.2f} MB/s")
+
+    failed = False
+    for html_parser in HTML_PARSERS:
+        try:
+            elapsed, texts = time_extraction(lambda page: TextExtractor.extract_text_from_html(page, html_parser), pages)
+        except ImportError as e:
+            print(f"{html_parser:<14} skipped: {e}")
+            continue
+
+        compared = [(name, TextExtractor.extract_text_from_html(html, html_parser), extract_text_with_beautiful_soup(html)) for name, html in corpus.items()]
+        compared += [(f"generated page {i}", a, b) for i, (a, b) in enumerate(zip(texts, reference_texts))]
+        different_pages = [name for name, a, b in compared if a != b]
+        missing_words = [(name, w) for name, a, b in compared for w in get_missing_words(a, b)]
+        print(f"{html_parser:<14} {elapsed:8.2f}s {megabytes / elapsed:8.2f} MB/s {reference_elapsed / elapsed:6.1f}x  "
+              f"different pages: {len(different_pages)} {different_pages[:5] if different_pages else ''}  "
+              f"missing words: {len(missing_words)} {missing_words[:5] if missing_words else ''}")
+        if html_parser == "html.parser" and different_pages or missing_words:
+            failed = True
+
+    if failed:
+        sys.exit("The html.parser backend must give the same text as BeautifulSoup and the lxml backend must not lose any word.")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,76 @@
+#!/usr/bin/env python3
+"""
+Measures the cold start of the tool: the time to run --help and to import main in a new interpreter, next to the
+startup of the interpreter itself, and the modules slowest to import. Fails if one of the dependencies loaded on first
+use is imported at startup, or if --max-seconds is given and the import of main takes longer.
+
+usage: python benchmarks/import_time.py [--runs 10] [--max-seconds 0.5]
+"""
+
+import argparse
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+SOURCE_FOLDER = os.path.join(os.path.dirname(os.path.realpath(__file__)), "../src/confluence_secret_finder")
+MAIN = os.path.join(SOURCE_FOLDER, "main.py")
+IMPORT_MAIN = f"import sys; sys.path.insert(0, {SOURCE_FOLDER!r}); import main"
+# Dependencies only loaded once a crawl needs them.
+LAZY_MODULES = ["textract", "detect_secrets", "requests", "httpx", "lxml", "bs4", "asyncio", "http.server"]
+
+
+def time_command(args, runs):
+    timings = []
+    for _ in range(runs):
+        start = time.perf_counter()
+        subprocess.run(args, check=True, stdout=subprocess.DEVNULL)
+        timings.append(time.perf_counter() - start)
+    return timings
+
+
+def get_loaded_modules():
+    script = f"{IMPORT_MAIN}; print('\\n'.join(sys.modules))"
+    return set(subprocess.run([sys.executable, "-c", script], check=True, capture_output=True, text=True).stdout.split())
+
+
+def get_slowest_imports(count):
+    """Returns the modules with the longest cumulative import time, in microseconds, from -X importtime."""
+    stderr = subprocess.run([sys.executable, "-X", "importtime", "-c", IMPORT_MAIN], check=True, capture_output=True, text=True).stderr
+    imports = []
+    for line in stderr.splitlines():
+        parts = line.split("|")
+        if len(parts) == 3 and parts[1].strip().isdigit():
+            imports.append((int(parts[1]), parts[2].strip()))
+    return sorted(imports, reverse=True)[:count]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Import time benchmark")
+    parser.add_argument("--runs", type=int, default=10, help="Number of runs of each command.")
+    parser.add_argument("--max-seconds", type=float, default=None, help="Fails if the median import of main takes longer.")
+    args = parser.parse_args()
+
+    commands = [("python -c pass", [sys.executable, "-c", "pass"]),
+                ("import main", [sys.executable, "-c", IMPORT_MAIN]),
+                ("main.py --help", [sys.executable, MAIN, "--help"])]
+    medians = {}
+    for name, command in commands:
+        timings = time_command(command, args.runs)
+        medians[name] = statistics.median(timings)
+        print(f"{name:<16} {medians[name] * 1000:8.1f} ms median {min(timings) * 1000:8.1f} ms min")
+
+    print("Slowest imports:")
+    for microseconds, module in get_slowest_imports(10):
+        print(f"  {microseconds / 1000:8.1f} ms {module}")
+
+    loaded = sorted(m for m in LAZY_MODULES if m in get_loaded_modules())
+    if loaded:
+        sys.exit(f"Imported at startup: {', '.join(loaded)}.")
+    if args.max_seconds is not None and medians["import main"] > args.max_seconds:
+        sys.exit(f"Importing main took {medians['import main']:.3f}s, more than {args.max_seconds}s.")
+
+
+if __name__ == "__main__":
+    main()
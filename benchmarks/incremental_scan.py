@@ -0,0 +1,76 @@
+#!/usr/bin/env python3
+"""
+Compares a full scan of every version of a long page history with the incremental scan (--incremental-scan), which
+only scans the lines added or changed since the previous version.
+
+usage: python benchmarks/incremental_scan.py [--versions 500] [--lines 200]
+"""
+
+import argparse
+import os
+import random
+import sys
+import time
+
+sys.path.append(os.path.join(os.path.dirname(os.path.realpath(__file__)), "../src/confluence_secret_finder"))
+
+from core.secrets import SecretFinder  # noqa: E402
+from main import App  # noqa: E402
+
+WORDS = ["deploy", "server", "the", "configuration", "database", "release", "notes", "team", "meeting", "backup"]
+
+
+def generate_history(version_count, line_count, seed=42):
+    rnd = random.Random(seed)
+
+    def random_line():
+        if rnd.random() < 0.05:
+            return f"password: {rnd.choice(['Hunter', 'Summer', 'Winter'])}{rnd.randrange(1000)}x"
+        return " ".join(rnd.choice(WORDS) for _ in range(rnd.randrange(4, 12)))
+
+    lines = [random_line() for _ in range(line_count)]
+    history = []
+    for _ in range(version_count):
+        for _ in range(rnd.randrange(1, 4)):
+            lines[rnd.randrange(len(lines))] = random_line()
+        if rnd.random() < 0.3:
+            lines.insert(rnd.randrange(len(lines)), random_line())
+        history.append(list(lines))
+    return history
+
+
+def scan(secret_finder, history, incremental):
+    reported = []
+    found = set()
+    previous_lines = None
+    for lines in history:
+        scanned_lines = App._get_new_lines(lines, previous_lines) if incremental else lines
+        # Same deduplication as the crawl history of a content.
+        secrets = [s for s in secret_finder.find_secrets_in_lines(scanned_lines) if s not in found]
+        found.update(secrets)
+        reported.append(sorted(secrets))
+        previous_lines = lines
+    return reported
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Incremental scan benchmark")
+    parser.add_argument("--versions", type=int, default=500, help="Number of versions of the page.")
+    parser.add_argument("--lines", type=int, default=200, help="Number of lines of the first version.")
+    args = parser.parse_args()
+
+    history = generate_history(args.versions, args.lines)
+    secret_finder = SecretFinder(None)
+
+    results = {}
+    for incremental in [False, True]:
+        start = time.perf_counter()
+        results[incremental] = scan(secret_finder, history, incremental)
+        elapsed = time.perf_counter() - start
+        print(f"{'incremental' if incremental else 'full':<12} {elapsed:8.2f}s {args.versions / elapsed:10.1f} versions/s")
+
+    print(f"identical results: {results[False] == results[True]}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,328 @@
+#!/usr/bin/env python3
+"""
+Local stand-in for the Confluence Cloud endpoints used by ConfluenceRepository, serving a synthetic tenant generated
+from a seed: the CQL search by day or by date range, space and type, the content list ordered by creation date, a
+single content, the version list of a content, a single version and the attachment downloads. Lists are paginated
+with _links.next or capped like the real API, and every Nth request can be answered with a 429. Page bodies and
+attachments are generated on request so that large tenants fit in memory.
+
+GET /_stats returns the number of requests, 429s and bytes served.
+
+usage: python benchmarks/mock_confluence.py [--port 8080] [--spaces 10] [--contents-per-space 50] [--max-versions 100]
+"""
+
+import argparse
+import datetime
+import json
+import random
+import re
+import threading
+from collections import Counter
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, quote, unquote, urlencode, urlsplit
+
+WORDS = ["deploy", "server", "the", "configuration", "database", "release", "notes", "team", "meeting", "backup", "rollout",
+         "customer", "incident", "review", "owner", "staging", "production", "&amp;", "caf&eacute;"]
+# Mime type, file extension and whether the content is text.
+ATTACHMENT_TYPES = [("text/plain", ".txt", True), ("application/json", ".json", True), ("application/xml", ".xml", True),
+                    ("text/csv", ".csv", True), ("application/octet-stream", ".log", True), ("image/png", ".png", False),
+                    ("application/zip", ".zip", False)]
+SEARCH_PAGE_SIZE = 25
+MAX_SEARCH_PAGE_SIZE = 250
+VERSION_PAGE_SIZE = 50
+
+
+class Content(object):
+    def __init__(self, content_id, content_type, title, space_key, created, modified, latest_version, mime_type=None, size=0):
+        self.id = content_id
+        self.type = content_type
+        self.title = title
+        self.space_key = space_key
+        self.created = created
+        self.modified = modified
+        self.latest_version = latest_version
+        self.mime_type = mime_type
+        self.size = size
+
+
+class Tenant(object):
+    """
+    Synthetic Confluence site. Contents are created and last modified on days of the date range. The number of versions
+    follows a long tailed distribution up to max_versions. Each paragraph of a page changes every few versions and
+    about one paragraph in 50 holds a password. A share of the versions only change metadata or restore an earlier
+    version, so that their body is identical to an earlier one.
+    """
+
+    def __init__(self, spaces=10, contents_per_space=50, max_versions=100, attachment_ratio=0.3, paragraphs=40, attachment_size=32,
+                 start_date=datetime.date(2024, 1, 1), days=7, seed=42, duplicate_ratio=0.2):
+        self.seed = seed
+        self.duplicate_ratio = duplicate_ratio
+        self.paragraphs = paragraphs
+        self.start_date = start_date
+        self.end_date = start_date + datetime.timedelta(days=days - 1)
+        self.spaces = {f"SP{i}": f"Space {i}" for i in range(spaces)}
+        self.contents = {}
+
+        rnd = random.Random(seed)
+        content_id = 1000
+        for space_key in self.spaces:
+            for i in range(contents_per_space):
+                content_id += 1
+                created = start_date + datetime.timedelta(days=rnd.randrange(days))
+                modified = created + datetime.timedelta(days=rnd.randrange((self.end_date - created).days + 1))
+                latest_version = max(1, int(max_versions ** rnd.random()))
+                if rnd.random() < attachment_ratio:
+                    mime_type, extension, _ = rnd.choice(ATTACHMENT_TYPES)
+                    size = int(rnd.expovariate(1 / attachment_size) * 1024) + 1
+                    content = Content(str(content_id), "attachment", f"file {content_id}{extension}", space_key, created, modified,
+                                      min(latest_version, 5), mime_type, size)
+                else:
+                    content = Content(str(content_id), "page", f"Page {content_id} &amp; notes", space_key, created, modified, latest_version)
+                self.contents[content.id] = content
+
+    def search(self, start_date, end_date, filters=None):
+        """Returns the contents changed between the dates whose space and type match the filters: (field, negated, values)."""
+        def matches(c):
+            return all((getattr(c, field) in values) != negated for field, negated, values in filters or [])
+
+        contents = [c for c in self.contents.values() if (start_date <= c.created <= end_date or start_date <= c.modified <= end_date) and matches(c)]
+        return sorted(contents, key=lambda c: (c.modified, c.created, int(c.id)))
+
+    def get_body_version(self, content: Content, version_number) -> int:
+        """Returns the first version with the same body as the given version."""
+        while version_number > 1:
+            rnd = random.Random(f"{self.seed}:{content.id}:v{version_number}")
+            r = rnd.random()
+            if r < self.duplicate_ratio / 2:
+                version_number -= 1  # Metadata change.
+            elif r < self.duplicate_ratio:
+                version_number = rnd.randrange(1, version_number)  # Restore.
+            else:
+                break
+        return version_number
+
+    def get_body(self, content: Content, version_number) -> str:
+        version_number = self.get_body_version(content, version_number)
+        parts = []
+        for i in range(self.paragraphs):
+            # Paragraph i changes every 5 to 14 versions, at a different version for each paragraph.
+            revision = (version_number + 3 * i) // (5 + i % 10)
+            rnd = random.Random(f"{self.seed}:{content.id}:{i}:{revision}")
+            text = " ".join(rnd.choice(WORDS) for _ in range(rnd.randrange(5, 20)))
+            r = rnd.random()
+            if r < 0.02:
+                parts.append(f"<p>password: {rnd.choice(['Hunter', 'Summer', 'Winter'])}{rnd.randrange(100000)}x</p>")
+            elif r < 0.2:
+                cells = "".join(f"<td class=\"confluenceTd\">{w}:</td><td class=\"confluenceTd\">{text}</td>" for w in text.split()[:3])
+                parts.append(f"<div class=\"table-wrap\"><table class=\"confluenceTable\"><tbody><tr>{cells}</tr></tbody></table></div>")
+            elif r < 0.3:
+                parts.append(f"<div class=\"code panel\"><pre class=\"syntaxhighlighter-pre\">{text}\nhost: db-{rnd.randrange(100)}</pre></div>")
+            else:
+                parts.append(f"<p>{text} <strong>{content.title}</strong></p>")
+        return "".join(parts)
+
+    def get_attachment(self, content: Content, version_number) -> bytes:
+        version_number = self.get_body_version(content, version_number)
+        rnd = random.Random(f"{self.seed}:{content.id}:{version_number}")
+        if not next(t for t in ATTACHMENT_TYPES if t[0] == content.mime_type)[2]:
+            return rnd.randbytes(content.size)
+
+        lines = []
+        size = 0
+        while size < content.size:
+            line = " ".join(rnd.choice(WORDS) for _ in range(rnd.randrange(5, 20)))
+            if rnd.random() < 0.02:
+                line = f"token = {''.join(rnd.choice('abcdef0123456789') for _ in range(40))}"
+            lines.append(line)
+            size += len(line) + 1
+        return "\n".join(lines).encode("utf-8")[:content.size]
+
+
+class MockConfluenceServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, address, tenant: Tenant, rate_limit_every=0, retry_after=1.0):
+        super(MockConfluenceServer, self).__init__(address, MockConfluenceHandler)
+        self.tenant = tenant
+        self.rate_limit_every = rate_limit_every
+        self.retry_after = retry_after
+        self.stats = Counter()
+        self._lock = threading.Lock()
+
+    @property
+    def wiki_url(self):
+        return f"http://{self.server_address[0]}:{self.server_address[1]}/wiki"
+
+    def count(self, **counts):
+        with self._lock:
+            self.stats.update(counts)
+            return self.stats["requests"]
+
+
+class MockConfluenceHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    server: MockConfluenceServer
+
+    def log_message(self, *args):
+        pass
+
+    def do_GET(self):
+        url = urlsplit(self.path)
+        params = {k: v[0] for k, v in parse_qs(url.query).items()}
+        if url.path == "/_stats":
+            return self._send(200, json.dumps(self.server.stats).encode("utf-8"), "application/json")
+
+        request_count = self.server.count(requests=1)
+        if self.server.rate_limit_every and request_count % self.server.rate_limit_every == 0:
+            self.server.count(rate_limited=1)
+            return self._send(429, b"Rate limit exceeded", "text/plain", {"Retry-After": str(self.server.retry_after)})
+
+        routes = [(r"/wiki/rest/api/search", self._search),
+                  (r"/wiki/rest/api/content", self._list_contents),
+                  (r"/wiki/rest/api/content/(\d+)", self._get_content),
+                  (r"/wiki/rest/api/content/(\d+)/version", self._list_versions),
+                  (r"/wiki/rest/api/content/(\d+)/version/(\d+)", self._get_version),
+                  (r"/wiki/download/attachments/(\d+)/[^/]+", self._download)]
+        for pattern, route in routes:
+            m = re.fullmatch(pattern, url.path)
+            if m:
+                try:
+                    return route(params, *m.groups())
+                except KeyError:
+                    return self._send(404, b"Not found", "text/plain")
+        self._send(404, b"Not found", "text/plain")
+
+    def _search(self, params):
+        cql = params["cql"]
+        window = re.search(r'created >= "(\d{4}-\d{2}-\d{2})" and created < "(\d{4}-\d{2}-\d{2})"', cql)
+        if window:
+            start_date = datetime.date.fromisoformat(window.group(1))
+            end_date = datetime.date.fromisoformat(window.group(2)) - datetime.timedelta(days=1)
+        else:
+            start_date = end_date = datetime.date.fromisoformat(re.search(r"created=(\d{4}-\d{2}-\d{2})", cql).group(1))
+        filters = [({"space": "space_key"}.get(field, field), bool(negated), {v.strip().strip('"') for v in values.split(",")})
+                   for field, negated, values in re.findall(r"(space|type)( not)? in \(([^)]*)\)", cql)]
+
+        start, limit = int(params.get("start", 0)), min(int(params.get("limit", SEARCH_PAGE_SIZE)), MAX_SEARCH_PAGE_SIZE)
+        contents = self.server.tenant.search(start_date, end_date, filters)
+        results = [self._to_search_result(c) for c in contents[start:start + limit]]
+        links = {"base": self.server.wiki_url, "context": "/wiki"}
+        if start + limit < len(contents):
+            links["next"] = "/rest/api/search?" + urlencode(dict(params, start=start + limit, limit=limit))
+        self._send_json({"results": results, "start": start, "limit": limit, "size": len(results), "totalSize": len(contents), "_links": links})
+
+    def _to_search_result(self, content: Content):
+        return {
+            "content": {"id": content.id, "type": content.type, "title": content.title, "version": {"number": content.latest_version},
+                        "metadata": {"mediaType": content.mime_type} if content.mime_type else {}},
+            "title": content.title,
+            "resultGlobalContainer": {"title": self.server.tenant.spaces[content.space_key], "displayUrl": f"/spaces/{content.space_key}"},
+            "lastModified": content.modified.isoformat(),
+        }
+
+    def _list_contents(self, params):
+        # Only the oldest content is requested, to find where to start crawling.
+        start, limit = int(params.get("start", 0)), int(params.get("limit", SEARCH_PAGE_SIZE))
+        contents = sorted(self.server.tenant.contents.values(), key=lambda c: (c.created, int(c.id)))
+        results = [{"id": c.id, "type": c.type, "title": c.title, "history": {"createdDate": f"{c.created.isoformat()}T09:00:00.000Z"}}
+                   for c in contents[start:start + limit]]
+        self._send_json({"results": results, "start": start, "limit": limit, "size": len(results),
+                         "_links": {"base": self.server.wiki_url, "context": "/wiki"}})
+
+    def _get_content(self, params, content_id):
+        content = self.server.tenant.contents[content_id]
+        self._send_json({"id": content.id, "type": content.type, "status": "current", "title": content.title,
+                         "version": {"number": content.latest_version},
+                         "space": {"key": content.space_key, "name": self.server.tenant.spaces[content.space_key]},
+                         "metadata": {"mediaType": content.mime_type} if content.mime_type else {}})
+
+    def _list_versions(self, params, content_id):
+        content = self.server.tenant.contents[content_id]
+        start, limit = int(params.get("start", 0)), min(int(params.get("limit", 200)), VERSION_PAGE_SIZE)
+        # Versions are listed from the newest.
+        numbers = range(content.latest_version - start, max(content.latest_version - start - limit, 0), -1)
+        results = [self._to_version(content, n, params.get("expand", "")) for n in numbers]
+        self._send_json({"results": results, "start": start, "limit": limit, "size": len(results),
+                         "_links": {"base": self.server.wiki_url, "context": "/wiki"}})
+
+    def _get_version(self, params, content_id, version_number):
+        content = self.server.tenant.contents[content_id]
+        if not 1 <= int(version_number) <= content.latest_version:
+            raise KeyError(version_number)
+        self._send_json(self._to_version(content, int(version_number), params.get("expand", "")))
+
+    def _to_version(self, content: Content, number, expand):
+        version = {"number": number, "by": {"email": f"user{number % 7}@example.com", "displayName": f"User {number % 7}"},
+                   "when": f"{content.modified.isoformat()}T09:00:00.000Z"}
+        if content.type == "attachment":
+            version["content"] = {"id": content.id, "type": "attachment", "title": content.title,
+                                  "extensions": {"mediaType": content.mime_type, "fileSize": content.size},
+                                  "_links": {"download": f"/download/attachments/{content.id}/{quote(content.title)}?version={number}&api=v2"}}
+        elif "content" in expand.split(",") or "content.body.view" in expand.split(","):
+            version["content"] = {"id": content.id, "type": "page", "title": content.title}
+            if "content.body.view" in expand.split(","):
+                version["content"]["body"] = {"view": {"value": self.server.tenant.get_body(content, number), "representation": "view"}}
+        return version
+
+    def _download(self, params, content_id):
+        content = self.server.tenant.contents[content_id]
+        if unquote(urlsplit(self.path).path).rsplit("/", 1)[1] != content.title:
+            raise KeyError(content.title)
+        self._send(200, self.server.tenant.get_attachment(content, int(params.get("version", content.latest_version))), content.mime_type)
+
+    def _send_json(self, data):
+        self._send(200, json.dumps(data).encode("utf-8"), "application/json")
+
+    def _send(self, status_code, body: bytes, content_type, headers=None):
+        if status_code == 200 and self.path != "/_stats":
+            self.server.count(bytes=len(body))
+        self.send_response(status_code)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+
+def add_tenant_arguments(parser):
+    parser.add_argument("--spaces", type=int, default=10, help="Number of spaces.")
+    parser.add_argument("--contents-per-space", type=int, default=50, help="Number of pages and attachments per space.")
+    parser.add_argument("--max-versions", type=int, default=100, help="Max number of versions of a page. Most pages have a few versions.")
+    parser.add_argument("--attachment-ratio", type=float, default=0.3, help="Share of the contents that are attachments.")
+    parser.add_argument("--attachment-size", type=int, default=32, help="Average attachment size in KB.")
+    parser.add_argument("--paragraphs", type=int, default=40, help="Number of paragraphs, tables or code blocks per page.")
+    parser.add_argument("--days", type=int, default=7, help="Number of days over which the contents were created and modified.")
+    parser.add_argument("--duplicate-ratio", type=float, default=0.2, help="Share of the versions whose body is identical to an earlier version.")
+    parser.add_argument("--seed", type=int, default=42, help="Seed of the generated tenant.")
+    parser.add_argument("--rate-limit-every", type=int, default=0, help="Answers every Nth request with a 429. 0 disables rate limiting.")
+    parser.add_argument("--retry-after", type=float, default=1.0, help="Seconds of the Retry-After header of the 429s.")
+
+
+def create_server(args, host="127.0.0.1", port=0) -> MockConfluenceServer:
+    tenant = Tenant(args.spaces, args.contents_per_space, args.max_versions, args.attachment_ratio, args.paragraphs, args.attachment_size,
+                    days=args.days, seed=args.seed, duplicate_ratio=args.duplicate_ratio)
+    return MockConfluenceServer((host, port), tenant, args.rate_limit_every, args.retry_after)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Local Confluence stand-in serving a synthetic tenant")
+    parser.add_argument("--port", type=int, default=8080, help="Port to listen on. 0 picks a free port.")
+    add_tenant_arguments(parser)
+    args = parser.parse_args()
+
+    server = create_server(args, port=args.port)
+    tenant = server.tenant
+    # The first line tells the caller where to connect.
+    print(json.dumps({"wiki_url": server.wiki_url, "start_date": tenant.start_date.isoformat(), "end_date": tenant.end_date.isoformat(),
+                      "contents": len(tenant.contents), "versions": sum(c.latest_version for c in tenant.contents.values())}), flush=True)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,176 @@
+#!/usr/bin/env python3
+"""
+Measures the memory held by the models of a synthetic crawl: the versions listed from the raw API payloads, the results
+kept by the caller and the crawl history of every content. The previous models, plain __dict__ objects whose versions
+kept the whole raw version and histories holding the plaintext secrets, are measured as a reference.
+
+usage: python benchmarks/model_memory.py [--contents 100000] [--max-versions 5] [--body-size 2000]
+"""
+
+import argparse
+import gc
+import os
+import random
+import sys
+import time
+import tracemalloc
+
+sys.path.append(os.path.join(os.path.dirname(os.path.realpath(__file__)), "../src/confluence_secret_finder"))
+
+from core.confluence import ConfluenceRepository  # noqa: E402
+from core.model import ContentCrawlHistory, ContentInfo, SpaceInfo, VersionSecrets  # noqa: E402
+
+WORDS = ["deploy", "server", "the", "configuration", "database", "release", "notes", "team", "meeting", "backup"]
+WIKI_URL = "https://example.atlassian.net/wiki"
+
+
+class PreviousSpaceInfo(object):
+    def __init__(self, key, name):
+        self.key = key
+        self.name = name
+
+
+class PreviousContentInfo(object):
+    def __init__(self, content_id, content_type, latest_version, title, space, mime_type):
+        self.mime_type = mime_type
+        self.space = space
+        self.type = content_type
+        self.title = title
+        self.latest_version = latest_version
+        self.id = content_id
+
+
+class PreviousVersionInfo(object):
+    def __init__(self, version_id, by, content_accessor, url):
+        self.url = url
+        self._content_accessor = content_accessor
+        self.by = by
+        self.id = version_id
+
+    def get_content(self):
+        return self._content_accessor()
+
+
+class PreviousVersionSecrets(object):
+    def __init__(self, content, version, secrets):
+        self.secrets = secrets
+        self.version = version
+        self.content = content
+
+
+class PreviousContentCrawlHistory(object):
+    def __init__(self, latest_version=0, secrets=None):
+        self.latest_version = latest_version
+        self.secrets = secrets if secrets is not None else set()
+
+
+class PreviousModels(object):
+    space_info = PreviousSpaceInfo
+    content_info = PreviousContentInfo
+    version_secrets = PreviousVersionSecrets
+
+    @staticmethod
+    def to_version_info(content, v):
+        url = f"{WIKI_URL}/pages/viewpage.action?pageId={content.id}&pageVersion={v['number']}"
+        return PreviousVersionInfo(v["number"], v["by"]["email"], lambda: v["content"]["body"]["view"]["value"], url)
+
+    @staticmethod
+    def add_secrets(history, content_id, secrets):
+        new_secrets = [s for s in secrets if s not in history.secrets]
+        history.secrets.update(new_secrets)
+        return new_secrets
+
+    @staticmethod
+    def create_history():
+        return PreviousContentCrawlHistory()
+
+
+class Models(object):
+    space_info = SpaceInfo
+    content_info = ContentInfo
+    version_secrets = VersionSecrets
+
+    def __init__(self):
+        self._repository = ConfluenceRepository("example", None, None, 0, [], client=object(), wiki_url=WIKI_URL)
+
+    def to_version_info(self, content, v):
+        return self._repository._to_version_info(content, v)
+
+    @staticmethod
+    def add_secrets(history, content_id, secrets):
+        return history.add_secrets(content_id, secrets)
+
+    @staticmethod
+    def create_history():
+        return ContentCrawlHistory()
+
+
+def generate_versions(content_id, version_count, bodies, rnd):
+    """Returns the raw versions of a page as listed by the API, with the secrets found in each of them."""
+    versions = []
+    secrets = []
+    for number in range(1, version_count + 1):
+        if rnd.random() < 0.1:
+            # A secret stays in the page once added, so it is found again in the next versions.
+            secrets = secrets + [f"{rnd.choice(['Hunter', 'Summer', 'Winter'])}{rnd.randrange(10 ** 6)}x"]
+        # Every version has its own body object, as when parsed from a response.
+        body = rnd.choice(bodies) + f"<p>Version {number}</p>"
+        versions.append(({"number": number, "by": {"email": f"user{number % 7}@example.com", "displayName": f"User {number % 7}"},
+                          "when": "2024-01-01T09:00:00.000Z",
+                          "content": {"id": content_id, "type": "page", "title": f"Page {content_id}", "body": {"view": {"value": body, "representation": "view"}}}},
+                         list(secrets)))
+    return versions
+
+
+def crawl(models, content_count, max_versions, body_size, seed):
+    """Crawls the synthetic contents and returns the results and the crawl histories, as kept by a caller collecting them."""
+    rnd = random.Random(seed)
+    spaces = [models.space_info(f"SP{i}", f"Space {i}") for i in range(10)]
+    results = []
+    histories = {}
+    bodies = [f"<p>{' '.join(rnd.choices(WORDS, k=body_size // 7))}</p>" for _ in range(100)]
+    for i in range(content_count):
+        content_id = str(1000 + i)
+        versions = generate_versions(content_id, rnd.randint(1, max_versions), bodies, rnd)
+        content = models.content_info(content_id, "page", len(versions), f"Page {content_id}", rnd.choice(spaces), None)
+        history = models.create_history()
+        version_infos = [(models.to_version_info(content, v), secrets) for v, secrets in versions]
+        for version, secrets in version_infos:
+            version.get_content()
+            new_secrets = models.add_secrets(history, content_id, secrets)
+            if new_secrets:
+                results.append(models.version_secrets(content, version, new_secrets))
+        history.latest_version = content.latest_version
+        histories[content_id] = history
+    return results, histories
+
+
+def measure(name, models, args):
+    gc.collect()
+    tracemalloc.start()
+    start = time.perf_counter()
+    results, histories = crawl(models, args.contents, args.max_versions, args.body_size, args.seed)
+    elapsed = time.perf_counter() - start
+    gc.collect()
+    retained, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    print(f"{name:<10} {elapsed:7.2f}s {retained / 2 ** 20:9.1f} MB retained {peak / 2 ** 20:9.1f} MB peak "
+          f"{retained / args.contents:7.0f} B/content {len(results):8d} results")
+    return retained
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Model memory benchmark")
+    parser.add_argument("--contents", type=int, default=100000, help="Number of pages crawled.")
+    parser.add_argument("--max-versions", type=int, default=5, help="Max number of versions of a page.")
+    parser.add_argument("--body-size", type=int, default=2000, help="Size of the body of a version in characters.")
+    parser.add_argument("--seed", type=int, default=42, help="Seed of the generated crawl.")
+    args = parser.parse_args()
+
+    previous = measure("previous", PreviousModels(), args)
+    current = measure("current", Models(), args)
+    print(f"{previous / current:.1f}x less memory retained")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,83 @@
+#!/usr/bin/env python3
+"""
+Compares the output writers with the previous output, a print of to_json per result. The results are written to a
+temporary file, or to stdout with --stdout to include the terminal or the pipe reading it. The json lines writer
+must give the same output as to_json.
+
+usage: python benchmarks/output_writers.py [--results 100000] [--batch-size 100]
+"""
+
+import argparse
+import contextlib
+import os
+import random
+import sys
+import tempfile
+import time
+
+sys.path.append(os.path.join(os.path.dirname(os.path.realpath(__file__)), "../src/confluence_secret_finder"))
+
+from core.model import ContentInfo, SpaceInfo, VersionInfo, VersionSecrets  # noqa: E402
+from core.output import OUTPUT_FORMATS, open_output  # noqa: E402
+from core.util import to_json  # noqa: E402
+
+
+def generate_results(count, rnd):
+    spaces = [SpaceInfo(f"SP{i}", f"Space {i}") for i in range(10)]
+    results = []
+    for i in range(count):
+        content = ContentInfo(str(1000 + i), "page", rnd.randrange(1, 100), f"Page {i} & notes", rnd.choice(spaces), None)
+        version = VersionInfo(rnd.randrange(1, 100), f"user{rnd.randrange(50)}@example.com", None,
+                              f"https://example.atlassian.net/wiki/pages/viewpage.action?pageId={content.id}&pageVersion=1")
+        secrets = [f"Hunter{rnd.randrange(100000)}x" for _ in range(rnd.randrange(1, 4))]
+        results.append(VersionSecrets(content, version, secrets))
+    return results
+
+
+def print_results(results, file_name):
+    """The previous output."""
+    with (open(file_name, "w") if file_name else contextlib.nullcontext(sys.stdout)) as f:
+        for s in results:
+            print(to_json(s), file=f, flush=True)
+
+
+def write_results(results, output_format, file_name, batch_size):
+    with contextlib.ExitStack() as stack:
+        writers = [stack.enter_context(w) for w in open_output(output_format, file_name, batch_size=batch_size)]
+        for s in results:
+            for writer in writers:
+                writer.write(s)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Output writers benchmark")
+    parser.add_argument("--results", type=int, default=100000, help="Number of results written.")
+    parser.add_argument("--batch-size", type=int, default=100, help="Number of results written at once.")
+    parser.add_argument("--stdout", action="store_true", help="Writes to stdout instead of a temporary file. Redirect stdout to compare pipes.")
+    args = parser.parse_args()
+
+    results = generate_results(args.results, random.Random(42))
+    report = sys.stderr if args.stdout else sys.stdout
+    with tempfile.TemporaryDirectory() as folder:
+        def file_name(name):
+            return None if args.stdout else os.path.join(folder, name)
+
+        start = time.perf_counter()
+        print_results(results, file_name("reference.jsonl"))
+        reference_elapsed = time.perf_counter() - start
+        print(f"{'print(to_json)':<14} {reference_elapsed:8.2f}s {args.results / reference_elapsed:10.0f} results/s", file=report)
+
+        for output_format in OUTPUT_FORMATS + ([] if args.stdout else ["jsonl.gz"]):
+            start = time.perf_counter()
+            write_results(results, output_format.split(".")[0], file_name(f"results.{output_format}"), args.batch_size)
+            elapsed = time.perf_counter() - start
+            print(f"{output_format:<14} {elapsed:8.2f}s {args.results / elapsed:10.0f} results/s {reference_elapsed / elapsed:6.1f}x", file=report)
+
+        if not args.stdout:
+            with open(file_name("reference.jsonl")) as reference, open(file_name("results.jsonl")) as f:
+                if reference.read() != f.read():
+                    sys.exit("The json lines writer must give the same output as to_json.")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,92 @@
+#!/usr/bin/env python3
+"""
+Measures the overhead of each call to the detect_secrets plugin. The previous implementation created every
+detect_secrets plugin and filter and parsed a diff for each document. It is compared with the long-lived scanner,
+called once per document and once for all the documents, and the secrets found must be the same.
+
+Requires unidiff for the previous implementation.
+
+usage: python benchmarks/secret_scanner.py [--documents 300] [--lines 5]
+"""
+
+import argparse
+import os
+import random
+import sys
+import time
+
+from detect_secrets import SecretsCollection
+from detect_secrets.core.plugins.util import get_mapping_from_secret_type_to_class
+from detect_secrets.settings import transient_settings
+
+sys.path.append(os.path.join(os.path.dirname(os.path.realpath(__file__)), "../src/confluence_secret_finder"))
+
+from core.secrets.plugins.yelp_detect_secrets_plugin import YelpDetectSecretsPlugin  # noqa: E402
+
+WORDS = ["deploy", "server", "the", "configuration", "database", "release", "notes", "team", "meeting", "backup"]
+SECRET_LINES = ["password: {}", "mot de passe = \"{}\"", "pwd={}", "AWS_SECRET_ACCESS_KEY = \"{}\"", "token: '{}'",
+                "Authorization: Bearer {}", "api_key={}  # pragma: allowlist secret", "{}"]
+
+
+def find_secrets_with_diff(plugin, lines):
+    """The implementation replaced by the long-lived scanner."""
+    secrets_collection = SecretsCollection()
+    with transient_settings({'plugins_used': [{'name': plugin_type.__name__} for plugin_type in
+                                              get_mapping_from_secret_type_to_class().values()]}) as settings:
+        settings.disable_filters(
+            'detect_secrets.filters.common.is_invalid_file',
+        )
+
+        line_diff = "\n".join("+" + l for l in lines)
+        line_diff = plugin.password_replacement_regex.sub("password", line_diff)
+        dummy_diff = f"--- dummy\n+++ dummy\n@@ -0,0 +1,{len(lines)} @@\n{line_diff}"
+        secrets_collection.scan_diff(dummy_diff)
+
+    secrets = []
+    for _, secret in secrets_collection:
+        line = lines[secret.line_number - 1]
+        secret_index = line.lower().find(secret.secret_value.lower())
+        secrets.append(line[secret_index:secret_index + len(secret.secret_value)])
+    return secrets
+
+
+def generate_documents(document_count, line_count, seed=42):
+    rnd = random.Random(seed)
+    alphabet = "abcdefghijklmnopqrstuvwxyzABCDEFGHIJKLMNOPQRSTUVWXYZ0123456789+/"
+
+    def random_line():
+        if rnd.random() < 0.2:
+            secret = "".join(rnd.choice(alphabet) for _ in range(rnd.randrange(8, 41)))
+            return rnd.choice(SECRET_LINES).format(secret)
+        return " ".join(rnd.choice(WORDS) for _ in range(rnd.randrange(4, 12)))
+
+    return [[random_line() for _ in range(rnd.randrange(1, 2 * line_count))] for _ in range(document_count)]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="detect_secrets scanner benchmark")
+    parser.add_argument("--documents", type=int, default=300, help="Number of documents.")
+    parser.add_argument("--lines", type=int, default=5, help="Average number of lines per document.")
+    args = parser.parse_args()
+
+    documents = generate_documents(args.documents, args.lines)
+    plugin = YelpDetectSecretsPlugin()
+    scans = [("diff per document", lambda: [find_secrets_with_diff(plugin, lines) for lines in documents]),
+             ("per document", lambda: [list(plugin.find_secrets(lines)) for lines in documents]),
+             ("batch", lambda: plugin.find_secrets_in_documents(documents))]
+
+    results = {}
+    for name, scan in scans:
+        start = time.perf_counter()
+        results[name] = scan()
+        elapsed = time.perf_counter() - start
+        print(f"{name:<18} {elapsed:8.2f}s {elapsed / args.documents * 1000:8.2f} ms/document")
+
+    identical = all(r == results["diff per document"] for r in results.values())
+    print(f"identical results: {identical}")
+    if not identical:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -11,14 +11,15 @@ setup(
     packages=find_packages("src"),
     package_dir={"": "src"},
     install_requires=[
-        'unidiff',
         'requests',
         'detect_secrets',
-        'sqlitedict',
-        'beautifulsoup4==4.8.0',
         'python-dateutil',
         'textract'
     ],
+    extras_require={
+        'async': ['httpx'],
+        'lxml': ['lxml'],
+    },
     entry_points={
         'console_scripts': ['confluence-secret-finder = confluence_secret_finder.main:main'],
     },
@@ -0,0 +1,133 @@
+import os
+import sqlite3
+import threading
+import time
+import zlib
+from typing import Iterable, List, Tuple
+
+from .metrics import metrics
+from .model import ContentInfo, SpaceInfo, VersionInfo
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS content (
+    content_id TEXT PRIMARY KEY,
+    type TEXT NOT NULL,
+    latest_version INTEGER NOT NULL,
+    title TEXT NOT NULL,
+    space_key TEXT NOT NULL,
+    space_name TEXT NOT NULL,
+    mime_type TEXT
+);
+CREATE TABLE IF NOT EXISTS version (
+    content_id TEXT NOT NULL,
+    version INTEGER NOT NULL,
+    by TEXT,
+    url TEXT NOT NULL,
+    chunk TEXT NOT NULL,
+    offset INTEGER NOT NULL,
+    length INTEGER NOT NULL,
+    PRIMARY KEY (content_id, version)
+);
+"""
+
+# Chunk, offset and length of the compressed text of a version.
+ArchiveLocation = Tuple[str, int, int]
+
+
+class Archive(object):
+    """
+    Extracted text of the versions crawled, so that they can be scanned again without the API. The text of each
+    version is compressed and appended to chunk files of up to chunk_size bytes, which are never rewritten: every
+    Archive opens new chunks, so that several processes can write to the same folder. The chunks are indexed by content
+    id and version number in a sqlite file, along with what the results need about the content and the version.
+    Safe to use from several threads.
+    """
+    index_file_name = "index.sqlite"
+    _batch_size = 1000
+
+    def __init__(self, folder, chunk_size=64 * 1024 * 1024):
+        self.folder = folder
+        self._chunk_size = chunk_size
+        self._chunk = None
+        self._chunk_count = 0
+        self._read_chunks = {}
+        self._pending_writes = 0
+        self._lock = threading.Lock()
+        os.makedirs(folder, exist_ok=True)
+        self._connection = sqlite3.connect(os.path.join(folder, self.index_file_name), check_same_thread=False, timeout=60)
+        self._connection.execute("PRAGMA journal_mode=WAL")
+        self._connection.executescript(SCHEMA)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def close(self):
+        with self._lock:
+            self._commit()
+            if self._chunk:
+                self._chunk.close()
+            for f in self._read_chunks.values():
+                f.close()
+            self._connection.close()
+
+    def add(self, content: ContentInfo, version: VersionInfo, lines: List[str]):
+        data = zlib.compress("\n".join(lines).encode("utf-8"))
+        with self._lock:
+            if not self._chunk or self._chunk.tell() and self._chunk.tell() + len(data) > self._chunk_size:
+                self._open_chunk()
+            offset = self._chunk.tell()
+            self._chunk.write(data)
+            metrics.inc("archive_bytes_total", len(data))
+
+            self._connection.execute("""INSERT INTO content (content_id, type, latest_version, title, space_key, space_name, mime_type) VALUES (?, ?, ?, ?, ?, ?, ?)
+                                        ON CONFLICT (content_id) DO UPDATE SET latest_version = MAX(latest_version, excluded.latest_version), title = excluded.title,
+                                        space_key = excluded.space_key, space_name = excluded.space_name""",
+                                     (content.id, content.type, content.latest_version, content.title, content.space.key, content.space.name, content.mime_type))
+            # A version crawled again points to its latest extraction.
+            self._connection.execute("INSERT OR REPLACE INTO version (content_id, version, by, url, chunk, offset, length) VALUES (?, ?, ?, ?, ?, ?, ?)",
+                                     (content.id, version.id, version.by, version.url, os.path.basename(self._chunk.name), offset, len(data)))
+            self._pending_writes += 1
+            if self._pending_writes >= self._batch_size:
+                self._commit()
+
+    def get_versions(self) -> Iterable[Tuple[ContentInfo, VersionInfo, ArchiveLocation]]:
+        """Yields the archived versions, by content in the order the contents were first archived and by version number."""
+        rows = self._connection.execute("""SELECT c.content_id, c.type, c.latest_version, c.title, c.space_key, c.space_name, c.mime_type,
+                                           v.version, v.by, v.url, v.chunk, v.offset, v.length
+                                           FROM content c JOIN version v ON v.content_id = c.content_id ORDER BY c.rowid, v.version""")
+        content = None
+        for content_id, content_type, latest_version, title, space_key, space_name, mime_type, version_id, by, url, chunk, offset, length in rows:
+            if not content or content.id != content_id:
+                content = ContentInfo(content_id, content_type, latest_version, title, SpaceInfo(space_key, space_name), mime_type)
+            yield content, VersionInfo(version_id, by, None, url), (chunk, offset, length)
+
+    def read(self, location: ArchiveLocation) -> List[str]:
+        """Returns the lines of an archived version."""
+        chunk, offset, length = location
+        with self._lock:
+            f = self._read_chunks.get(chunk)
+            if not f:
+                f = self._read_chunks[chunk] = open(os.path.join(self.folder, chunk), "rb")
+            f.seek(offset)
+            data = f.read(length)
+        text = zlib.decompress(data).decode("utf-8")
+        return text.split("\n") if text else []
+
+    def _open_chunk(self):
+        self._commit()
+        if self._chunk:
+            self._chunk.close()
+        self._chunk_count += 1
+        name = f"{time.strftime('%Y%m%d%H%M%S')}-{os.getpid()}-{self._chunk_count:04d}.chunk"
+        self._chunk = open(os.path.join(self.folder, name), "ab")
+
+    def _commit(self):
+        # The chunk is written before the index so that the index never points past the end of a chunk.
+        if self._chunk:
+            self._chunk.flush()
+        with metrics.time("cache_commit_seconds", database="archive"):
+            self._connection.commit()
+        self._pending_writes = 0
@@ -1,47 +1,234 @@
 import datetime
+import json
+import logging
+import sqlite3
+from typing import Iterable, List, Optional, Set, Tuple
 
-from sqlitedict import SqliteDict
-
-from .model import ContentCrawlHistory
+from .metrics import metrics
+from .model import ContentCrawlHistory, ContentCrawlResult, ContentInfo, SpaceInfo, VersionInfo, hash_secret
+from .shard import Shard
 from .util.legacy_unpickler import legacy_decode
 
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS info (
+    domain TEXT NOT NULL,
+    key TEXT NOT NULL,
+    value TEXT,
+    PRIMARY KEY (domain, key)
+);
+CREATE TABLE IF NOT EXISTS content (
+    domain TEXT NOT NULL,
+    shard_id TEXT NOT NULL,
+    content_id TEXT NOT NULL,
+    latest_version INTEGER NOT NULL,
+    PRIMARY KEY (domain, shard_id, content_id)
+);
+CREATE TABLE IF NOT EXISTS secret_hash (
+    domain TEXT NOT NULL,
+    shard_id TEXT NOT NULL,
+    content_id TEXT NOT NULL,
+    secret_hash BLOB NOT NULL,
+    PRIMARY KEY (domain, shard_id, content_id, secret_hash)
+);
+CREATE TABLE IF NOT EXISTS body_hash (
+    domain TEXT NOT NULL,
+    shard_id TEXT NOT NULL,
+    content_id TEXT NOT NULL,
+    body_hash TEXT NOT NULL,
+    PRIMARY KEY (domain, shard_id, content_id, body_hash)
+);
+CREATE TABLE IF NOT EXISTS shard (
+    domain TEXT NOT NULL,
+    shard_id TEXT NOT NULL,
+    start_date TEXT NOT NULL,
+    end_date TEXT NOT NULL,
+    spaces TEXT,
+    last_crawl_date TEXT,
+    PRIMARY KEY (domain, shard_id)
+);
+CREATE TABLE IF NOT EXISTS shard_result (
+    domain TEXT NOT NULL,
+    shard_id TEXT NOT NULL,
+    result_key TEXT NOT NULL,
+    content TEXT NOT NULL,
+    version_secrets TEXT NOT NULL,
+    PRIMARY KEY (domain, shard_id, result_key)
+);
+"""
+
 
 class Cache(object):
+    """
+    Crawl state stored in sqlite tables. Writes are grouped in transactions committed every batch_size writes and at
+    every checkpoint, when the last crawl date of the crawl or of a shard is saved.
+    """
+    _main_shard_id = ""
+    _batch_size = 1000
+
     def __init__(self, file_name, domain):
         self.file_name = file_name
-        self.tables = {}
-
-        self._crawl_history_table = f"{domain}_crawl_history"
-        self._info_table = f"{domain}_info"
-        self._last_crawl_date_key = f"{domain}_last_crawl_date"
+        self._domain = domain
+        self._pending_writes = 0
+        self._connection = sqlite3.connect(file_name)
+        self._connection.execute("PRAGMA journal_mode=WAL")
+        self._connection.execute("PRAGMA synchronous=NORMAL")
+        self._connection.executescript(SCHEMA)
+        self._migrate_legacy_tables()
 
     def close(self):
-        for t in self.tables.values():
-            t.close()
+        self.commit()
+        self._connection.close()
 
-    def get(self, table, key):
-        d = self._get_dict(table)
-        if key not in d:
+    def commit(self):
+        with metrics.time("cache_commit_seconds", database="crawl"):
+            self._connection.commit()
+        self._pending_writes = 0
+
+    def get_crawl_history(self, content_id, shard_id=_main_shard_id) -> Optional[ContentCrawlHistory]:
+        row = self._connection.execute("SELECT latest_version FROM content WHERE domain = ? AND shard_id = ? AND content_id = ?",
+                                       (self._domain, shard_id, content_id)).fetchone()
+        if not row:
             return None
-        return d[key]
 
-    def get_crawl_history(self, content_id) -> ContentCrawlHistory:
-        return self.get(self._crawl_history_table, content_id)
+        secret_hashes = self._connection.execute("SELECT secret_hash FROM secret_hash WHERE domain = ? AND shard_id = ? AND content_id = ?",
+                                                 (self._domain, shard_id, content_id))
+        body_hashes = self._connection.execute("SELECT body_hash FROM body_hash WHERE domain = ? AND shard_id = ? AND content_id = ?",
+                                               (self._domain, shard_id, content_id))
+        return ContentCrawlHistory(row[0], {h for h, in secret_hashes}, {h for h, in body_hashes})
 
-    def set_crawl_history(self, content_id, crawl_history: ContentCrawlHistory):
-        self.set(self._crawl_history_table, content_id, crawl_history)
+    def set_crawl_history(self, content_id, crawl_history: ContentCrawlHistory, shard_id=_main_shard_id):
+        self._connection.execute("INSERT OR REPLACE INTO content (domain, shard_id, content_id, latest_version) VALUES (?, ?, ?, ?)",
+                                 (self._domain, shard_id, content_id, crawl_history.latest_version))
+        # Secrets and body hashes are never removed from the history so only the new ones are inserted.
+        self._connection.executemany("INSERT OR IGNORE INTO secret_hash (domain, shard_id, content_id, secret_hash) VALUES (?, ?, ?, ?)",
+                                     ((self._domain, shard_id, content_id, h) for h in crawl_history.secret_hashes))
+        self._connection.executemany("INSERT OR IGNORE INTO body_hash (domain, shard_id, content_id, body_hash) VALUES (?, ?, ?, ?)",
+                                     ((self._domain, shard_id, content_id, h) for h in crawl_history.body_hashes))
+        self._written()
 
-    def get_last_crawl_date(self) -> datetime.date:
-        return self.get(self._info_table, self._last_crawl_date_key)
+    def get_last_crawl_date(self) -> Optional[datetime.date]:
+        return self._get_date(self._get_info("last_crawl_date"))
 
     def set_last_crawl_date(self, last_crawl_date: datetime.date):
-        self.set(self._info_table, self._last_crawl_date_key, last_crawl_date)
+        self._set_info("last_crawl_date", last_crawl_date.isoformat())
+        self.commit()
+
+    def get_shard_plan(self) -> Optional[List[Shard]]:
+        plan = self._get_info("shard_plan")
+        if not plan:
+            return None
+        return [Shard(self._get_date(s["start_date"]), self._get_date(s["end_date"]), s["spaces"]) for s in json.loads(plan)]
+
+    def set_shard_plan(self, shards: List[Shard]):
+        plan = [{"start_date": s.start_date.isoformat(), "end_date": s.end_date.isoformat(), "spaces": s.spaces} for s in shards]
+        self._set_info("shard_plan", json.dumps(plan))
+        self.commit()
+
+    def delete_shard_plan(self):
+        self._connection.execute("DELETE FROM info WHERE domain = ? AND key = ?", (self._domain, "shard_plan"))
+        self.commit()
+
+    def get_shard_crawl_history(self, shard_id, content_id) -> Optional[ContentCrawlHistory]:
+        return self.get_crawl_history(content_id, shard_id)
+
+    def set_shard_crawl_history(self, shard_id, content_id, crawl_history: ContentCrawlHistory):
+        self.set_crawl_history(content_id, crawl_history, shard_id)
+
+    def get_shard_last_crawl_date(self, shard_id) -> Optional[datetime.date]:
+        row = self._connection.execute("SELECT last_crawl_date FROM shard WHERE domain = ? AND shard_id = ?", (self._domain, shard_id)).fetchone()
+        return self._get_date(row[0]) if row else None
+
+    def set_shard_last_crawl_date(self, shard_id, last_crawl_date: datetime.date):
+        self._connection.execute("UPDATE shard SET last_crawl_date = ? WHERE domain = ? AND shard_id = ?",
+                                 (last_crawl_date.isoformat(), self._domain, shard_id))
+        self.commit()
+
+    def get_shards(self) -> List[Shard]:
+        rows = self._connection.execute("SELECT start_date, end_date, spaces FROM shard WHERE domain = ? ORDER BY shard_id", (self._domain,))
+        return [Shard(self._get_date(start_date), self._get_date(end_date), json.loads(spaces)) for start_date, end_date, spaces in rows]
+
+    def add_shard(self, shard: Shard):
+        self._connection.execute("INSERT OR IGNORE INTO shard (domain, shard_id, start_date, end_date, spaces) VALUES (?, ?, ?, ?, ?)",
+                                 (self._domain, shard.id, shard.start_date.isoformat(), shard.end_date.isoformat(), json.dumps(shard.spaces)))
+        self.commit()
+
+    def get_shard_results(self, shard_id) -> Iterable[Tuple[str, ContentCrawlResult]]:
+        """Returns the results of a shard ordered by crawl date and then by their order in the search results."""
+        rows = self._connection.execute("SELECT result_key, content, version_secrets FROM shard_result WHERE domain = ? AND shard_id = ? ORDER BY result_key",
+                                        (self._domain, shard_id))
+        for key, content, versions in rows.fetchall():
+            yield key, ContentCrawlResult(_content_from_dict(json.loads(content)), [_version_from_dict(v) for v in json.loads(versions)])
+
+    def set_shard_result(self, shard_id, date: datetime.date, position, result: ContentCrawlResult):
+        self._connection.execute("INSERT OR REPLACE INTO shard_result (domain, shard_id, result_key, content, version_secrets) VALUES (?, ?, ?, ?, ?)",
+                                 (self._domain, shard_id, f"{date.isoformat()}:{position:08d}", json.dumps(_content_to_dict(result.content)),
+                                  json.dumps([_version_to_dict(version, secret_hashes) for version, secret_hashes in result.versions])))
+        self._written()
+
+    def _get_info(self, key):
+        row = self._connection.execute("SELECT value FROM info WHERE domain = ? AND key = ?", (self._domain, key)).fetchone()
+        return row[0] if row else None
+
+    def _set_info(self, key, value):
+        self._connection.execute("INSERT OR REPLACE INTO info (domain, key, value) VALUES (?, ?, ?)", (self._domain, key, value))
+        self._written()
+
+    def _written(self):
+        self._pending_writes += 1
+        if self._pending_writes >= self._batch_size:
+            self.commit()
+
+    @staticmethod
+    def _get_date(value) -> Optional[datetime.date]:
+        return datetime.date.fromisoformat(value) if value else None
+
+    def _migrate_legacy_tables(self):
+        """
+        Copies the crawl state pickled by the previous versions of the cache in SqliteDict tables, then drops these
+        tables since they hold the plaintext secrets.
+        """
+        tables = {name for name, in self._connection.execute("SELECT name FROM sqlite_master WHERE type = 'table'")}
+        crawl_history_table = f"{self._domain}_crawl_history"
+        info_table = f"{self._domain}_info"
+        if crawl_history_table in tables:
+            logging.info(f"Migrating {crawl_history_table} from {self.file_name}...")
+            for content_id, value in self._connection.execute(f'SELECT key, value FROM "{crawl_history_table}"').fetchall():
+                crawl_history = legacy_decode(value)
+                secret_hashes = {hash_secret(content_id, s) for s in crawl_history.secrets}
+                self.set_crawl_history(content_id, ContentCrawlHistory(crawl_history.latest_version, secret_hashes))
+        if info_table in tables:
+            row = self._connection.execute(f'SELECT value FROM "{info_table}" WHERE key = ?', (f"{self._domain}_last_crawl_date",)).fetchone()
+            if row:
+                self._set_info("last_crawl_date", legacy_decode(row[0]).isoformat())
+
+        legacy_tables = [t for t in [crawl_history_table, info_table] if t in tables]
+        if legacy_tables:
+            self._drop_tables(legacy_tables)
+
+    def _drop_tables(self, tables: List[str]):
+        """
+        Drops tables holding plaintext secrets. The freed pages are overwritten so that the secrets do not remain in the
+        file or in the write-ahead log.
+        """
+        self._connection.execute("PRAGMA secure_delete=ON")
+        for table in tables:
+            self._connection.execute(f'DROP TABLE "{table}"')
+        self.commit()
+        self._connection.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+        self._connection.execute("PRAGMA secure_delete=OFF")
+
+def _content_to_dict(content: ContentInfo):
+    return {"id": content.id, "type": content.type, "latest_version": content.latest_version, "title": content.title,
+            "space": {"key": content.space.key, "name": content.space.name}, "mime_type": content.mime_type}
+
+
+def _content_from_dict(d) -> ContentInfo:
+    return ContentInfo(d["id"], d["type"], d["latest_version"], d["title"], SpaceInfo(d["space"]["key"], d["space"]["name"]), d["mime_type"])
+
+
+def _version_to_dict(version: VersionInfo, secret_hashes: Set[bytes]):
+    return {"version": {"id": version.id, "by": version.by, "url": version.url}, "secret_hashes": sorted(h.hex() for h in secret_hashes)}
 
-    def set(self, table, key, value):
-        d = self._get_dict(table)
-        d[key] = value
 
-    def _get_dict(self, table):
-        if table not in self.tables:
-            self.tables[table] = SqliteDict(self.file_name, tablename=table, autocommit=True, decode=legacy_decode)
-        return self.tables[table]
+def _version_from_dict(d) -> Tuple[VersionInfo, Set[bytes]]:
+    return VersionInfo(d["version"]["id"], d["version"]["by"], None, d["version"]["url"]), {bytes.fromhex(h) for h in d["secret_hashes"]}
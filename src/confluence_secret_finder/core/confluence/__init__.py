@@ -1 +1,2 @@
 from .confluence_repository import ConfluenceRepository
+from .content_filter import ContentFilter
@@ -0,0 +1,125 @@
+import asyncio
+import inspect
+import logging
+import time
+from typing import Optional
+
+import httpx
+
+from .confluence_client import ConfluenceClient
+from .rate_limiter import RateLimiter
+from ..metrics import metrics
+from ..spooled_file import SpooledFile
+
+
+class AsyncConfluenceClient(object):
+    """
+    asyncio counterpart of ConfluenceClient. Up to max_concurrent_requests requests are kept in flight over a single
+    pooled httpx client. Must be entered with `async with` before use.
+    """
+    _max_retries = 5
+    _timeout = 60
+
+    def __init__(self, domain, api_user, api_token, max_concurrent_requests=100, max_requests_per_second=10, wiki_url=None):
+        self._base_url = wiki_url or f"https://{domain}.atlassian.net/wiki"
+        self._base_api_url = f"{self._base_url}/rest/api"
+        self.api_token = api_token
+        self.api_user = api_user
+        self._max_concurrent_requests = max_concurrent_requests
+        self._rate_limiter = RateLimiter(max_requests_per_second)
+        self._semaphore = None
+        self._client = None
+
+    async def __aenter__(self):
+        self._semaphore = asyncio.Semaphore(self._max_concurrent_requests)
+        limits = httpx.Limits(max_connections=self._max_concurrent_requests, max_keepalive_connections=self._max_concurrent_requests)
+        self._client = httpx.AsyncClient(auth=(self.api_user, self.api_token), headers={"Content-Type": "application/json"},
+                                         limits=limits, timeout=self._timeout, follow_redirects=True)
+        return self
+
+    async def __aexit__(self, *args):
+        await self._client.aclose()
+        self._client = None
+
+    async def paginated_get(self, endpoint, params=None):
+        url = f"{self._base_api_url}/{endpoint}"
+        params = ConfluenceClient.get_pagination_params(params)
+
+        while url:
+            r = await self._get(url, params, lambda response: response.json())
+            if not r:
+                break
+            for result in r["results"]:
+                yield result
+            url = ConfluenceClient.get_next_page_url(r)
+            params = None
+
+    async def get(self, endpoint, params=None):
+        return await self._get(f"{self._base_api_url}/{endpoint}", params, lambda response: response.json())
+
+    async def get_file(self, url, max_size=None) -> Optional[SpooledFile]:
+        """Downloads a file in chunks, without holding it in memory whole. Returns None if it is larger than max_size bytes."""
+        async def read_file(response):
+            f = SpooledFile()
+            try:
+                async for chunk in response.aiter_bytes(SpooledFile.chunk_size):
+                    metrics.inc("confluence_downloaded_bytes_total", len(chunk))
+                    f.write(chunk)
+                    if max_size is not None and f.size > max_size:
+                        logging.warning(f"Attachment larger than {max_size} bytes. Skipping {url}")
+                        f.close()
+                        return None
+            except BaseException:
+                f.close()
+                raise
+            return f
+
+        return await self._get(url, None, read_file, stream=True)
+
+    async def _get(self, url, params, response_action, stream=False):
+        retry = 1
+        while True:
+            status_code = None
+            response = None
+            wait = self._rate_limiter.reserve()
+            if wait > 0:
+                metrics.inc("confluence_rate_limit_wait_seconds_total", wait)
+            await asyncio.sleep(wait)
+            try:
+                async with self._semaphore:
+                    start = time.perf_counter()
+                    response = await self._client.send(self._client.build_request("GET", url, params=params), stream=stream)
+                    try:
+                        status_code = response.status_code
+                        ConfluenceClient.record_request(start, response, stream)
+                        self._rate_limiter.update(status_code, response.headers)
+
+                        if status_code == 200:
+                            result = response_action(response)
+                            return await result if inspect.isawaitable(result) else result
+                        if stream:
+                            await response.aread()  # Read for the error message.
+                    finally:
+                        if stream:
+                            # Releases the connection, aborting the download if it was stopped.
+                            await response.aclose()
+            except httpx.HTTPError as e:
+                ConfluenceClient.record_request(start, None)
+                logging.debug(f"Request to {url} failed: {e}")
+
+            if retry >= self._max_retries:
+                logging.error("Could not get %s. Skipping." % url)
+                return None
+
+            if status_code == 429:
+                sleep_time = 0
+                logging.warning(f"Rate limit reached. Request rate lowered to {self._rate_limiter.rate:.2f}/s.")
+            else:
+                sleep_time = retry * 5
+                message = response.text if response is not None else None
+                logging.error(f"Unhandled error. Retrying in {sleep_time} seconds. Status code {status_code}, Message: {message}.")
+
+            retry += 1
+            metrics.inc("confluence_retries_total")
+            if sleep_time > 0:
+                await asyncio.sleep(sleep_time)
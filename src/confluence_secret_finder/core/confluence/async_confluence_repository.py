@@ -0,0 +1,97 @@
+import datetime
+from typing import AsyncIterable, List, Optional, Tuple
+
+import dateutil.parser
+
+from .async_confluence_client import AsyncConfluenceClient
+from .confluence_repository import ConfluenceRepository
+from .content_filter import ContentFilter
+from ..model import ContentInfo, VersionInfo
+
+
+class AsyncConfluenceRepository(ConfluenceRepository):
+    """
+    asyncio counterpart of ConfluenceRepository. The content accessor of the returned versions returns an awaitable
+    for attachments. Must be entered with `async with` before use.
+    """
+
+    def __init__(self, domain, api_user, api_token, max_attachment_size, supported_attachment_types, max_concurrent_requests=100, max_requests_per_second=10,
+                 lazy_version_bodies=False, wiki_url=None, content_filter: ContentFilter = None):
+        client = AsyncConfluenceClient(domain, api_user, api_token, max_concurrent_requests, max_requests_per_second, wiki_url)
+        super(AsyncConfluenceRepository, self).__init__(domain, api_user, api_token, max_attachment_size, supported_attachment_types, client=client,
+                                                        lazy_version_bodies=lazy_version_bodies, wiki_url=wiki_url, content_filter=content_filter)
+
+    async def __aenter__(self):
+        await self._client.__aenter__()
+        return self
+
+    async def __aexit__(self, *args):
+        await self._client.__aexit__(*args)
+
+    def close(self):
+        pass
+
+    async def get_oldest_content_creation_date(self) -> datetime.date:
+        params = {"expand": ["history"], "orderby": "history.createdDate asc", "limit": 1}
+        async for c in self._client.paginated_get("content", params):
+            return dateutil.parser.parse(c["history"]["createdDate"]).date()
+
+    async def get_content(self, content_id, spaces=None) -> Optional[ContentInfo]:
+        return self._content_to_content_info(await self._client.get(f"content/{content_id}", self._get_content_params()), spaces)
+
+    def get_content_for_date(self, date: datetime.date, spaces=None) -> AsyncIterable[ContentInfo]:
+        return self.get_content_for_dates(date, date, spaces)
+
+    async def get_content_for_dates(self, start_date: datetime.date, end_date: datetime.date, spaces=None) -> AsyncIterable[ContentInfo]:
+        async for r in self._client.paginated_get("search", self._get_content_search_params(start_date, spaces, end_date)):
+            content_info = self._to_content_info(r)
+            if content_info:
+                yield content_info
+
+    async def count_content_for_dates(self, start_date: datetime.date, end_date: datetime.date, spaces=None) -> int:
+        r = await self._client.get("search", self._get_content_count_params(start_date, spaces, end_date))
+        return r.get("totalSize", r["size"]) if r else 0
+
+    async def get_date_windows(self, start_date: datetime.date, end_date: datetime.date, max_days=1, spaces=None) -> AsyncIterable[Tuple[datetime.date, datetime.date]]:
+        days = max_days
+        while start_date <= end_date:
+            window_end = min(start_date + datetime.timedelta(days=days - 1), end_date)
+            if window_end > start_date and await self.count_content_for_dates(start_date, window_end, spaces) > self._max_window_results:
+                days = ((window_end - start_date).days + 1) // 2
+                continue
+            yield start_date, window_end
+            start_date = window_end + datetime.timedelta(days=1)
+            days = min(days * 2, max_days)
+
+    async def get_versions(self, content_info: ContentInfo, start_version=0) -> AsyncIterable[VersionInfo]:
+        pages = self._get_version_pages(content_info, start_version)
+        for offset, limit in pages:
+            versions = await self._get_version_page(content_info, offset, limit)
+            if offset == pages[0][0]:
+                # Versions created since the search push the oldest new versions further down the list.
+                while versions and versions[-1]["number"] > start_version + 1:
+                    older_versions = await self._get_version_page(content_info, offset + len(versions), self._version_page_size)
+                    if not older_versions:
+                        break
+                    versions.extend(older_versions)
+
+            for v in versions[::-1]:
+                if v["number"] <= start_version:
+                    continue
+                version_info = self._to_version_info(content_info, v)
+                if version_info:
+                    yield version_info
+
+    async def _get_version_page(self, content_info: ContentInfo, offset, limit) -> List[dict]:
+        versions = []
+        while len(versions) < limit:
+            params = {"start": offset + len(versions), "limit": limit - len(versions), "expand": self._get_version_expand(content_info)}
+            r = await self._client.get(f"content/{content_info.id}/version", params)
+            if not r or not r["results"]:
+                break
+            versions.extend(r["results"])
+        return versions
+
+    async def _get_version_body(self, content_info: ContentInfo, version_number):
+        v = await self._client.get(f"content/{content_info.id}/version/{version_number}", {"expand": "content.body.view"})
+        return v["content"]["body"]["view"]["value"] if v else None
@@ -1,72 +1,143 @@
 import logging
 import time
+from typing import Iterable, Optional
 
-import requests
-from requests import RequestException
-from requests.auth import HTTPBasicAuth
+from .rate_limiter import RateLimiter
+from ..metrics import metrics
+from ..spooled_file import SpooledFile
 
 
 class ConfluenceClient(object):
     _max_retries = 5
+    _timeout = 60
 
-    def __init__(self, domain, api_user, api_token):
-        self._base_url = f"https://{domain}.atlassian.net/wiki"
+    def __init__(self, domain, api_user, api_token, pool_size=10, max_requests_per_second=10, wiki_url=None):
+        # Imported here since requests takes longer to load than the rest of the tool, which --help does not need.
+        import requests
+        from requests.adapters import HTTPAdapter
+        from requests.auth import HTTPBasicAuth
+
+        self._base_url = wiki_url or f"https://{domain}.atlassian.net/wiki"
         self._base_api_url = f"{self._base_url}/rest/api"
         self.api_token = api_token
         self.api_user = api_user
+        self._rate_limiter = RateLimiter(max_requests_per_second)
+        self._session = requests.Session()
+        self._session.auth = HTTPBasicAuth(api_user, api_token)
+        self._session.headers.update({"Content-Type": "application/json"})
+        adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size, pool_block=True)
+        self._session.mount("https://", adapter)
+        self._session.mount("http://", adapter)
+
+    def close(self):
+        self._session.close()
 
     def paginated_get(self, endpoint, params=None):
         url = f"{self._base_api_url}/{endpoint}"
+        params = self.get_pagination_params(params)
+
+        while url:
+            r = self._get(url, params, lambda response: response.json())
+            if not r:
+                break
+            for result in r["results"]:
+                yield result
+            url = self.get_next_page_url(r)
+            params = None
+
+    @staticmethod
+    def get_pagination_params(params):
+        params = dict(params or {})
         if "limit" not in params:
             params["limit"] = 25
         if "start" not in params:
             params["start"] = 0
         if "expand" in params and not isinstance(params["expand"], str):
             params["expand"] = ",".join(params["expand"])
+        return params
 
-        while True:
-            r = self._get(url, params, lambda response: response.json())
-            if not r:
-                break
-            for result in r["results"]:
-                yield result
-            if "next" in r["_links"]:
-                url = r["_links"]["base"] + r["_links"]["next"]
-                params = None
-            else:
-                break
+    @staticmethod
+    def get_next_page_url(page):
+        if "next" in page["_links"]:
+            return page["_links"]["base"] + page["_links"]["next"]
+        return None
+
+    @staticmethod
+    def record_request(start, response, stream=False):
+        """
+        Records the duration, status code and size of a response, or an error when response is None. The size of
+        streamed responses is recorded as they are read.
+        """
+        metrics.observe("confluence_request_seconds", time.perf_counter() - start)
+        status_code = response.status_code if response is not None else None
+        metrics.inc("confluence_requests_total", status=status_code or "error")
+        if status_code == 429:
+            metrics.inc("confluence_rate_limited_total")
+        elif status_code == 200 and not stream:
+            metrics.inc("confluence_downloaded_bytes_total", len(response.content))
+
+    @staticmethod
+    def read_file(url, chunks: Iterable[bytes], max_size=None) -> Optional[SpooledFile]:
+        """Writes the chunks of a download to a SpooledFile. Stops and returns None once more than max_size bytes are read."""
+        f = SpooledFile()
+        try:
+            for chunk in chunks:
+                metrics.inc("confluence_downloaded_bytes_total", len(chunk))
+                f.write(chunk)
+                if max_size is not None and f.size > max_size:
+                    logging.warning(f"Attachment larger than {max_size} bytes. Skipping {url}")
+                    f.close()
+                    return None
+        except BaseException:
+            f.close()
+            raise
+        return f
 
     def get(self, endpoint, params=None):
         return self._get(f"{self._base_api_url}/{endpoint}", params, lambda response: response.json())
 
-    def get_file(self, url):
-        return self._get(url, None, lambda response: response.content)
+    def get_file(self, url, max_size=None) -> Optional[SpooledFile]:
+        """Downloads a file in chunks, without holding it in memory whole. Returns None if it is larger than max_size bytes."""
+        return self._get(url, None, lambda response: self.read_file(url, response.iter_content(SpooledFile.chunk_size), max_size), stream=True)
 
-    def _get(self, url, params, response_action):
+    def _get(self, url, params, response_action, stream=False):
+        from requests import RequestException
         retry = 1
         while True:
+            status_code = None
+            response = None
+            self._rate_limiter.acquire()
+            start = time.perf_counter()
             try:
-                response = requests.get(url, auth=HTTPBasicAuth(self.api_user, self.api_token), headers={"Content-Type": "application/json"}, params=params)
+                response = self._session.get(url, params=params, timeout=self._timeout, stream=stream)
                 status_code = response.status_code
+                self.record_request(start, response, stream)
+                self._rate_limiter.update(status_code, response.headers)
 
                 if status_code == 200:
                     return response_action(response)
-            except RequestException:
-                continue
+            except RequestException as e:
+                self.record_request(start, None)
+                logging.debug(f"Request to {url} failed: {e}")
+            finally:
+                if stream and response is not None:
+                    # Releases the connection, aborting the download if it was stopped.
+                    response.close()
 
             if retry >= self._max_retries:
                 logging.error("Could not get %s. Skipping." % url)
                 return None
 
             if status_code == 429:
-                sleep_time = 5
-                logging.warning(f"Rate limit reached. Sleeping {sleep_time} seconds." )
+                # The rate limiter holds back every thread until Retry-After has elapsed.
+                sleep_time = 0
+                logging.warning(f"Rate limit reached. Request rate lowered to {self._rate_limiter.rate:.2f}/s.")
             else:
                 sleep_time = retry * 5
-                logging.error(f"Unhandled error. Retrying in {sleep_time} seconds. Status code {status_code}, Message: {response.text}.")
+                message = response.text if response is not None else None
+                logging.error(f"Unhandled error. Retrying in {sleep_time} seconds. Status code {status_code}, Message: {message}.")
 
             retry += 1
+            metrics.inc("confluence_retries_total")
             if sleep_time > 0:
                 time.sleep(sleep_time)
-
-
@@ -1,76 +1,213 @@
 import datetime
 import html
 import logging
-from typing import Iterable
+from typing import Iterable, List, Optional, Tuple
 
 import dateutil.parser
 
 from .confluence_client import ConfluenceClient
+from .content_filter import ContentFilter
 from ..model import ContentInfo, VersionInfo, SpaceInfo
 from ..util import get_mime_type_from_file_name
 
 
 class ConfluenceRepository:
-    def __init__(self, domain, api_user, api_token, max_attachment_size, supported_attachment_types):
-        self._wiki_url = f"https://{domain}.atlassian.net/wiki"
-        self._client = ConfluenceClient(domain, api_user, api_token)
+    _version_page_size = 50
+    # The API lowers the limit of search pages when it is above its maximum.
+    _search_page_size = 250
+    # Windows with more contents are split since the crawl is only checkpointed once a window is done.
+    _max_window_results = 1000
+
+    def __init__(self, domain, api_user, api_token, max_attachment_size, supported_attachment_types, pool_size=10, max_requests_per_second=10, client=None,
+                 lazy_version_bodies=False, wiki_url=None, content_filter: ContentFilter = None):
+        self._wiki_url = wiki_url or f"https://{domain}.atlassian.net/wiki"
+        self._client = client or ConfluenceClient(domain, api_user, api_token, pool_size, max_requests_per_second, wiki_url)
         self.max_attachment_size = max_attachment_size * 1024 * 1024  # MB to B
         self.supported_attachment_types = supported_attachment_types
+        self.lazy_version_bodies = lazy_version_bodies
+        self.content_filter = content_filter or ContentFilter()
+
+    def close(self):
+        self._client.close()
 
     def get_oldest_content_creation_date(self) -> datetime.date:
-        params = {"expand": ["history"], "orderby": "history.createdDate asc"}
+        params = {"expand": ["history"], "orderby": "history.createdDate asc", "limit": 1}
         oldest_date_str = next(self._client.paginated_get("content", params))["history"]["createdDate"]
         return dateutil.parser.parse(oldest_date_str).date()
 
-    def get_content_for_date(self, date: datetime.date) -> Iterable[ContentInfo]:
-        date_string = date.strftime("%Y-%m-%d")
-        params = {
-            "expand": ["content.version.number", "content.metadata.mediatype"],
-            "includeArchivedSpaces": True,
-            "cql": f"lastModified={date_string} or created={date_string} order by lastModified,created asc"
-        }
-
-        for r in self._client.paginated_get("search", params):
-            content = r.get("content")
-            result_global_container = r.get("resultGlobalContainer")
-            if not content or not result_global_container:
+    def get_content(self, content_id, spaces=None) -> Optional[ContentInfo]:
+        """Returns the content with its latest version number, or None if it is not current or not in the crawled spaces and types."""
+        return self._content_to_content_info(self._client.get(f"content/{content_id}", self._get_content_params()), spaces)
+
+    def get_content_for_date(self, date: datetime.date, spaces=None) -> Iterable[ContentInfo]:
+        return self.get_content_for_dates(date, date, spaces)
+
+    def get_content_for_dates(self, start_date: datetime.date, end_date: datetime.date, spaces=None) -> Iterable[ContentInfo]:
+        """Yields the contents created or last modified between the two dates, inclusive, in a single paginated search."""
+        for r in self._client.paginated_get("search", self._get_content_search_params(start_date, spaces, end_date)):
+            content_info = self._to_content_info(r)
+            if content_info:
+                yield content_info
+
+    def count_content_for_dates(self, start_date: datetime.date, end_date: datetime.date, spaces=None) -> int:
+        r = self._client.get("search", self._get_content_count_params(start_date, spaces, end_date))
+        return r.get("totalSize", r["size"]) if r else 0
+
+    def get_date_windows(self, start_date: datetime.date, end_date: datetime.date, max_days=1, spaces=None) -> Iterable[Tuple[datetime.date, datetime.date]]:
+        """
+        Yields consecutive windows of up to max_days days covering the date range. A window holding more than
+        _max_window_results contents is halved until it fits or is a single day, and the next window is twice as long.
+        """
+        days = max_days
+        while start_date <= end_date:
+            window_end = min(start_date + datetime.timedelta(days=days - 1), end_date)
+            if window_end > start_date and self.count_content_for_dates(start_date, window_end, spaces) > self._max_window_results:
+                days = ((window_end - start_date).days + 1) // 2
                 continue
-
-            space = SpaceInfo(result_global_container["displayUrl"].split("/")[-1], result_global_container["title"])
-            content_id = content["id"]
-            latest_version = content["version"]["number"]
-            title = ConfluenceRepository._extract_title(r)
-
-            mime_type = None
-            if content["type"] == "attachment":
-                mime_type = ConfluenceRepository._extract_mime_type(r, title)
-                if not mime_type.startswith("text/") and mime_type not in self.supported_attachment_types:
-                    if not mime_type.startswith("image/"):
-                        logging.warning(f"Content type {mime_type} not supported. Skipping attachment {title}")
+            yield start_date, window_end
+            start_date = window_end + datetime.timedelta(days=1)
+            days = min(days * 2, max_days)
+
+    def get_versions(self, content_info: ContentInfo, start_version=0) -> Iterable[VersionInfo]:
+        """
+        Yields the versions newer than start_version from the oldest to the newest. The API lists the versions from the
+        newest so only the pages holding the new versions are requested, starting with the last one.
+        """
+        pages = self._get_version_pages(content_info, start_version)
+        for offset, limit in pages:
+            versions = self._get_version_page(content_info, offset, limit)
+            if offset == pages[0][0]:
+                # Versions created since the search push the oldest new versions further down the list.
+                while versions and versions[-1]["number"] > start_version + 1:
+                    older_versions = self._get_version_page(content_info, offset + len(versions), self._version_page_size)
+                    if not older_versions:
+                        break
+                    versions.extend(older_versions)
+
+            for v in versions[::-1]:
+                if v["number"] <= start_version:
                     continue
+                version_info = self._to_version_info(content_info, v)
+                if version_info:
+                    yield version_info
+
+    def _get_version_page(self, content_info: ContentInfo, offset, limit) -> List[dict]:
+        versions = []
+        while len(versions) < limit:
+            # The API may cap the limit so keep requesting until the page is complete or the list ends.
+            params = {"start": offset + len(versions), "limit": limit - len(versions), "expand": self._get_version_expand(content_info)}
+            r = self._client.get(f"content/{content_info.id}/version", params)
+            if not r or not r["results"]:
+                break
+            versions.extend(r["results"])
+        return versions
+
+    def _get_version_pages(self, content_info: ContentInfo, start_version) -> List[Tuple[int, int]]:
+        """Returns the offset and limit of the pages holding the new versions, from the oldest versions to the newest."""
+        new_versions = max(content_info.latest_version - start_version, 0)
+        return [(offset, min(self._version_page_size, new_versions - offset)) for offset in range(0, new_versions, self._version_page_size)][::-1]
+
+    def _get_version_expand(self, content_info: ContentInfo):
+        if content_info.type == "attachment" or self.lazy_version_bodies:
+            return "content"
+        return "content.body.view"
+
+    def _get_content_search_params(self, date: datetime.date, spaces=None, end_date: datetime.date = None):
+        # Only the fields read by _to_content_info are expanded. The mime type is only needed for attachments.
+        expand = ["content.version.number"]
+        if self.content_filter.includes_attachments():
+            expand.append("content.metadata.mediatype")
+        return {
+            "expand": expand,
+            "includeArchivedSpaces": self.content_filter.include_archived_spaces,
+            "limit": self._search_page_size,
+            "cql": f"{self._get_content_cql(date, spaces, end_date)} order by lastModified,created asc"
+        }
 
-            yield ContentInfo(content_id, content["type"], latest_version, title, space, mime_type)
-
-    def get_versions(self, content_info: ContentInfo) -> Iterable[VersionInfo]:
-        for v in list(self._client.paginated_get(f"content/{content_info.id}/version", {"expand": "content.body.view"}))[::-1]:
-            by = v["by"].get("email")
-            if not by:
-                by = v["by"].get("displayName")
-
-            if content_info.type == "attachment":
-                download = v["content"]["_links"].get("download")
-                if not download:
-                    continue
+    def _get_content_count_params(self, date: datetime.date, spaces=None, end_date: datetime.date = None):
+        # Only the totalSize of the response is used.
+        return {"includeArchivedSpaces": self.content_filter.include_archived_spaces, "limit": 1,
+                "cql": self._get_content_cql(date, spaces, end_date)}
 
-                url = self._wiki_url + download
-                if v["content"]["extensions"]["fileSize"] > self.max_attachment_size:
-                    logging.warning(f"Attachment too big. Skipping {url}")
-                    continue
+    def _get_content_cql(self, date: datetime.date, spaces=None, end_date: datetime.date = None):
+        date_string = date.strftime("%Y-%m-%d")
+        if end_date is None or end_date == date:
+            cql = f"lastModified={date_string} or created={date_string}"
+        else:
+            next_date_string = (end_date + datetime.timedelta(days=1)).strftime("%Y-%m-%d")
+            cql = (f'(lastModified >= "{date_string}" and lastModified < "{next_date_string}") or '
+                   f'(created >= "{date_string}" and created < "{next_date_string}")')
+        filter_cql = self.content_filter.get_cql(spaces)
+        if filter_cql:
+            cql = f"({cql}) and {filter_cql}"
+        return cql
 
-                yield VersionInfo(v["number"], by, lambda: self._client.get_file(url), url)
-            else:
-                url = f"{self._wiki_url}/pages/viewpage.action?pageId={content_info.id}&pageVersion={v['number']}"
-                yield VersionInfo(v["number"], by, lambda: v["content"]["body"]["view"]["value"], url)
+    @staticmethod
+    def _get_content_params():
+        return {"expand": "version,space,metadata.mediatype"}
+
+    def _content_to_content_info(self, content, spaces=None) -> Optional[ContentInfo]:
+        if not content or content.get("status", "current") != "current":
+            return None
+        space = SpaceInfo(content["space"]["key"], content["space"]["name"])
+        if not self.content_filter.includes_content(space.key, content["type"], spaces):
+            return None
+        return self._create_content_info(content, content.get("title", ""), space)
+
+    def _to_content_info(self, r):
+        content = r.get("content")
+        result_global_container = r.get("resultGlobalContainer")
+        if not content or not result_global_container:
+            return None
+
+        space = SpaceInfo(result_global_container["displayUrl"].split("/")[-1], result_global_container["title"])
+        return self._create_content_info(content, ConfluenceRepository._extract_title(r), space)
+
+    def _create_content_info(self, content, title, space: SpaceInfo) -> Optional[ContentInfo]:
+        content_id = content["id"]
+        latest_version = content["version"]["number"]
+
+        mime_type = None
+        if content["type"] == "attachment":
+            mime_type = ConfluenceRepository._extract_mime_type(content, title)
+            if not self.content_filter.includes_mime_type(mime_type):
+                logging.debug(f"Content type {mime_type} excluded. Skipping attachment {title}")
+                return None
+            if not mime_type.startswith("text/") and mime_type not in self.supported_attachment_types:
+                if not mime_type.startswith("image/"):
+                    logging.warning(f"Content type {mime_type} not supported. Skipping attachment {title}")
+                return None
+
+        return ContentInfo(content_id, content["type"], latest_version, title, space, mime_type)
+
+    def _to_version_info(self, content_info: ContentInfo, v):
+        by = v["by"].get("email")
+        if not by:
+            by = v["by"].get("displayName")
+
+        if content_info.type == "attachment":
+            download = v["content"]["_links"].get("download")
+            if not download:
+                return None
+
+            url = self._wiki_url + download
+            if v["content"]["extensions"]["fileSize"] > self.max_attachment_size:
+                logging.warning(f"Attachment too big. Skipping {url}")
+                return None
+
+            return VersionInfo(v["number"], by, lambda: self._client.get_file(url, self.max_attachment_size), url)
+
+        url = f"{self._wiki_url}/pages/viewpage.action?pageId={content_info.id}&pageVersion={v['number']}"
+        # The accessors only hold what they need rather than the whole version, which holds the body.
+        version_number = v["number"]
+        if self.lazy_version_bodies:
+            return VersionInfo(version_number, by, lambda: self._get_version_body(content_info, version_number), url)
+        body = v["content"].pop("body")["view"]["value"]
+        return VersionInfo(version_number, by, lambda: body, url)
+
+    def _get_version_body(self, content_info: ContentInfo, version_number):
+        v = self._client.get(f"content/{content_info.id}/version/{version_number}", {"expand": "content.body.view"})
+        return v["content"]["body"]["view"]["value"] if v else None
 
     @staticmethod
     def _extract_title(data):
@@ -85,8 +222,8 @@ class ConfluenceRepository:
         return data.get("resultParentContainer", {}).get("title", "")
 
     @staticmethod
-    def _extract_mime_type(data, title):
-        mime = data["content"]["metadata"]["mediaType"]
+    def _extract_mime_type(content, title):
+        mime = content["metadata"]["mediaType"]
         if mime == "application/octet-stream":
             title_mime_type = get_mime_type_from_file_name(title)
             if title_mime_type:
@@ -0,0 +1,48 @@
+from fnmatch import fnmatchcase
+from typing import List, Optional
+
+
+class ContentFilter(object):
+    """
+    Spaces, content types and attachment mime types to crawl or to skip, on top of the spaces given to each search.
+    Spaces and types are filtered by the CQL query so that the search only returns the contents to crawl. CQL has no
+    mime type field, so mime types are filtered on the search results, before the versions are listed. Mime types may
+    hold wildcards such as image/*. Empty lists do not filter.
+    """
+
+    def __init__(self, exclude_spaces: Optional[List[str]] = None, types: Optional[List[str]] = None, exclude_types: Optional[List[str]] = None,
+                 mime_types: Optional[List[str]] = None, exclude_mime_types: Optional[List[str]] = None, include_archived_spaces=True):
+        self.exclude_spaces = exclude_spaces or []
+        self.types = types or []
+        self.exclude_types = exclude_types or []
+        self.mime_types = mime_types or []
+        self.exclude_mime_types = exclude_mime_types or []
+        self.include_archived_spaces = include_archived_spaces
+
+    def get_cql(self, spaces=None) -> str:
+        """Returns the CQL clauses restricting the search to the given spaces and to the spaces and types of the filter."""
+        clauses = []
+        for field, values, operator in [("space", spaces, "in"), ("space", self.exclude_spaces, "not in"),
+                                        ("type", self.types, "in"), ("type", self.exclude_types, "not in")]:
+            if values:
+                clauses.append(f"{field} {operator} ({','.join(_quote(v) for v in values)})")
+        return " and ".join(clauses)
+
+    def includes_content(self, space_key, content_type, spaces=None) -> bool:
+        """Returns whether the filter, and the given spaces, include a content found without a search."""
+        if spaces and space_key not in spaces or space_key in self.exclude_spaces:
+            return False
+        return (not self.types or content_type in self.types) and content_type not in self.exclude_types
+
+    def includes_attachments(self) -> bool:
+        return (not self.types or "attachment" in self.types) and "attachment" not in self.exclude_types
+
+    def includes_mime_type(self, mime_type) -> bool:
+        if self.mime_types and not any(fnmatchcase(mime_type, m) for m in self.mime_types):
+            return False
+        return not any(fnmatchcase(mime_type, m) for m in self.exclude_mime_types)
+
+
+def _quote(value) -> str:
+    escaped = str(value).replace("\\", "\\\\").replace('"', '\\"')
+    return f'"{escaped}"'
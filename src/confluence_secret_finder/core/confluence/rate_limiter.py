@@ -0,0 +1,98 @@
+import datetime
+import email.utils
+import logging
+import threading
+import time
+
+import dateutil.parser
+
+from ..metrics import metrics
+
+
+class RateLimiter(object):
+    """
+    Token bucket shared by every thread using a client. The rate is halved when Confluence answers with a 429 or
+    reports that we are near the limit and slowly grows back while requests succeed. Retry-After and
+    X-RateLimit-Reset pause every caller until the given time.
+    """
+    _increase_step = 0.1
+    _min_rate = 0.2
+
+    def __init__(self, rate, burst=None):
+        self._max_rate = rate
+        self._rate = rate
+        self._burst = burst or max(1.0, rate)
+        self._tokens = self._burst
+        self._last_refill = time.monotonic()
+        self._blocked_until = 0.0
+        self._lock = threading.Lock()
+
+    @property
+    def rate(self):
+        return self._rate
+
+    def acquire(self):
+        wait = self.reserve()
+        if wait > 0:
+            metrics.inc("confluence_rate_limit_wait_seconds_total", wait)
+            time.sleep(wait)
+
+    def reserve(self) -> float:
+        """Reserves a request slot and returns the number of seconds the caller must wait before sending it."""
+        with self._lock:
+            now = time.monotonic()
+            self._refill(now)
+            self._tokens -= 1
+            return max(self._blocked_until - now, -self._tokens / self._rate, 0.0)
+
+    def update(self, status_code, headers):
+        retry_after = self.get_retry_after(headers)
+        near_limit = headers.get("X-RateLimit-NearLimit", "").lower() == "true"
+        remaining = headers.get("X-RateLimit-Remaining")
+
+        with self._lock:
+            now = time.monotonic()
+            self._refill(now)
+            if status_code == 429 or remaining == "0":
+                self._set_rate(self._rate / 2)
+                self._tokens = min(self._tokens, 0.0)
+                self._blocked_until = max(self._blocked_until, now + (retry_after if retry_after is not None else 1 / self._rate))
+            elif near_limit:
+                self._set_rate(self._rate * 0.75)
+            elif status_code < 400:
+                self._set_rate(self._rate + self._increase_step)
+
+    @staticmethod
+    def get_retry_after(headers):
+        retry_after = headers.get("Retry-After")
+        if retry_after:
+            try:
+                return max(float(retry_after), 0.0)
+            except ValueError:
+                try:
+                    retry_date = email.utils.parsedate_to_datetime(retry_after)
+                    return max((retry_date - datetime.datetime.now(datetime.timezone.utc)).total_seconds(), 0.0)
+                except (TypeError, ValueError):
+                    pass
+
+        reset = headers.get("X-RateLimit-Reset")
+        if reset:
+            try:
+                reset_date = dateutil.parser.isoparse(reset)
+                if not reset_date.tzinfo:
+                    reset_date = reset_date.replace(tzinfo=datetime.timezone.utc)
+                return max((reset_date - datetime.datetime.now(datetime.timezone.utc)).total_seconds(), 0.0)
+            except ValueError:
+                logging.debug(f"Could not parse X-RateLimit-Reset header {reset}.")
+
+        return None
+
+    def _set_rate(self, rate):
+        rate = min(max(rate, self._min_rate), self._max_rate)
+        if rate != self._rate:
+            logging.debug(f"Request rate adjusted to {rate:.2f}/s.")
+        self._rate = rate
+
+    def _refill(self, now):
+        self._tokens = min(self._burst, self._tokens + (now - self._last_refill) * self._rate)
+        self._last_refill = now
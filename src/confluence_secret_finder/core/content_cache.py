@@ -0,0 +1,87 @@
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import zlib
+from typing import Callable, List, Optional, Tuple
+
+from .metrics import metrics
+from .model import ContentInfo
+from .spooled_file import iter_chunks
+
+
+class ContentCache(object):
+    """
+    Extracted text and secrets of version contents, addressed by a hash of the raw bytes or HTML and of the scanning
+    configuration. Identical contents found in other versions or pages skip extraction and scanning. Holds at most
+    max_entries entries and evicts the least recently used ones. The text and the secrets are stored in plaintext.
+    Writes are grouped in transactions committed every batch_size writes and on close, like the crawl cache. Safe to
+    use from several threads.
+    """
+    _batch_size = 1000
+
+    def __init__(self, file_name, get_fingerprint: Callable[[], str], max_entries=10000):
+        self.file_name = file_name
+        # The fingerprint of the scanning configuration loads the secret plugins so it is only computed once needed.
+        self._get_fingerprint = get_fingerprint
+        self._fingerprint = None
+        self._max_entries = max_entries
+        self._pending_writes = 0
+        self._lock = threading.Lock()
+        self._connection = sqlite3.connect(file_name, check_same_thread=False)
+        self._connection.execute("PRAGMA journal_mode=WAL")
+        self._connection.execute("PRAGMA synchronous=NORMAL")
+        self._connection.execute("CREATE TABLE IF NOT EXISTS content (key TEXT PRIMARY KEY, last_used INTEGER, text BLOB, secrets TEXT)")
+        self._connection.execute("CREATE INDEX IF NOT EXISTS content_last_used ON content (last_used)")
+        self._clock = self._connection.execute("SELECT COALESCE(MAX(last_used), 0) FROM content").fetchone()[0]
+        self._connection.commit()
+
+    def close(self):
+        with self._lock:
+            self._commit()
+            self._connection.close()
+
+    def get_key(self, content_info: ContentInfo, data) -> str:
+        if self._fingerprint is None:
+            self._fingerprint = self._get_fingerprint()
+        h = hashlib.sha256()
+        # The extraction depends on the type of the content and on the extension of attachments.
+        extension = os.path.splitext(content_info.title)[1].lower() if content_info.type == "attachment" else ""
+        h.update(f"{self._fingerprint}\n{content_info.type}\n{content_info.mime_type}\n{extension}\n".encode("utf-8"))
+        for chunk in iter_chunks(data):
+            h.update(chunk)
+        return h.hexdigest()
+
+    def get(self, key) -> Optional[Tuple[List[str], List[str]]]:
+        """Returns the lines and the secrets of the content with the given key, if they were cached."""
+        with self._lock:
+            row = self._connection.execute("SELECT text, secrets FROM content WHERE key = ?", (key,)).fetchone()
+            if not row:
+                return None
+            self._clock += 1
+            self._connection.execute("UPDATE content SET last_used = ? WHERE key = ?", (self._clock, key))
+            self._written()
+
+        text = zlib.decompress(row[0]).decode("utf-8")
+        return text.split("\n") if text else [], json.loads(row[1])
+
+    def set(self, key, lines: List[str], secrets: List[str]):
+        text = zlib.compress("\n".join(lines).encode("utf-8"))
+        with self._lock:
+            self._clock += 1
+            self._connection.execute("INSERT OR REPLACE INTO content (key, last_used, text, secrets) VALUES (?, ?, ?, ?)",
+                                     (key, self._clock, text, json.dumps(sorted(secrets))))
+            self._connection.execute("DELETE FROM content WHERE key IN (SELECT key FROM content ORDER BY last_used DESC LIMIT -1 OFFSET ?)",
+                                     (self._max_entries,))
+            self._written()
+
+    def _written(self):
+        self._pending_writes += 1
+        if self._pending_writes >= self._batch_size:
+            self._commit()
+
+    def _commit(self):
+        with metrics.time("cache_commit_seconds", database="content"):
+            self._connection.commit()
+        self._pending_writes = 0
@@ -0,0 +1,139 @@
+import multiprocessing
+import os
+import queue
+import signal
+import threading
+from typing import List, Optional, Tuple
+
+from .text_extractor import process_with_textract
+
+try:
+    import resource
+except ImportError:  # Not available on Windows, where memory limits are not enforced.
+    resource = None
+
+
+class ExtractionError(Exception):
+    pass
+
+
+class ExtractionPool(object):
+    """
+    Persistent worker processes running textract. Each attachment is extracted by one worker with a timeout and a
+    memory limit inherited by the tools textract starts. A worker exceeding its timeout or dying is killed with the
+    tools it started, replaced and the attachment is reported with an ExtractionError. Workers are started on the
+    first attachment.
+    """
+    _poll_interval = 0.5
+
+    def __init__(self, workers=1, timeout=300, max_memory=None):
+        self._workers = max(1, workers)
+        self._timeout = timeout
+        self._max_memory = max_memory * 1024 * 1024 if max_memory else None  # MB to B
+        # Spawned rather than forked since the crawler process runs many threads.
+        self._context = multiprocessing.get_context("spawn")
+        self._idle = queue.Queue()
+        self._started = 0
+        self._lock = threading.Lock()
+        self._closed = False
+
+    def close(self):
+        with self._lock:
+            self._closed = True
+        while True:
+            try:
+                self._idle.get_nowait().kill()
+            except queue.Empty:
+                break
+
+    def extract(self, path: str, extensions: List[str], name="") -> Tuple[Optional[str], List[str]]:
+        """
+        Returns the text extracted from a file by the first extension supported by textract and the errors of the
+        others. The file is read by the worker, only its path is sent.
+        """
+        worker = self._acquire()
+        try:
+            try:
+                worker.connection.send((path, extensions))
+                if not worker.connection.poll(self._timeout):
+                    self._discard(worker)
+                    worker = None
+                    raise ExtractionError(f"Extraction of {name} took more than {self._timeout} seconds. The worker was killed.")
+                return worker.connection.recv()
+            except (EOFError, OSError):
+                self._discard(worker)
+                exit_code = worker.process.exitcode
+                worker = None
+                raise ExtractionError(f"Extraction worker died with exit code {exit_code} while extracting {name}.")
+        finally:
+            if worker:
+                self._release(worker)
+
+    def _acquire(self) -> "_Worker":
+        with self._lock:
+            if self._closed:
+                raise ExtractionError("The extraction pool is closed.")
+            start = self._idle.empty() and self._started < self._workers
+            if start:
+                self._started += 1
+
+        if start:
+            try:
+                return _Worker(self._context, self._max_memory)
+            except BaseException:
+                with self._lock:
+                    self._started -= 1
+                raise
+
+        while True:
+            try:
+                return self._idle.get(timeout=self._poll_interval)
+            except queue.Empty:
+                if self._closed:
+                    raise ExtractionError("The extraction pool is closed.")
+
+    def _release(self, worker: "_Worker"):
+        with self._lock:
+            if not self._closed and worker.process.is_alive():
+                self._idle.put(worker)
+                return
+        self._discard(worker)
+
+    def _discard(self, worker: "_Worker"):
+        """Kills a worker so that the next attachment starts a new one."""
+        worker.kill()
+        with self._lock:
+            self._started -= 1
+
+
+class _Worker(object):
+    def __init__(self, context, max_memory):
+        self.connection, child_connection = context.Pipe()
+        self.process = context.Process(target=_run_worker, args=(child_connection, max_memory), daemon=True)
+        self.process.start()
+        child_connection.close()
+
+    def kill(self):
+        if self.process.is_alive():
+            try:
+                # The worker leads its own process group so that the tools started by textract are killed as well.
+                os.killpg(self.process.pid, signal.SIGKILL)
+            except (AttributeError, OSError):
+                self.process.kill()
+        self.process.join()
+        self.connection.close()
+
+
+def _run_worker(connection, max_memory):
+    if hasattr(os, "setpgrp"):
+        os.setpgrp()
+    if max_memory and resource:
+        resource.setrlimit(resource.RLIMIT_AS, (max_memory, max_memory))
+
+    while True:
+        try:
+            path, extensions = connection.recv()
+        except EOFError:
+            return
+        text, errors = process_with_textract(path, extensions)
+        connection.send((text, [str(e) for e in errors]))
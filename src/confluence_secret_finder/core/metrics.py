@@ -0,0 +1,172 @@
+import json
+import logging
+import sys
+import threading
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+
+# Upper bounds in seconds of the latency histograms, those of the Prometheus clients.
+_BUCKETS = [0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, float("inf")]
+
+# Type and description of every metric.
+_DESCRIPTIONS = {
+    "confluence_requests_total": ("counter", "Requests sent to Confluence by status code, or error when no response was received."),
+    "confluence_request_seconds": ("histogram", "Duration of the requests sent to Confluence."),
+    "confluence_retries_total": ("counter", "Requests sent again after an error or a rate limit."),
+    "confluence_rate_limited_total": ("counter", "Requests answered with a 429."),
+    "confluence_rate_limit_wait_seconds_total": ("counter", "Time spent waiting for the rate limiter or for Retry-After."),
+    "confluence_downloaded_bytes_total": ("counter", "Bytes of the successful responses."),
+    "extraction_seconds": ("histogram", "Time spent extracting the text of a version by mime type. Pages are text/html."),
+    "scan_seconds": ("histogram", "Time spent scanning the text of a version for secrets."),
+    "versions_scanned_total": ("counter", "Versions scanned for secrets, including those found in the content cache."),
+    "duplicate_versions_total": ("counter", "Versions skipped since an earlier version of the content had the same body."),
+    "content_cache_hits_total": ("counter", "Versions whose text and secrets were found in the content cache."),
+    "secrets_found_total": ("counter", "Secrets found in a version, before removing those of the previous versions."),
+    "webhook_events_total": ("counter", "Webhooks received by event."),
+    "archive_bytes_total": ("counter", "Compressed bytes of extracted text appended to the archive."),
+    "cache_commit_seconds": ("histogram", "Duration of the sqlite commits of the crawl state, of the content cache or of the archive index."),
+}
+
+
+class Metrics(object):
+    """Thread safe counters and latency histograms with labels, exposed in the Prometheus text format or as a dict."""
+
+    def __init__(self):
+        self._counters = {}
+        self._histograms = {}
+        self._lock = threading.Lock()
+
+    def inc(self, name, value=1, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + value
+
+    def observe(self, name, value, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            histogram = self._histograms.get(key)
+            if histogram is None:
+                histogram = self._histograms[key] = [[0] * len(_BUCKETS), 0.0]
+            histogram[0][bisect_left(_BUCKETS, value)] += 1
+            histogram[1] += value
+
+    @contextmanager
+    def time(self, name, **labels):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(name, time.perf_counter() - start, **labels)
+
+    def reset(self):
+        with self._lock:
+            self._counters.clear()
+            self._histograms.clear()
+
+    def to_dict(self) -> dict:
+        """Returns the counters and the count and sum of each histogram, the labels being appended to the names."""
+        with self._lock:
+            stats = {_format_name(name, labels): value for (name, labels), value in sorted(self._counters.items())}
+            for (name, labels), (buckets, total) in sorted(self._histograms.items()):
+                stats[_format_name(f"{name}_count", labels)] = sum(buckets)
+                stats[_format_name(f"{name}_sum", labels)] = round(total, 6)
+        return stats
+
+    def to_prometheus(self) -> str:
+        with self._lock:
+            counters = sorted(self._counters.items())
+            histograms = sorted((key, (list(buckets), total)) for key, (buckets, total) in self._histograms.items())
+
+        lines = []
+        for name, (metric_type, description) in _DESCRIPTIONS.items():
+            lines.extend([f"# HELP {name} {description}", f"# TYPE {name} {metric_type}"])
+            for (n, labels), value in counters:
+                if n == name:
+                    lines.append(f"{_format_name(name, labels)} {value}")
+            for (n, labels), (buckets, total) in histograms:
+                if n != name:
+                    continue
+                count = 0
+                for bound, bucket in zip(_BUCKETS, buckets):
+                    count += bucket
+                    le = "+Inf" if bound == float("inf") else repr(bound)
+                    lines.append(f"{_format_name(f'{name}_bucket', labels + (('le', le),))} {count}")
+                lines.append(f"{_format_name(f'{name}_count', labels)} {count}")
+                lines.append(f"{_format_name(f'{name}_sum', labels)} {total}")
+        return "\n".join(lines) + "\n"
+
+
+def _format_name(name, labels) -> str:
+    if not labels:
+        return name
+    values = ",".join('{}="{}"'.format(k, str(v).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")) for k, v in labels)
+    return f"{name}{{{values}}}"
+
+
+# Metrics of the process. Each crawler process started by the shards has its own.
+metrics = Metrics()
+
+
+class MetricsServer(object):
+    """Serves the metrics at /metrics in the Prometheus text format from a background thread. Only listens on localhost by default."""
+
+    def __init__(self, port, address="127.0.0.1", registry: Metrics = None):
+        from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+        registry = registry or metrics
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path.split("?")[0] not in ["/", "/metrics"]:
+                    self.send_error(404)
+                    return
+                body = registry.to_prometheus().encode("utf-8")
+                self.send_response(200)
+                self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, *args):
+                pass
+
+        self._server = ThreadingHTTPServer((address, port), Handler)
+        self._server.daemon_threads = True
+        self._thread = threading.Thread(target=self._server.serve_forever, name="metrics-server", daemon=True)
+
+    def __enter__(self):
+        self._thread.start()
+        logging.info(f"Serving metrics on {self._server.server_address[0]} port {self._server.server_address[1]}.")
+        return self
+
+    def __exit__(self, *args):
+        self._server.shutdown()
+        self._server.server_close()
+
+
+class StatsReporter(object):
+    """Writes the metrics as a JSON line to stderr every interval seconds and once more when the crawl ends."""
+
+    def __init__(self, interval, registry: Metrics = None, output=None):
+        self._interval = interval
+        self._registry = registry or metrics
+        self._output = output or sys.stderr
+        self._stopped = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="stats-reporter", daemon=True)
+
+    def __enter__(self):
+        self._thread.start()
+        return self
+
+    def __exit__(self, *args):
+        self._stopped.set()
+        self._thread.join()
+        self.report()
+
+    def report(self):
+        stats = dict(time=time.strftime("%Y-%m-%dT%H:%M:%S"), **self._registry.to_dict())
+        print(json.dumps(stats), file=self._output, flush=True)
+
+    def _run(self):
+        while not self._stopped.wait(self._interval):
+            self.report()
@@ -2,4 +2,5 @@ from .version_info import VersionInfo
 from .content_info import ContentInfo
 from .space_info import SpaceInfo
 from .version_secrets import VersionSecrets
-from .content_crawl_history import ContentCrawlHistory
+from .content_crawl_history import ContentCrawlHistory, hash_secret
+from .content_crawl_result import ContentCrawlResult
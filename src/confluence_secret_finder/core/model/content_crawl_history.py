@@ -1,4 +1,28 @@
+import hashlib
+from typing import Iterable, List
+
+
+def hash_secret(content_id, secret) -> bytes:
+    """Returns the hash saved in the crawl history in place of a secret found in a content."""
+    return hashlib.blake2b(f"{content_id}:{secret}".encode("utf-8"), digest_size=16).digest()
+
+
 class ContentCrawlHistory(object):
-    def __init__(self):
-        self.latest_version = 0
-        self.secrets = []
+    __slots__ = ("latest_version", "secret_hashes", "body_hashes")
+
+    def __init__(self, latest_version=0, secret_hashes=None, body_hashes=None):
+        self.latest_version = latest_version
+        # Hashes of the secrets already found, so that the plaintext secrets are not kept.
+        self.secret_hashes = secret_hashes if secret_hashes is not None else set()
+        # Hashes of the bodies of the versions already scanned.
+        self.body_hashes = body_hashes if body_hashes is not None else set()
+
+    def add_secrets(self, content_id, secrets: Iterable[str]) -> List[str]:
+        """Adds the secrets found in a version of the content and returns those that were not found before."""
+        new_secrets = []
+        for secret in secrets:
+            h = hash_secret(content_id, secret)
+            if h not in self.secret_hashes:
+                self.secret_hashes.add(h)
+                new_secrets.append(secret)
+        return new_secrets
@@ -0,0 +1,7 @@
+class ContentCrawlResult(object):
+    __slots__ = ("content", "versions")
+
+    def __init__(self, content, versions):
+        self.content = content
+        # Versions holding secrets, each with the hashes of its secrets rather than the plaintext secrets.
+        self.versions = versions
@@ -2,6 +2,8 @@ from .space_info import SpaceInfo
 
 
 class ContentInfo(object):
+    __slots__ = ("mime_type", "space", "type", "title", "latest_version", "id")
+
     def __init__(self, content_id, content_type, latest_version, title, space: SpaceInfo, mime_type):
         self.mime_type = mime_type
         self.space = space
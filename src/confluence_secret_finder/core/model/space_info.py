@@ -1,4 +1,6 @@
 class SpaceInfo(object):
+    __slots__ = ("key", "name")
+
     def __init__(self, key, name):
         self.key = key
         self.name = name
@@ -1,4 +1,6 @@
 class VersionInfo(object):
+    __slots__ = ("url", "_content_accessor", "by", "id")
+
     def __init__(self, version_id, by, content_accessor, url):
         self.url = url
         self._content_accessor = content_accessor
@@ -6,7 +8,9 @@ class VersionInfo(object):
         self.id = version_id
 
     def get_content(self):
-        return self._content_accessor()
+        """Returns the content of the version, once. The accessor is dropped so that the version no longer holds the body."""
+        content_accessor, self._content_accessor = self._content_accessor, None
+        return content_accessor() if content_accessor else None
 
     def __str__(self):
         return f"{self.url} - {self.by}"
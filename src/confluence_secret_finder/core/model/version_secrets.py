@@ -1,4 +1,6 @@
 class VersionSecrets(object):
+    __slots__ = ("secrets", "version", "content")
+
     def __init__(self, content, version, secrets):
         self.secrets = secrets
         self.version = version
@@ -0,0 +1,225 @@
+import bz2
+import csv
+import gzip
+import hashlib
+import io
+import json
+import logging
+import lzma
+import sys
+import time
+from abc import ABC, abstractmethod
+from typing import List
+
+from .model import VersionSecrets
+
+OUTPUT_FORMATS = ["text", "jsonl", "sarif", "csv"]
+
+# gzip uses the default level of zlib rather than the slowest one.
+_COMPRESSED_OPENERS = {".gz": lambda file_name: gzip.open(file_name, "wt", compresslevel=6, encoding="utf-8"),
+                       ".bz2": lambda file_name: bz2.open(file_name, "wt", encoding="utf-8"),
+                       ".xz": lambda file_name: lzma.open(file_name, "wt", encoding="utf-8")}
+
+# Columns of the CSV output, one row per secret, with the attribute of the VersionSecrets they are read from.
+_CSV_FIELDS = [("space_key", lambda s: s.content.space.key), ("space_name", lambda s: s.content.space.name),
+               ("content_id", lambda s: s.content.id), ("content_type", lambda s: s.content.type), ("title", lambda s: s.content.title),
+               ("mime_type", lambda s: s.content.mime_type), ("latest_version", lambda s: s.content.latest_version),
+               ("version", lambda s: s.version.id), ("by", lambda s: s.version.by), ("url", lambda s: s.version.url)]
+
+_SARIF_RULE_ID = "confluence-secret"
+
+
+def version_secrets_to_dict(version_secrets: VersionSecrets) -> dict:
+    """Returns the JSON output of a VersionSecrets, with the keys in the order of its attributes."""
+    version = version_secrets.version
+    content = version_secrets.content
+    return {"secrets": list(version_secrets.secrets),
+            "version": {"url": version.url, "by": version.by, "id": version.id},
+            "content": {"mime_type": content.mime_type, "space": {"key": content.space.key, "name": content.space.name},
+                        "type": content.type, "title": content.title, "latest_version": content.latest_version, "id": content.id}}
+
+
+class OutputWriter(ABC):
+    """
+    Formats the secrets found and writes them to a text stream in batches. The batch is written once batch_size
+    results are buffered, when a result arrives flush_interval seconds after the previous write, and on close.
+    """
+    content_type = "text/plain"
+
+    def __init__(self, stream, batch_size=100, flush_interval=1.0):
+        self._stream = stream
+        self._batch_size = max(1, batch_size)
+        self._flush_interval = flush_interval
+        self._buffer = []
+        self._buffered = 0
+        self._last_flush = time.monotonic()
+        self._buffer.append(self.header())
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def write(self, version_secrets: VersionSecrets):
+        self._buffer.append(self.format(version_secrets))
+        self._buffered += 1
+        if self._buffered >= self._batch_size or time.monotonic() - self._last_flush >= self._flush_interval:
+            self.flush()
+
+    def flush(self):
+        if any(self._buffer):
+            self._stream.write("".join(self._buffer))
+            self._stream.flush()
+        self._buffer = []
+        self._buffered = 0
+        self._last_flush = time.monotonic()
+
+    def close(self):
+        self._buffer.append(self.footer())
+        self.flush()
+        if self._stream not in [sys.stdout, sys.stderr]:
+            self._stream.close()
+
+    def header(self) -> str:
+        return ""
+
+    def footer(self) -> str:
+        return ""
+
+    @abstractmethod
+    def format(self, version_secrets: VersionSecrets) -> str:
+        return ""
+
+
+class TextWriter(OutputWriter):
+    def format(self, version_secrets: VersionSecrets) -> str:
+        return f"{version_secrets.content.space}): {version_secrets.version}: {version_secrets.secrets}\n"
+
+
+class JsonLinesWriter(OutputWriter):
+    content_type = "application/x-ndjson"
+
+    def format(self, version_secrets: VersionSecrets) -> str:
+        return json.dumps(version_secrets_to_dict(version_secrets)) + "\n"
+
+
+class CsvWriter(OutputWriter):
+    """Writes a row per secret."""
+    content_type = "text/csv"
+
+    def __init__(self, *args, **kwargs):
+        self._rows = io.StringIO()
+        self._csv_writer = csv.writer(self._rows)
+        super(CsvWriter, self).__init__(*args, **kwargs)
+
+    def header(self) -> str:
+        self._csv_writer.writerow([name for name, _ in _CSV_FIELDS] + ["secret"])
+        return self._pop_rows()
+
+    def format(self, version_secrets: VersionSecrets) -> str:
+        values = [get(version_secrets) for _, get in _CSV_FIELDS]
+        self._csv_writer.writerows(values + [secret] for secret in version_secrets.secrets)
+        return self._pop_rows()
+
+    def _pop_rows(self) -> str:
+        rows = self._rows.getvalue()
+        self._rows.seek(0)
+        self._rows.truncate()
+        return rows
+
+
+class SarifWriter(OutputWriter):
+    """
+    Writes a SARIF 2.1.0 log with a result per secret, located at the URL of the version. The results are streamed
+    between the header and the footer of the log, which is only valid once the writer is closed.
+    """
+    content_type = "application/sarif+json"
+
+    def __init__(self, *args, **kwargs):
+        self._results = 0
+        super(SarifWriter, self).__init__(*args, **kwargs)
+
+    def header(self) -> str:
+        driver = {"name": "confluence-secret-finder", "informationUri": "https://github.com/gsoft-inc/confluence-secret-finder",
+                  "rules": [{"id": _SARIF_RULE_ID, "shortDescription": {"text": "Secret found in a version of a Confluence page or attachment."}}]}
+        log = json.dumps({"version": "2.1.0", "$schema": "https://json.schemastore.org/sarif-2.1.0.json",
+                          "runs": [{"tool": {"driver": driver}, "results": []}]})
+        # The results are written inside the empty list.
+        return log[:-len("]}]}")]
+
+    def footer(self) -> str:
+        return "]}]}\n"
+
+    def format(self, version_secrets: VersionSecrets) -> str:
+        results = []
+        for secret in version_secrets.secrets:
+            results.append(json.dumps(self._to_result(version_secrets, secret)))
+        if not results:
+            return ""
+        separator = "," if self._results else ""
+        self._results += len(results)
+        return separator + ",".join(results)
+
+    @staticmethod
+    def _to_result(version_secrets: VersionSecrets, secret) -> dict:
+        content = version_secrets.content
+        version = version_secrets.version
+        return {"ruleId": _SARIF_RULE_ID, "level": "error",
+                "message": {"text": f"Secret found in version {version.id} of {content.title} by {version.by}."},
+                "locations": [{"physicalLocation": {"artifactLocation": {"uri": version.url}}}],
+                "partialFingerprints": {"secretHash/v1": hashlib.sha256(f"{content.id}:{secret}".encode("utf-8")).hexdigest()},
+                "properties": {"secret": secret, "space": content.space.key, "contentId": content.id, "contentType": content.type,
+                               "version": version.id, "by": version.by}}
+
+
+_WRITERS = {"text": TextWriter, "jsonl": JsonLinesWriter, "sarif": SarifWriter, "csv": CsvWriter}
+
+
+class PostStream(object):
+    """Text stream posting each write to a collector, for example a local log shipper. Failed posts are retried."""
+    _max_retries = 3
+
+    def __init__(self, url, content_type):
+        import requests
+        self._url = url
+        self._session = requests.Session()
+        self._session.headers.update({"Content-Type": content_type})
+
+    def write(self, text):
+        from requests import RequestException
+        body = text.encode("utf-8")
+        for retry in range(1, self._max_retries + 1):
+            try:
+                response = self._session.post(self._url, data=body, timeout=30)
+                if response.status_code < 300:
+                    return
+                message = f"status code {response.status_code}"
+            except RequestException as e:
+                message = str(e)
+            if retry < self._max_retries:
+                time.sleep(retry)
+        lines = body.count(b"\n")
+        logging.error(f"Could not post {lines} lines to {self._url}: {message}.")
+
+    def flush(self):
+        pass
+
+    def close(self):
+        self._session.close()
+
+
+def open_output(output_format, file_name=None, post_url=None, batch_size=100) -> List[OutputWriter]:
+    """
+    Returns the writers of the results: one in the given format to the file, compressed according to its extension,
+    or to stdout, and one posting batches of JSON lines to post_url if given.
+    """
+    if file_name and file_name != "-":
+        extension = next((e for e in _COMPRESSED_OPENERS if file_name.endswith(e)), None)
+        stream = _COMPRESSED_OPENERS[extension](file_name) if extension else open(file_name, "w", encoding="utf-8", newline="")
+    else:
+        stream = sys.stdout
+    writers = [_WRITERS[output_format](stream, batch_size)]
+    if post_url:
+        writers.append(JsonLinesWriter(PostStream(post_url, JsonLinesWriter.content_type), batch_size))
+    return writers
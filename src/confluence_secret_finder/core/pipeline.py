@@ -0,0 +1,61 @@
+from collections import deque
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Callable, Iterable, List, Tuple
+
+
+class Pipeline(object):
+    """
+    Runs items through a chain of stages. Each stage has its own thread pool so that slow I/O stages do not starve
+    CPU stages. At most max_in_flight items are processed at once and results are yielded in submission order.
+    """
+
+    def __init__(self, stages: List[Tuple[Callable, int]], max_in_flight=None):
+        self._stages = stages
+        self._max_in_flight = max_in_flight or max(1, 2 * sum(workers for _, workers in stages))
+        self._executors = []
+
+    def __enter__(self):
+        # Threads are named after their stage, as shown by the profiler.
+        self._executors = [ThreadPoolExecutor(max_workers=max(1, workers), thread_name_prefix=getattr(stage, "__name__", "stage").strip("_"))
+                           for stage, workers in self._stages]
+        return self
+
+    def __exit__(self, *args):
+        for e in self._executors:
+            e.shutdown(wait=True, cancel_futures=True)
+        self._executors = []
+
+    def map(self, items: Iterable) -> Iterable:
+        pending = deque()
+        for item in items:
+            pending.append(self._submit(item))
+            while len(pending) >= self._max_in_flight:
+                yield pending.popleft().result()
+
+        while pending:
+            yield pending.popleft().result()
+
+    def _submit(self, item) -> Future:
+        result = Future()
+        self._run_stage(0, item, result)
+        return result
+
+    def _run_stage(self, index, value, result: Future):
+        if index == len(self._stages):
+            result.set_result(value)
+            return
+
+        def on_done(f: Future):
+            try:
+                next_value = f.result()
+            except BaseException as e:
+                result.set_exception(e)
+                return
+            self._run_stage(index + 1, next_value, result)
+
+        try:
+            future = self._executors[index].submit(self._stages[index][0], value)
+        except RuntimeError as e:  # The executor was shut down while the item was in flight.
+            result.set_exception(e)
+            return
+        future.add_done_callback(on_done)
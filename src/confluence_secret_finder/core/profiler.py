@@ -0,0 +1,50 @@
+import logging
+import os
+import re
+import sys
+import threading
+from collections import Counter
+
+
+class Profiler(object):
+    """
+    Sampling profiler of every thread of the process. The stacks of the threads are recorded every interval seconds
+    and written in the collapsed format read by flamegraph.pl and speedscope, one line per distinct stack starting with
+    the thread name. Unlike cProfile, which only profiles the thread enabling it, it covers the pipeline threads and
+    shows where they wait, like HTTP responses or the rate limiter.
+    """
+
+    def __init__(self, file_name, interval=0.01):
+        self.file_name = file_name
+        self._interval = interval
+        self._samples = Counter()
+        self._stopped = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="profiler", daemon=True)
+
+    def __enter__(self):
+        self._thread.start()
+        return self
+
+    def __exit__(self, *args):
+        self._stopped.set()
+        self._thread.join()
+        with open(self.file_name, "w", encoding="utf-8") as f:
+            for stack, count in self._samples.most_common():
+                f.write(f"{';'.join(stack)} {count}\n")
+        logging.info(f"Wrote {sum(self._samples.values())} samples of the stacks of the threads to {self.file_name}.")
+
+    def _run(self):
+        own_id = threading.get_ident()
+        while not self._stopped.wait(self._interval):
+            # The workers of a thread pool are merged under the name of the pool.
+            thread_names = {t.ident: re.sub(r"_\d+$", "", t.name) for t in threading.enumerate()}
+            for thread_id, frame in sys._current_frames().items():
+                if thread_id == own_id:
+                    continue
+                stack = []
+                while frame is not None:
+                    code = frame.f_code
+                    stack.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})")
+                    frame = frame.f_back
+                stack.append(thread_names.get(thread_id, str(thread_id)))
+                self._samples[tuple(reversed(stack))] += 1
@@ -1,8 +1,19 @@
+import logging
 import re
 import os
 
+# Constructs that refer to other groups of the pattern or change the flags of the whole pattern. Patterns using them
+# keep their own regex since they would change meaning inside a combined alternation.
+_UNCOMBINABLE_REGEX = re.compile(r"\\[1-9]|\\g<|\(\?P=|\(\?\(|\(\?[aiLmsux]+\)")
+
 
 class Blacklist(object):
+    """
+    Case insensitive regexes that must match a whole value. Literal entries are looked up in a set and the others are
+    combined in a single alternation. Values already checked are remembered.
+    """
+    _memo_size = 100000
+
     def __init__(self, predefined_blacklist, blacklist_file=None):
         regex_strings = list(predefined_blacklist)
         if blacklist_file and os.path.exists(blacklist_file):
@@ -10,7 +21,44 @@ class Blacklist(object):
                 lines = (line.strip() for line in f.readlines())
                 regex_strings.extend(line for line in lines if line)
 
-        self.regexes = [re.compile(f"^{s}$", flags=re.I) for s in regex_strings]
+        self.patterns = regex_strings
+
+        # Case insensitive matching of ASCII literals is a comparison of the lowercase strings.
+        literals = {s for s in regex_strings if s and s.isascii() and re.escape(s) == s}
+        self._literals = {s.lower() for s in literals}
+        self._literal_regex = self._combine([s for s in regex_strings if s in literals])
+        self._regexes = self._combine([s for s in regex_strings if s not in literals])
+        self._memo = {}
 
     def matches(self, value):
-        return any(r for r in self.regexes if r.match(value))
+        matched = self._memo.get(value)
+        if matched is None:
+            matched = self._matches(value)
+            if len(self._memo) >= self._memo_size:
+                self._memo.clear()
+            self._memo[value] = matched
+        return matched
+
+    def _matches(self, value):
+        if value.isascii():
+            # Like $, the literals match before a trailing line break.
+            if (value[:-1] if value.endswith("\n") else value).lower() in self._literals:
+                return True
+        elif any(r.match(value) for r in self._literal_regex):
+            # Case insensitive regexes also match some non ASCII characters to ASCII ones, like the Kelvin sign to k.
+            return True
+        return any(r.match(value) for r in self._regexes)
+
+    @staticmethod
+    def _combine(regex_strings):
+        combinable = [s for s in regex_strings if not _UNCOMBINABLE_REGEX.search(s)]
+        regexes = [re.compile(f"^{s}$", flags=re.I) for s in regex_strings if _UNCOMBINABLE_REGEX.search(s)]
+        if combinable:
+            try:
+                # Each alternative keeps its own anchors since a pattern may hold a top level alternation.
+                regexes.insert(0, re.compile("|".join(f"(?:^{s}$)" for s in combinable), flags=re.I))
+            except re.error as e:
+                # For example, the same group name used in two patterns.
+                logging.debug(f"Could not combine the blacklist regexes: {e}")
+                regexes.extend(re.compile(f"^{s}$", flags=re.I) for s in combinable)
+        return regexes
@@ -1,8 +1,40 @@
 from abc import ABC, abstractmethod
-from typing import List
+from bisect import bisect_right
+from itertools import accumulate
+from typing import Iterable, List, Optional, Pattern, Set
 
 
 class BasePlugin(ABC):
+    # Matches every line the plugin could flag. Other lines are skipped, unless prefilter is disabled.
+    candidate_line_regex: Optional[Pattern] = None
+    prefilter = True
+
     @abstractmethod
     def find_secrets(self, lines: List[str]):
         return []
+
+    def find_secrets_in_documents(self, documents: Iterable[List[str]]) -> List[List[str]]:
+        """Returns the secrets of each document. Plugins override it when scanning documents together is faster."""
+        return [list(self.find_secrets(lines)) for lines in documents]
+
+    def get_config(self) -> List[str]:
+        """Returns everything that changes the secrets found by the plugin. Cached results are dropped when it changes."""
+        return [type(self).__name__]
+
+    def get_candidate_lines(self, lines: List[str]) -> Set[int]:
+        """Returns the indexes of the lines matched by candidate_line_regex, searching the whole document at once."""
+        if not self.prefilter or self.candidate_line_regex is None:
+            return set(range(len(lines)))
+
+        text = "\n".join(lines)
+        line_ends = list(accumulate(len(l) + 1 for l in lines))
+        candidates = set()
+        position = 0
+        while True:
+            m = self.candidate_line_regex.search(text, position)
+            if not m:
+                return candidates
+            index = bisect_right(line_ends, m.start())
+            candidates.add(index)
+            # A single match is enough, the search goes on at the next line.
+            position = line_ends[index]
@@ -13,13 +13,22 @@ class PasswordPatternPlugin(BasePlugin):
                  r"\d{2,4}(x\d{2,4})px", r"\d{3,4}px", r"\d{2,4}x\d{2,4}",
                  r"\d{1,2}(secs?|mins?|hours?|days?|weeks?|months?)", r"\d{1,2}min\d{1,2}s?",
                  r"ConsoleApp\d", r"\d{1,4}(k|m)bps", r"\d{1,4}ms", "KB\d+"]
+    # Passwords hold a digit.
+    candidate_line_regex = re.compile(r"\d")
 
-    def __init__(self):
+    def __init__(self, prefilter=True):
+        self.prefilter = prefilter
         self.password_regex = re.compile(r"(?:^|\s)(\w*(?:\d+[a-zA-Z]|[a-zA-Z]+\d)\w*!?)(?:$|\s)")
         self.blacklist = Blacklist(self.BLACKLIST)
 
+    def get_config(self) -> List[str]:
+        return super(PasswordPatternPlugin, self).get_config() + [self.password_regex.pattern] + self.blacklist.patterns
+
     def find_secrets(self, lines: List[str]):
-        for line in lines:
+        candidates = self.get_candidate_lines(lines)
+        for i, line in enumerate(lines):
+            if i not in candidates:
+                continue
             for m in self.password_regex.findall(line):
                 if not self.blacklist.matches(m):
                     yield m
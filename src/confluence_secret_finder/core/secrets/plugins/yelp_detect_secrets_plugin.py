@@ -1,36 +1,109 @@
 import re
-from typing import List
+import threading
+from typing import Iterable, List
 
-from detect_secrets import SecretsCollection
+from detect_secrets.__version__ import VERSION as DETECT_SECRETS_VERSION
 from detect_secrets.core.plugins.util import get_mapping_from_secret_type_to_class
-from detect_secrets.settings import transient_settings
+from detect_secrets.core.scan import get_filters_with_parameter
+from detect_secrets.settings import get_plugins, transient_settings
+from detect_secrets.util.code_snippet import get_code_snippet
 
 from .base_plugin import BasePlugin
 
+# Stands for the name of the scanned file, which detect_secrets passes to the filters.
+_FILE_NAME = "dummy"
+
 
 class YelpDetectSecretsPlugin(BasePlugin):
+    """
+    Scans lines with every detect_secrets plugin and the default filters. The plugins and filters are created once
+    since creating them costs more than scanning a page, and lines are scanned directly like detect_secrets scans the
+    added lines of a diff.
+    """
     PASSWORD_REPLACEMENTS = ["mot de passe", "mdp", "pwd"]
+    # Holds every line a detect_secrets plugin can flag with its default settings, matched after the replacements.
+    candidate_line_regex = re.compile("|".join([
+        r"\d",  # IP addresses, Slack, Telegram and Mailchimp tokens and most keys.
+        r"[0-9a-fA-F]{9}",  # Hex strings need 9 distinct characters to exceed the entropy limit of 3.
+        r"[\w+/=-]{20}",  # Keys, and base64 strings which need 23 distinct characters to exceed the entropy limit of 4.5.
+        r"AKC|AP[A-F]",  # Artifactory tokens.
+        r"://|eyJ|_authToken|PRIVATE KEY|PuTTY",  # URLs with credentials, JWTs, npm tokens and private keys.
+        r"(?i:key|pass|pw|secret|token|contrase)",  # Keywords of the keyword, AWS, IBM, Cloudant and Softlayer plugins.
+    ]))
+    # detect_secrets settings are global to the process so concurrent scans must not overlap.
+    _settings_lock = threading.Lock()
 
-    def __init__(self):
+    def __init__(self, prefilter=True):
+        self.prefilter = prefilter
         self.password_replacement_regex = re.compile("|".join(self.PASSWORD_REPLACEMENTS), flags=re.I)
-
-    def find_secrets(self, lines: List[str]):
-        secrets_collection = SecretsCollection()
-        with transient_settings({'plugins_used': [{'name': plugin_type.__name__} for plugin_type in
-                                                  get_mapping_from_secret_type_to_class().values()]}) as settings:
+        # Some detect_secrets plugins change their own state while scanning a line.
+        self._scan_lock = threading.Lock()
+        with self._settings_lock, transient_settings({'plugins_used': [{'name': plugin_type.__name__} for plugin_type in
+                                                                       get_mapping_from_secret_type_to_class().values()]}) as settings:
             settings.disable_filters(
                 'detect_secrets.filters.common.is_invalid_file',
             )
+            self._detectors = list(get_plugins())
+            self._line_filters = get_filters_with_parameter('line')
+            self._secret_filters = get_filters_with_parameter('secret')
+            self._context_filters = get_filters_with_parameter('context')
+
+    def get_config(self) -> List[str]:
+        return super(YelpDetectSecretsPlugin, self).get_config() + [DETECT_SECRETS_VERSION] + self.PASSWORD_REPLACEMENTS
+
+    def find_secrets(self, lines: List[str]):
+        with self._scan_lock:
+            secrets = self._find_secrets(lines)
+        return iter(secrets)
+
+    def find_secrets_in_documents(self, documents: Iterable[List[str]]) -> List[List[str]]:
+        with self._scan_lock:
+            return [self._find_secrets(lines) for lines in documents]
+
+    def _find_secrets(self, lines: List[str]) -> List[str]:
+        scanned_lines = [self.password_replacement_regex.sub("password", l) for l in lines]
+        # The lines of a diff keep their line break, which is part of the context given to the filters.
+        context_lines = [l + "\n" for l in scanned_lines[:-1]] + scanned_lines[-1:]
 
-            # Use scan_diff since scan_line seems broken.
-            line_diff = "\n".join("+" + l for l in lines)
-            line_diff = self.password_replacement_regex.sub("password", line_diff)
-            dummy_diff = f"--- dummy\n+++ dummy\n@@ -0,0 +1,{len(lines)} @@\n{line_diff}"
-            secrets_collection.scan_diff(dummy_diff)
+        # Like a detect_secrets SecretsCollection, only the first line holding a secret of a given type is kept.
+        found = {}
+        candidates = self.get_candidate_lines(scanned_lines)
+        for line_number, line in enumerate(scanned_lines, 1):
+            # Lines skipped by the prefilter are still part of the context of the others.
+            if line_number - 1 not in candidates:
+                continue
+            line = line.rstrip()
+            context = get_code_snippet(lines=context_lines, line_number=line_number)
+            if self._is_filtered_out(self._line_filters, filename=_FILE_NAME, line=line, context=context):
+                continue
 
-        for _, secret in secrets_collection:
+            for detector in self._detectors:
+                for secret in detector.analyze_line(filename=_FILE_NAME, line=line, line_number=line_number, context=context) or []:
+                    if secret in found:
+                        continue
+                    if self._is_filtered_out(self._secret_filters, filename=_FILE_NAME, secret=secret.secret_value, plugin=detector, line=line):
+                        continue
+                    if self._is_filtered_out(self._context_filters, filename=_FILE_NAME, secret=secret.secret_value, plugin=detector, line=line,
+                                             context=context):
+                        continue
+                    found[secret] = secret
+
+        secret_values = []
+        for secret in sorted(found, key=lambda s: (s.line_number, s.secret_hash, s.type)):
             # detect_secrets sometimes return a lowercase version of the secret. Find the real string.
             line = lines[secret.line_number - 1]
             secret_index = line.lower().find(secret.secret_value.lower())
-            secret_value = line[secret_index:secret_index + len(secret.secret_value)]
-            yield secret_value
+            secret_values.append(line[secret_index:secret_index + len(secret.secret_value)])
+        return secret_values
+
+    @staticmethod
+    def _is_filtered_out(filters, **kwargs) -> bool:
+        for f in filters:
+            try:
+                # Only the arguments declared by the filter are passed, as call_function_with_arguments does.
+                if f(**{k: v for k, v in kwargs.items() if k in f.injectable_variables}):
+                    return True
+            except TypeError:
+                # Like detect_secrets, skips the filters that do not accept these arguments.
+                pass
+        return False
@@ -1,21 +1,146 @@
+import hashlib
+import multiprocessing
+import pickle
+import threading
+from collections import deque
+from concurrent.futures import Future, ProcessPoolExecutor
+from itertools import chain
+from multiprocessing.shared_memory import SharedMemory
+from typing import Iterable, List
+
 from .blacklist import Blacklist
+from .plugins.base_plugin import BasePlugin
 from .plugins.password_pattern_plugin import PasswordPatternPlugin
-from .plugins.yelp_detect_secrets_plugin import YelpDetectSecretsPlugin
 
 
 class SecretFinder(object):
+    """
+    Finds the secrets of documents with every plugin. With processes, documents are scanned by a pool of worker
+    processes, each holding its own SecretFinder, and large documents are passed to them through shared memory.
+    """
     BLACKLIST = ["password", "%password%"]
+    MIN_SECRET_LENGTH = 6
+    _shared_memory_threshold = 1024 * 1024
 
-    def __init__(self, blacklist_file):
-        self._plugins = [PasswordPatternPlugin(), YelpDetectSecretsPlugin()]
+    def __init__(self, blacklist_file, processes=0, prefilter=True):
+        self._prefilter = prefilter
+        self._plugins = None
+        self._plugins_lock = threading.Lock()
         self.blacklist = Blacklist(self.BLACKLIST, blacklist_file)
+        self.processes = processes
+        self._executor = None
+        if processes:
+            # Spawned rather than forked since the crawler process runs many threads.
+            self._executor = ProcessPoolExecutor(processes, mp_context=multiprocessing.get_context("spawn"), initializer=_init_worker,
+                                                 initargs=(blacklist_file, prefilter))
+
+    def close(self):
+        if self._executor:
+            self._executor.shutdown(wait=True, cancel_futures=True)
+            self._executor = None
+
+    def get_fingerprint(self) -> str:
+        """Hash of the configuration of the plugins and of the blacklist."""
+        config = [str(self.MIN_SECRET_LENGTH)] + self.blacklist.patterns
+        for p in self._get_plugins():
+            config.extend(p.get_config())
+        return hashlib.sha256("\n".join(config).encode("utf-8")).hexdigest()
 
     def find_secrets(self, content: str):
+        return self.find_secrets_in_lines(self.get_lines(content))
+
+    def find_secrets_in_lines(self, lines: List[str]):
+        if self._executor:
+            return iter(self._submit(lines).result())
+        return self._filter_secrets(chain.from_iterable(p.find_secrets(lines) for p in self._get_plugins()))
+
+    def find_secrets_in_documents(self, documents: List[List[str]]) -> List[List[str]]:
+        """Returns the secrets of each document. Scanning many documents in one call saves the overhead of each call."""
+        if self._executor:
+            return list(self.map_secrets(documents))
+        plugin_secrets = [p.find_secrets_in_documents(documents) for p in self._get_plugins()]
+        return [list(self._filter_secrets(chain.from_iterable(s[i] for s in plugin_secrets))) for i in range(len(documents))]
+
+    def map_secrets(self, documents: Iterable[List[str]]) -> Iterable[List[str]]:
+        """Yields the secrets of each document in the order of the documents, scanning up to two per process at once."""
+        if not self._executor:
+            for lines in documents:
+                yield list(self.find_secrets_in_lines(lines))
+            return
+
+        pending = deque()
+        try:
+            for lines in documents:
+                pending.append(self._submit(lines))
+                while len(pending) >= 2 * self.processes:
+                    yield pending.popleft().result()
+            while pending:
+                yield pending.popleft().result()
+        finally:
+            for f in pending:
+                f.cancel()
+
+    def _get_plugins(self) -> List[BasePlugin]:
+        """Creates the plugins on first use, since loading detect_secrets takes longer than a crawl finding nothing new."""
+        if self._plugins is None:
+            with self._plugins_lock:
+                if self._plugins is None:
+                    from .plugins.yelp_detect_secrets_plugin import YelpDetectSecretsPlugin
+                    self._plugins = [PasswordPatternPlugin(self._prefilter), YelpDetectSecretsPlugin(self._prefilter)]
+        return self._plugins
+
+    def _submit(self, lines: List[str]) -> Future:
+        if sum(len(l) for l in lines) < self._shared_memory_threshold:
+            return self._executor.submit(_find_secrets_in_worker, lines)
+
+        # Large documents, like extracted attachments, are copied once in shared memory instead of through a pipe.
+        data = pickle.dumps(lines, protocol=pickle.HIGHEST_PROTOCOL)
+        shared_memory = SharedMemory(create=True, size=len(data))
+        shared_memory.buf[:len(data)] = data
+        try:
+            future = self._executor.submit(_find_secrets_in_shared_memory, shared_memory.name, len(data))
+        except BaseException:
+            _release_shared_memory(shared_memory)
+            raise
+        future.add_done_callback(lambda _: _release_shared_memory(shared_memory))
+        return future
+
+    def _filter_secrets(self, candidates: Iterable[str]):
         secrets = set()
-        lines = [l.strip() for l in content.splitlines()]
-        for p in self._plugins:
-            for s in p.find_secrets(lines):
-                if len(s) >= 6 and s not in secrets and not self.blacklist.matches(s):
-                    secrets.add(s)
-                    yield s
+        for s in candidates:
+            if len(s) >= self.MIN_SECRET_LENGTH and s not in secrets and not self.blacklist.matches(s):
+                secrets.add(s)
+                yield s
+
+    @staticmethod
+    def get_lines(content: str) -> List[str]:
+        return [l.strip() for l in content.splitlines()]
+
+
+_worker_secret_finder = None
+
+
+def _init_worker(blacklist_file, prefilter):
+    global _worker_secret_finder
+    _worker_secret_finder = SecretFinder(blacklist_file, prefilter=prefilter)
+
+
+def _find_secrets_in_worker(lines: List[str]) -> List[str]:
+    return list(_worker_secret_finder.find_secrets_in_lines(lines))
+
+
+def _find_secrets_in_shared_memory(name, size) -> List[str]:
+    # Workers share the resource tracker of the parent process, which unlinks the block once scanned.
+    shared_memory = SharedMemory(name=name)
+    data = shared_memory.buf[:size]
+    try:
+        lines = pickle.loads(data)
+    finally:
+        data.release()
+        shared_memory.close()
+    return _find_secrets_in_worker(lines)
+
 
+def _release_shared_memory(shared_memory: SharedMemory):
+    shared_memory.close()
+    shared_memory.unlink()
@@ -0,0 +1,64 @@
+import datetime
+from typing import List, Optional, Tuple
+
+
+class Shard(object):
+    """A date range, optionally restricted to some spaces, that can be crawled independently of the others."""
+
+    def __init__(self, start_date: datetime.date, end_date: datetime.date, spaces: Optional[List[str]] = None):
+        self.start_date = start_date
+        self.end_date = end_date
+        self.spaces = sorted(spaces) if spaces else None
+
+    @property
+    def id(self):
+        shard_id = f"{self.start_date.isoformat()}_{self.end_date.isoformat()}"
+        if self.spaces:
+            shard_id += "_" + "-".join(self.spaces)
+        return shard_id
+
+    @staticmethod
+    def plan(start_date: datetime.date, end_date: datetime.date, shard_count, spaces=None, split_spaces=False) -> List["Shard"]:
+        """
+        Splits the date range in shard_count contiguous ranges of about the same number of days. When split_spaces is
+        set, every date range is further split in one shard per space.
+        """
+        days = (end_date - start_date).days + 1
+        shard_count = max(1, min(shard_count, days))
+        space_groups = [[s] for s in spaces] if spaces and split_spaces else [spaces]
+
+        shards = []
+        shard_start = start_date
+        for i in range(shard_count):
+            shard_days = days // shard_count + (1 if i < days % shard_count else 0)
+            shard_end = shard_start + datetime.timedelta(days=shard_days - 1)
+            shards.extend(Shard(shard_start, shard_end, space_group) for space_group in space_groups)
+            shard_start = shard_end + datetime.timedelta(days=1)
+        return shards
+
+    @staticmethod
+    def get_completed_end_date(shards: List[Tuple["Shard", bool]], start_date: Optional[datetime.date] = None) -> Optional[datetime.date]:
+        """
+        Returns the end of the unbroken run of completed shards from start_date, or from the first shard, given every
+        shard and whether it was crawled completely. The dates of a shard are only completed when all the shards
+        sharing them, such as the shards of the other spaces, are.
+        """
+        date_ranges = {}
+        for shard, complete in shards:
+            key = (shard.start_date, shard.end_date)
+            date_ranges[key] = date_ranges.get(key, True) and complete
+        if not date_ranges:
+            return None
+
+        end_date = start_date or min(date_ranges)[0] - datetime.timedelta(days=1)
+        completed_end_date = None
+        for (range_start, range_end), complete in sorted(date_ranges.items()):
+            if range_end <= end_date:
+                continue
+            if not complete or range_start > end_date + datetime.timedelta(days=1):
+                break
+            end_date = completed_end_date = range_end
+        return completed_end_date
+
+    def __str__(self):
+        return self.id
@@ -0,0 +1,82 @@
+import os
+import tempfile
+from typing import Iterable, Union
+
+
+class SpooledFile(object):
+    """
+    Bytes written in chunks, kept in memory up to max_memory_size and spilled to a temporary file beyond it. Holds the
+    downloaded attachments so that a large attachment is never held in memory whole and its text is extracted from the
+    file directly. Must be closed to delete the temporary file.
+    """
+    chunk_size = 64 * 1024
+
+    def __init__(self, max_memory_size=1024 * 1024):
+        self._max_memory_size = max_memory_size
+        self._buffer = bytearray()
+        self._file = None
+        self.size = 0
+
+    @classmethod
+    def from_bytes(cls, data: bytes) -> "SpooledFile":
+        f = cls()
+        f.write(data)
+        return f
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def write(self, chunk: bytes):
+        self.size += len(chunk)
+        if self._file is None and len(self._buffer) + len(chunk) > self._max_memory_size:
+            self._spill()
+        if self._file is None:
+            self._buffer.extend(chunk)
+        else:
+            self._file.write(chunk)
+
+    def get_path(self) -> str:
+        """Returns the path of the file holding the bytes, spilling them to disk if they are still in memory."""
+        if self._file is None:
+            self._spill()
+        self._file.flush()
+        return self._file.name
+
+    def iter_chunks(self) -> Iterable[bytes]:
+        if self._file is None:
+            for i in range(0, len(self._buffer), self.chunk_size):
+                yield bytes(self._buffer[i:i + self.chunk_size])
+            return
+
+        self._file.flush()
+        with open(self._file.name, "rb") as f:
+            for chunk in iter(lambda: f.read(self.chunk_size), b""):
+                yield chunk
+
+    def read(self) -> bytes:
+        return bytes(self._buffer) if self._file is None else b"".join(self.iter_chunks())
+
+    def close(self):
+        self._buffer = bytearray()
+        if self._file is not None:
+            self._file.close()
+            try:
+                os.unlink(self._file.name)
+            except OSError:
+                pass
+            self._file = None
+
+    def _spill(self):
+        self._file = tempfile.NamedTemporaryFile(prefix="confluence-attachment-", delete=False)
+        self._file.write(self._buffer)
+        self._buffer = bytearray()
+
+
+def iter_chunks(data: Union[str, bytes, SpooledFile]) -> Iterable[bytes]:
+    """Returns the bytes of a page body, of attachment bytes or of a spooled attachment in chunks."""
+    if isinstance(data, SpooledFile):
+        return data.iter_chunks()
+    return [data.encode("utf-8") if isinstance(data, str) else data]
@@ -1,66 +1,252 @@
+import codecs
 import logging
 import os
-import tempfile
+from html import unescape
+from html.entities import html5
+from html.parser import HTMLParser
 from itertools import chain
-
-import textract
-from bs4 import BeautifulSoup
-from textract.exceptions import ExtensionNotSupported
+from typing import List, Optional, Tuple
 
 from .model import ContentInfo, VersionInfo
+from .spooled_file import SpooledFile
 from .util import get_mime_types_from_extensions, get_extensions_from_mime_type
 
+HTML_PARSERS = ["html.parser", "lxml"]
+
+# Strings directly under these tags are not visible. [document] is the parent of the strings outside of any tag.
+_HIDDEN_PARENTS = {"style", "script", "head", "title", "meta", "[document]"}
+# Tags without content, closed as soon as they are opened.
+_VOID_TAGS = {"area", "base", "br", "col", "embed", "hr", "img", "input", "keygen", "link", "menuitem", "meta", "param", "source", "track",
+              "wbr", "basefont", "bgsound", "command", "frame", "image", "isindex", "nextid", "spacer"}
+# Tags whose content libxml2 keeps as raw text, markup included, while html.parser parses it.
+_LXML_RAW_TEXT_TAGS = {"textarea", "xmp", "iframe", "noembed", "noframes", "plaintext"}
+
 
 class TextExtractor:
     textract_extensions = [".pdf", ".doc", ".docx", ".xls", ".xlsx"]
     text_extensions = [".js", ".json", ".xml"]  # Mime types starting with text/ are automatically supported.
 
-    def __init__(self):
+    def __init__(self, extraction_pool=None, html_parser="html.parser"):
+        self._extraction_pool = extraction_pool
+        self.html_parser = html_parser
         self.supported_mime_types = get_mime_types_from_extensions(chain(self.textract_extensions, self.text_extensions))
         self.supported_mime_types.append('application/octet-stream')
 
     def extract_text_from_version(self, content_info: ContentInfo, version_info: VersionInfo) -> str:
         content = version_info.get_content()
+        try:
+            return self.extract_text(content_info, content)
+        finally:
+            if isinstance(content, SpooledFile):
+                content.close()
+
+    def extract_text(self, content_info: ContentInfo, content) -> str:
+        """Returns the text of a page body, or of an attachment given as bytes or as a SpooledFile."""
+        if content is None:
+            return ""
+
         if content_info.type != "attachment":
-            return self.extract_text_from_html(content)
+            return self.extract_text_from_html(content, self.html_parser)
 
+        if isinstance(content, SpooledFile):
+            return self._extract_text_from_attachment(content_info, content)
+        with SpooledFile.from_bytes(content) as f:
+            return self._extract_text_from_attachment(content_info, f)
+
+    def _extract_text_from_attachment(self, content_info: ContentInfo, content: SpooledFile) -> str:
         extensions = [ext for ext in get_extensions_from_mime_type(content_info.mime_type) if ext in self.textract_extensions]
         file_name_extension = os.path.splitext(content_info.title)[1].lower()
         if file_name_extension and file_name_extension not in extensions and file_name_extension in self.textract_extensions:
             extensions.append(file_name_extension)
 
         if extensions:
-            errors = []
-            f = tempfile.NamedTemporaryFile(delete=False)
-            try:
-                f.write(content)
-                f.close()
-
-                for extension in extensions:
-                    try:
-                        return textract.process(f.name, extension=extension).decode("utf-8")
-                    except ExtensionNotSupported:
-                        pass
-                    except Exception as e:
-                        errors.append(e)
-            finally:
-                f.close()
-                os.unlink(f.name)
+            # textract reads the file directly, the attachment is never loaded in memory whole.
+            if self._extraction_pool:
+                text, errors = self._extraction_pool.extract(content.get_path(), extensions, content_info.title)
+            else:
+                text, errors = process_with_textract(content.get_path(), extensions)
+            if text is not None:
+                return text
             if any(errors):
                 logging.error(errors[0])
         else:
+            # Assume that the content is text. Decoded chunk by chunk to avoid a copy of the whole attachment in bytes.
+            decoder = codecs.getincrementaldecoder("utf-8")()
             try:
-                return content.decode("utf-8")  # Assume that the content is text.
+                return "".join(chain((decoder.decode(chunk) for chunk in content.iter_chunks()), [decoder.decode(b"", final=True)]))
             except UnicodeDecodeError:
                 pass
 
         return ""
 
     @staticmethod
-    def extract_text_from_html(html):
-        soup = BeautifulSoup(html, 'html.parser')
-        texts = soup.findAll(text=True)
-        visible_texts = filter(lambda tag: tag.parent.name not in ['style', 'script', 'head', 'title', 'meta', '[document]'], texts)
-        content = u"\n".join(t.strip() for t in visible_texts if not t.isspace())
+    def extract_text_from_html(html, html_parser="html.parser"):
+        """
+        Returns the visible strings of an HTML document, one per line, in a single pass without building a tree.
+        The html.parser backend attributes strings to tags like BeautifulSoup does. The lxml backend is faster and
+        keeps the same text, but libxml2 wraps strings found outside of any tag in implied elements, which makes them
+        visible, and ignores stray end tags, which joins the strings around them.
+        """
+        if html_parser == "lxml":
+            texts = _get_visible_texts_with_lxml(html)
+        else:
+            parser = _VisibleTextParser()
+            parser.feed(html)
+            parser.close()
+            texts = parser.texts
+        content = u"\n".join(texts)
         content = content.replace(":\n", ": ")
         return content
+
+
+class _VisibleTextParser(HTMLParser):
+    """Collects the visible strings of a document as they are parsed, using the tag stack rules of BeautifulSoup."""
+
+    def __init__(self):
+        super(_VisibleTextParser, self).__init__(convert_charrefs=False)
+        self.texts = []
+        self._open_tags = []
+        self._closed_void_tags = []
+        self._data = []
+
+    def close(self):
+        super(_VisibleTextParser, self).close()
+        self._end_data()
+
+    def handle_starttag(self, tag, attrs):
+        self._end_data()
+        if tag in _VOID_TAGS:
+            self._closed_void_tags.append(tag)
+        else:
+            self._open_tags.append(tag)
+
+    def handle_startendtag(self, tag, attrs):
+        self._end_data()
+
+    def handle_endtag(self, tag):
+        if tag in self._closed_void_tags:
+            # The end tag of a void tag, which was closed when opened. Like BeautifulSoup, the strings around it are joined.
+            self._closed_void_tags.remove(tag)
+            return
+
+        self._end_data()
+        # Like BeautifulSoup, closes every tag opened after the most recent one with this name, if there is one.
+        for i in range(len(self._open_tags) - 1, -1, -1):
+            if self._open_tags[i] == tag:
+                del self._open_tags[i:]
+                break
+
+    def handle_data(self, data):
+        self._data.append(data)
+
+    def handle_charref(self, name):
+        self._data.append(unescape(f"&#{name};"))
+
+    def handle_entityref(self, name):
+        self._data.append(html5.get(f"{name};", f"&{name}"))
+
+    def handle_comment(self, data):
+        self._end_data()
+        self._add_text(data)
+
+    def handle_decl(self, decl):
+        self._end_data()
+        self._add_text(decl[len("DOCTYPE "):])
+
+    def unknown_decl(self, data):
+        self._end_data()
+        self._add_text(data[len("CDATA["):] if data.upper().startswith("CDATA[") else data)
+
+    def handle_pi(self, data):
+        self._end_data()
+        self._add_text(data)
+
+    def _end_data(self):
+        if self._data:
+            self._add_text("".join(self._data))
+            self._data = []
+
+    def _add_text(self, text):
+        parent = self._open_tags[-1] if self._open_tags else "[document]"
+        if text and not text.isspace() and parent not in _HIDDEN_PARENTS:
+            self.texts.append(text.strip())
+
+
+class _LxmlVisibleTextTarget(object):
+    """Receives the events of the lxml HTML parser and collects the visible strings."""
+
+    def __init__(self):
+        self.texts = []
+        self._open_tags = ["[document]"]
+        self._data = []
+
+    def start(self, tag, attrib):
+        self._end_data()
+        self._open_tags.append(tag)
+
+    def end(self, tag):
+        self._end_data()
+        self._open_tags.pop()
+
+    def data(self, data):
+        self._data.append(data)
+
+    def comment(self, text):
+        self._end_data()
+        # libxml2 reports CDATA sections as comments.
+        if text.startswith("[CDATA[") and text.endswith("]]"):
+            text = text[len("[CDATA["):-len("]]")]
+        self._add_text(text)
+
+    def pi(self, target, data=None):
+        self._end_data()
+        self._add_text(f"{target} {data}" if data else target)
+
+    def close(self):
+        self._end_data()
+        return self.texts
+
+    def _end_data(self):
+        if self._data:
+            text = "".join(self._data)
+            self._data = []
+            if self._open_tags[-1] in _LXML_RAW_TEXT_TAGS:
+                # Parsed as markup like html.parser does, so that the tags do not end up in the secrets.
+                self.texts.extend(_get_visible_texts_with_lxml(text))
+            else:
+                self._add_text(text)
+
+    def _add_text(self, text):
+        if text and not text.isspace() and self._open_tags[-1] not in _HIDDEN_PARENTS:
+            self.texts.append(text.strip())
+
+
+def _get_visible_texts_with_lxml(html) -> List[str]:
+    # Imported here since lxml is optional.
+    from lxml import etree
+
+    if not html or html.isspace():
+        return []
+    parser = etree.HTMLParser(target=_LxmlVisibleTextTarget())
+    parser.feed(html)
+    return parser.close()
+
+
+def process_with_textract(path, extensions) -> Tuple[Optional[str], List[Exception]]:
+    """
+    Returns the text extracted from a file by the first of the given extensions supported by textract and the errors
+    of the others.
+    """
+    # Imported here since textract loads every parser it supports.
+    import textract
+    from textract.exceptions import ExtensionNotSupported
+
+    errors = []
+    for extension in extensions:
+        try:
+            return textract.process(path, extension=extension).decode("utf-8"), errors
+        except ExtensionNotSupported:
+            pass
+        except Exception as e:
+            errors.append(e)
+    return None, errors
@@ -1,13 +1,11 @@
 import json
 import mimetypes
 
-if not mimetypes.inited:
-    mimetypes.init()
-
 
 class PublicPropertiesEncoder(json.JSONEncoder):
     def default(self, o):
-        return {k: v for k, v in vars(o).items() if not k.startswith("_")}
+        attributes = vars(o) if hasattr(o, "__dict__") else {k: getattr(o, k) for k in o.__slots__}
+        return {k: v for k, v in attributes.items() if not k.startswith("_")}
 
 
 def to_json(obj):
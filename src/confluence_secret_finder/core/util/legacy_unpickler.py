@@ -2,10 +2,23 @@ import io
 import pickle
 
 
+class LegacyContentCrawlHistory(object):
+    """Crawl history pickled by the previous versions of the cache, holding the plaintext secrets."""
+
+    def __init__(self):
+        self.latest_version = 0
+        self.secrets = set()
+
+
 class LegacyUnpickler(pickle.Unpickler):
     missing_core_modules = ["model"]
+    # Classes whose pickled attributes no longer match the current ones.
+    legacy_classes = {"ContentCrawlHistory": LegacyContentCrawlHistory}
 
     def find_class(self, module, name):
+        if name in self.legacy_classes and module.split(".")[-1] == "content_crawl_history":
+            return self.legacy_classes[name]
+
         # The namespace of these modules was changed.
         if any(t for t in self.missing_core_modules if module.startswith(t + ".")):
             module = "core." + module
@@ -14,4 +27,4 @@ class LegacyUnpickler(pickle.Unpickler):
 
 
 def legacy_decode(obj):
-    return LegacyUnpickler(io.BytesIO(obj)).load()
\ No newline at end of file
+    return LegacyUnpickler(io.BytesIO(obj)).load()
@@ -0,0 +1,129 @@
+import hashlib
+import hmac
+import json
+import logging
+import threading
+import time
+from typing import List, Optional
+from urllib.parse import parse_qs, urlsplit
+
+from .metrics import metrics
+
+# Keys of the webhook payloads holding the content that changed.
+_CONTENT_KEYS = ["page", "blog", "blogpost", "attachment", "comment", "content"]
+# Events of contents that have no new version to scan.
+_IGNORED_EVENT_SUFFIXES = ("_removed", "_trashed", "_deleted", "_viewed")
+_SIGNATURE_PREFIX = "sha256="
+# Addresses only reachable from this machine, where webhooks may be received without a secret.
+LOOPBACK_ADDRESSES = ["127.0.0.1", "::1", "localhost"]
+
+
+class EventQueue(object):
+    """
+    Contents to scan, debounced: a content is returned once no event was received for it during debounce seconds, so
+    that a burst of edits is scanned once, or max_delay seconds after its first event if the edits never stop.
+    """
+
+    def __init__(self, debounce=30.0, max_delay=None):
+        self._debounce = debounce
+        self._max_delay = max_delay if max_delay is not None else debounce * 10
+        self._first_events = {}
+        self._last_events = {}
+        self._condition = threading.Condition()
+
+    def put(self, content_id: str):
+        with self._condition:
+            now = time.monotonic()
+            self._first_events.setdefault(content_id, now)
+            self._last_events[content_id] = now
+            self._condition.notify()
+
+    def get(self, timeout=None) -> Optional[str]:
+        """Returns the content whose delay elapsed first, waiting up to timeout seconds for one. Returns None on timeout."""
+        deadline = time.monotonic() + timeout if timeout is not None else None
+        with self._condition:
+            while True:
+                now = time.monotonic()
+                due_times = {content_id: self._get_due_time(content_id) for content_id in self._last_events}
+                content_id = min(due_times, key=due_times.get, default=None)
+                if content_id is not None and due_times[content_id] <= now:
+                    del self._first_events[content_id]
+                    del self._last_events[content_id]
+                    return content_id
+
+                if deadline is not None and now >= deadline:
+                    return None
+                wait_times = [t - now for t in [deadline, due_times.get(content_id)] if t is not None]
+                self._condition.wait(min(wait_times) if wait_times else None)
+
+    def __len__(self):
+        with self._condition:
+            return len(self._last_events)
+
+    def _get_due_time(self, content_id) -> float:
+        return min(self._last_events[content_id] + self._debounce, self._first_events[content_id] + self._max_delay)
+
+
+class WebhookServer(object):
+    """
+    Receives the webhooks of Confluence, for example page_updated or attachment_created, from a background thread and
+    queues the contents they name. With a secret, the X-Hub-Signature header must hold the HMAC SHA-256 of the body,
+    as sha256=<hex digest>. Only listens on localhost by default.
+    """
+
+    def __init__(self, port, events: EventQueue, address="127.0.0.1", secret=None):
+        from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+        secret = secret.encode("utf-8") if secret else None
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_POST(self):
+                body = self.rfile.read(int(self.headers.get("Content-Length") or 0))
+                if secret and not _is_signed(body, self.headers.get("X-Hub-Signature"), secret):
+                    self.send_error(401)
+                    return
+                try:
+                    payload = json.loads(body)
+                except ValueError:
+                    self.send_error(400)
+                    return
+
+                query = parse_qs(urlsplit(self.path).query)
+                event = str(payload.get("webhookEvent") or payload.get("event") or query.get("event", [""])[0]) if isinstance(payload, dict) else ""
+                content_ids = get_content_ids(payload) if not event.endswith(_IGNORED_EVENT_SUFFIXES) else []
+                metrics.inc("webhook_events_total", event=event or "unknown")
+                for content_id in content_ids:
+                    events.put(content_id)
+                logging.info(f"Received {event or 'webhook'} for contents {content_ids}.")
+                self.send_response(204)
+                self.end_headers()
+
+            def log_message(self, *args):
+                pass
+
+        self._server = ThreadingHTTPServer((address, port), Handler)
+        self._server.daemon_threads = True
+        self._thread = threading.Thread(target=self._server.serve_forever, name="webhook-server", daemon=True)
+
+    def __enter__(self):
+        self._thread.start()
+        logging.info(f"Receiving webhooks on {self._server.server_address[0]} port {self._server.server_address[1]}.")
+        return self
+
+    def __exit__(self, *args):
+        self._server.shutdown()
+        self._server.server_close()
+
+
+def get_content_ids(payload) -> List[str]:
+    """Returns the ids of the contents named by a webhook payload."""
+    if not isinstance(payload, dict):
+        return []
+    items = [payload.get(key) for key in _CONTENT_KEYS] + list(payload.get("attachments") or [])
+    return list(dict.fromkeys(str(item["id"]) for item in items if isinstance(item, dict) and item.get("id")))
+
+
+def _is_signed(body: bytes, signature: Optional[str], secret: bytes) -> bool:
+    if not signature or not signature.startswith(_SIGNATURE_PREFIX):
+        return False
+    expected = hmac.new(secret, body, hashlib.sha256).hexdigest()
+    return hmac.compare_digest(signature[len(_SIGNATURE_PREFIX):], expected)
@@ -2,27 +2,93 @@
 
 import argparse
 import datetime
+import hashlib
+import inspect
 import logging
+import multiprocessing
 import os
-from typing import Iterable
+import signal
+import sys
+import threading
+import time
+from collections import deque
+from contextlib import ExitStack
+from concurrent.futures import Future, ProcessPoolExecutor, ThreadPoolExecutor
+from itertools import groupby
+from typing import AsyncIterable, Iterable, List, Optional, Tuple
 
 import dateutil.parser
+from core.archive import Archive
 from core.cache import Cache
-from core.confluence import ConfluenceRepository
-from core.model import VersionSecrets, ContentCrawlHistory
+from core.content_cache import ContentCache
+from core.extraction_pool import ExtractionError, ExtractionPool
+from core.metrics import MetricsServer, StatsReporter, metrics
+from core.output import OUTPUT_FORMATS, open_output
+from core.confluence import ConfluenceRepository, ContentFilter
+from core.model import VersionSecrets, ContentCrawlHistory, ContentInfo, ContentCrawlResult, VersionInfo, hash_secret
+from core.pipeline import Pipeline
+from core.profiler import Profiler
+from core.shard import Shard
+from core.spooled_file import SpooledFile, iter_chunks
 from core.secrets import SecretFinder
-from core.text_extractor import TextExtractor
-from core.util import to_json
+from core.text_extractor import HTML_PARSERS, TextExtractor
+from core.webhooks import LOOPBACK_ADDRESSES, EventQueue, WebhookServer
+
+
+class VersionTask(object):
+    """A version going through the crawl pipeline along with the result of every stage."""
+
+    def __init__(self, index, content: ContentInfo, version: Optional[VersionInfo], previous: "VersionTask" = None):
+        self.index = index
+        self.content = content
+        self.version = version
+        self.previous = previous
+        self.data = None
+        self.lines = Future()
+        self.secrets = None
+        self.content_key = None
+        self.cached_secrets = None
+        self.body_hash = None
 
 
 class App(object):
-    def __init__(self, domain, api_user, api_token, blacklist_file, max_attachment_size, cache_location, start_date: datetime.date):
+    def __init__(self, domain, api_user, api_token, blacklist_file, max_attachment_size, cache_location, start_date: datetime.date,
+                 fetch_workers=1, extract_workers=1, scan_workers=1, pool_size=10, max_requests_per_second=10, end_date: datetime.date = None,
+                 spaces=None, lazy_version_bodies=False, incremental_scan=False, content_cache_size=0,
+                 extraction_timeout=300, extraction_memory_limit=2048, html_parser="html.parser", scan_processes=0, wiki_url=None,
+                 search_window_days=1, content_filter: ContentFilter = None, archive_location=None):
         self._cache_location = cache_location
+        self._archive_location = archive_location
+        self._archive = None
         self._start_date = start_date
+        self._end_date = end_date
+        self._spaces = spaces
+        self._search_window_days = max(1, search_window_days)
         self._domain = domain
-        self._text_extractor = TextExtractor()
-        self._repository = ConfluenceRepository(domain, api_user, api_token, max_attachment_size, self._text_extractor.supported_mime_types)
-        self._secret_finder = SecretFinder(blacklist_file)
+        self._fetch_workers = fetch_workers
+        self._extract_workers = extract_workers
+        # Every scanning process needs a thread waiting for its results.
+        self._scan_workers = max(scan_workers, scan_processes)
+        self._lazy_version_bodies = lazy_version_bodies
+        self._incremental_scan = incremental_scan
+        self._content_cache_size = content_cache_size
+        self._content_cache = None
+        # Body hashes of the versions of the contents being crawled, with the number of the first version having them.
+        self._body_hashes = {}
+        self._body_hashes_lock = threading.Lock()
+        self._wiki_url = wiki_url
+        self._content_filter = content_filter
+        self._pool_size = pool_size
+        self._max_requests_per_second = max_requests_per_second
+        self._extraction_pool = ExtractionPool(extract_workers, extraction_timeout, extraction_memory_limit)
+        self._text_extractor = TextExtractor(self._extraction_pool, html_parser)
+        self._repository = self._create_repository(domain, api_user, api_token, max_attachment_size, pool_size, max_requests_per_second)
+        self._secret_finder = SecretFinder(blacklist_file, scan_processes)
+
+    def _create_repository(self, domain, api_user, api_token, max_attachment_size, pool_size, max_requests_per_second):
+        return ConfluenceRepository(domain, api_user, api_token, max_attachment_size, self._text_extractor.supported_mime_types,
+                                    pool_size, max_requests_per_second, lazy_version_bodies=self._lazy_version_bodies, wiki_url=self._wiki_url,
+                                    content_filter=self._content_filter)
 
     def __enter__(self):
         if self._cache_location:
@@ -31,57 +97,412 @@ class App(object):
             current_folder = os.path.dirname(os.path.realpath(__file__))
             cache_path = os.path.join(current_folder, "../../cache.sqlite")
         self._cache = Cache(cache_path, self._domain)
+        if self._content_cache_size:
+            self._content_cache = ContentCache(f"{cache_path}-content", self._get_content_fingerprint, self._content_cache_size)
+        if self._archive_location:
+            self._archive = Archive(self._archive_location)
         return self
 
     def __exit__(self, *args):
         self._cache.close()
+        if self._content_cache:
+            self._content_cache.close()
+        if self._archive:
+            self._archive.close()
+        self._extraction_pool.close()
+        self._secret_finder.close()
+        self._repository.close()
+
+    def _get_content_fingerprint(self) -> str:
+        # The extracted text depends on the HTML parser.
+        return f"{self._secret_finder.get_fingerprint()}\n{self._text_extractor.html_parser}"
 
     def get_secrets_from_versions(self, content, start_version) -> Iterable[VersionSecrets]:
-        for version in self._repository.get_versions(content):
-            if version.id <= start_version:
-                continue
+        for _, version_secrets in self.get_secrets_from_contents([(content, start_version)]):
+            for s in version_secrets:
+                yield s
+
+    def get_secrets_from_contents(self, contents: Iterable[Tuple[ContentInfo, int]]) -> Iterable[Tuple[ContentInfo, List[VersionSecrets]]]:
+        """
+        Fetches, extracts and scans the versions newer than the given start version of every content concurrently.
+        The contents are yielded in the order they were received along with the secrets found in each version.
+        """
+        version_stages = [(self._fetch_version, self._fetch_workers),
+                          (self._extract_version, self._extract_workers),
+                          (self._scan_version, self._scan_workers)]
+        with Pipeline([(self._list_versions, self._fetch_workers)]) as listing, Pipeline(version_stages) as scanning:
+            indexed_contents = ((i, content, start_version) for i, (content, start_version) in enumerate(contents))
+            for _, tasks in groupby(scanning.map(self._get_version_tasks(listing.map(indexed_contents))), key=lambda t: t.index):
+                tasks = list(tasks)
+                yield tasks[0].content, [t.secrets for t in tasks if t.secrets]
+
+    @staticmethod
+    def _get_version_tasks(content_versions) -> Iterable[VersionTask]:
+        for i, content, versions in content_versions:
+            previous = None
+            for version in versions:
+                previous = VersionTask(i, content, version, previous)
+                yield previous
+            if not versions:
+                # Contents without new versions still go through the pipeline to keep their place.
+                yield VersionTask(i, content, None)
+
+    def _list_versions(self, task):
+        i, content, start_version = task
+        return i, content, list(self._repository.get_versions(content, start_version))
+
+    def _fetch_version(self, task: VersionTask) -> VersionTask:
+        try:
+            if task.version:
+                task.data = task.version.get_content()
+                self._load_cached_content(task)
+        except BaseException:
+            self._release_data(task)
+            if not task.lines.done():
+                task.lines.set_result(None)
+            raise
+        return task
+
+    def _load_cached_content(self, task: VersionTask):
+        if task.data is None:
+            return
+        if self._is_known_body(task):
+            # The secrets of the earlier version with the same body are already in the crawl history.
+            metrics.inc("duplicate_versions_total")
+            task.cached_secrets = []
+            self._release_data(task)
+            task.lines.set_result(None)
+            return
+        if not self._content_cache:
+            return
+
+        task.content_key = self._content_cache.get_key(task.content, task.data)
+        cached_content = self._content_cache.get(task.content_key)
+        if cached_content:
+            metrics.inc("content_cache_hits_total")
+            lines, task.cached_secrets = cached_content
+            self._release_data(task)
+            task.lines.set_result(lines)
+
+    def _is_known_body(self, task: VersionTask) -> bool:
+        """Returns whether the body of the version was seen in a previous crawl or an earlier version of the content."""
+        with self._body_hashes_lock:
+            body_hashes = self._body_hashes.get(task.content.id)
+        if body_hashes is None:
+            return False
+
+        h = hashlib.blake2b(digest_size=16)
+        for chunk in iter_chunks(task.data):
+            h.update(chunk)
+        task.body_hash = h.hexdigest()
+        with self._body_hashes_lock:
+            version_id = body_hashes.get(task.body_hash)
+        return version_id is not None and version_id < task.version.id
+
+    def _add_body_hash(self, task: VersionTask):
+        with self._body_hashes_lock:
+            body_hashes = self._body_hashes.get(task.content.id)
+            if body_hashes is not None:
+                body_hashes.setdefault(task.body_hash, task.version.id)
+
+    @staticmethod
+    def _release_data(task: VersionTask):
+        """Drops the downloaded body of a version, deleting the temporary file of a spooled attachment."""
+        if isinstance(task.data, SpooledFile):
+            task.data.close()
+        task.data = None
+
+    def _save_cached_content(self, task: VersionTask, lines, secrets):
+        if self._content_cache and task.content_key:
+            self._content_cache.set(task.content_key, lines, secrets)
+
+    def _extract_version(self, task: VersionTask) -> VersionTask:
+        if task.lines.done():  # Loaded from the content cache.
+            return task
+
+        lines = None
+        try:
+            if task.version:
+                with metrics.time("extraction_seconds", mime_type=task.content.mime_type or "text/html"):
+                    lines = SecretFinder.get_lines(self._text_extractor.extract_text(task.content, task.data))
+        except ExtractionError as e:
+            logging.error(f"{e} Skipping {task.version.url}")
+            lines = []
+            task.content_key = None  # Extracted again by the next crawl.
+            task.body_hash = None
+        finally:
+            self._release_data(task)
+            task.lines.set_result(lines)
+        return task
+
+    def _scan_version(self, task: VersionTask) -> VersionTask:
+        if task.version:
+            metrics.inc("versions_scanned_total")
+        if task.cached_secrets is not None:
+            task.secrets = VersionSecrets(task.content, task.version, set(task.cached_secrets)) if any(task.cached_secrets) else None
+        elif task.version:
+            lines = task.lines.result()
+            if self._incremental_scan and task.previous:
+                lines = self._get_new_lines(lines, task.previous.lines.result())
+            with metrics.time("scan_seconds"):
+                task.secrets = self._find_version_secrets(task.content, task.version, lines)
+            if lines is task.lines.result():
+                # Only the secrets of complete contents can be reused.
+                self._save_cached_content(task, lines, task.secrets.secrets if task.secrets else [])
+        if self._archive and task.version and task.lines.result():
+            self._archive.add(task.content, task.version, task.lines.result())
+        if task.body_hash:
+            self._add_body_hash(task)
+        task.previous = None
+        return task
+
+    @staticmethod
+    def _get_new_lines(lines, previous_lines):
+        """
+        Returns the lines added or changed since the previous version. The secrets of the other lines were found when
+        the previous version was scanned and would be removed by the crawl history anyway.
+        """
+        if previous_lines is None:
+            return lines
+        previous_lines = set(previous_lines)
+        return [l for l in lines if l not in previous_lines]
+
+    def _find_version_secrets(self, content, version, lines) -> Optional[VersionSecrets]:
+        secrets = set()
+        for secret in self._secret_finder.find_secrets_in_lines(lines):
+            secrets.add(secret)
+        if not any(secrets):
+            return None
+        metrics.inc("secrets_found_total", len(secrets))
+        return VersionSecrets(content, version, secrets)
+
+    def _get_contents_to_crawl(self, start_date, end_date, shard: Shard = None, positions=None) -> Iterable[Tuple[ContentInfo, int]]:
+        seen = set()
+        spaces = shard.spaces if shard else self._spaces
+        for position, content in enumerate(self._repository.get_content_for_dates(start_date, end_date, spaces)):
+            start_version = self._get_start_version(content, seen, shard)
+            if start_version is not None:
+                if positions is not None:
+                    positions[content.id] = position
+                yield content, start_version
+
+    def _get_start_version(self, content, seen, shard: Shard = None) -> Optional[int]:
+        """Returns the version after which the content must be crawled or None when it is already up to date."""
+        if content.id in seen:
+            return None
+        seen.add(content.id)
+
+        crawl_history = self._get_crawl_history(content.id, shard)
+        if crawl_history and crawl_history.latest_version == content.latest_version:
+            return None
+
+        with self._body_hashes_lock:
+            self._body_hashes[content.id] = dict.fromkeys(crawl_history.body_hashes, 0) if crawl_history else {}
+        if crawl_history:
+            logging.info(f"Fetching versions {crawl_history.latest_version}-{content.latest_version} from {content}...")
+            return crawl_history.latest_version
+
+        logging.info(f"Fetching {content.latest_version} versions from {content}...")
+        return 0
 
-            version_content = self._text_extractor.extract_text_from_version(content, version)
-            secrets = set()
-            for secret in self._secret_finder.find_secrets(version_content):
-                secrets.add(secret)
+    def _get_crawl_history(self, content_id, shard: Shard = None) -> ContentCrawlHistory:
+        crawl_history = None
+        if shard:
+            crawl_history = self._cache.get_shard_crawl_history(shard.id, content_id)
+        return crawl_history or self._cache.get_crawl_history(content_id)
 
-            if any(secrets):
-                yield VersionSecrets(content, version, secrets)
+    def _update_crawl_history(self, content, new_version_secrets, shard: Shard = None) -> List[VersionSecrets]:
+        """Removes the secrets already found in previous versions of the content and saves its crawl history."""
+        crawl_history = self._get_crawl_history(content.id, shard) or ContentCrawlHistory()
+        with self._body_hashes_lock:
+            crawl_history.body_hashes.update(self._body_hashes.pop(content.id, {}))
+        for version_secrets in new_version_secrets:
+            version_secrets.secrets = crawl_history.add_secrets(content.id, version_secrets.secrets)
+
+        crawl_history.latest_version = content.latest_version
+        if shard:
+            self._cache.set_shard_crawl_history(shard.id, content.id, crawl_history)
+        else:
+            self._cache.set_crawl_history(content.id, crawl_history)
+        return [s for s in new_version_secrets if any(s.secrets)]
 
     def find_secrets_from_date(self, date) -> Iterable[VersionSecrets]:
-        today = datetime.datetime.now().date()
-        while date <= today:
-            logging.info(f"Fetching changes for {date}...")
-            for content in self._repository.get_content_for_date(date):
-                crawl_history = self._cache.get_crawl_history(content.id)
-                if crawl_history:
-                    new_version_secrets = []
-                    if crawl_history.latest_version != content.latest_version:
-                        logging.info(f"Fetching versions {crawl_history.latest_version}-{content.latest_version} from {content}...")
-                        new_version_secrets = list(self.get_secrets_from_versions(content, crawl_history.latest_version))
-                else:
-                    logging.info(f"Fetching {content.latest_version} versions from {content}...")
-                    new_version_secrets = list(self.get_secrets_from_versions(content, 0))
-                    crawl_history = ContentCrawlHistory()
-
-                for version_secrets in new_version_secrets:
-                    version_secrets.secrets = [s for s in version_secrets.secrets if s not in crawl_history.secrets]
-                    crawl_history.secrets.extend(version_secrets.secrets)
-
-                crawl_history.latest_version = content.latest_version
-                self._cache.set_crawl_history(content.id, crawl_history)
-                for s in new_version_secrets:
-                    if any(s.secrets):
-                        yield s
+        end_date = self._end_date or datetime.datetime.now().date()
+        for start_date, window_end in self._repository.get_date_windows(date, end_date, self._search_window_days, self._spaces):
+            logging.info(f"Fetching changes for {format_window(start_date, window_end)}...")
+            for content, new_version_secrets in self.get_secrets_from_contents(self._get_contents_to_crawl(start_date, window_end)):
+                for s in self._update_crawl_history(content, new_version_secrets):
+                    yield s
+
+            self._cache.set_last_crawl_date(window_end)
+
+    def plan_shards(self, shard_count, split_spaces=False) -> List[Shard]:
+        end_date = self._end_date or datetime.datetime.now().date()
+        return Shard.plan(self._get_start_date(), end_date, shard_count, self._spaces, split_spaces)
+
+    def find_secrets_for_shard(self, shard: Shard) -> Iterable[VersionSecrets]:
+        """
+        Crawls a shard independently of the others. Its checkpoint, crawl history and results are kept in their own
+        cache entries so that it can be resumed on its own and merged later with merge_shards.
+        """
+        self._cache.add_shard(shard)
+        date = self._cache.get_shard_last_crawl_date(shard.id) or shard.start_date
+        for start_date, window_end in self._repository.get_date_windows(date, shard.end_date, self._search_window_days, shard.spaces):
+            logging.info(f"Fetching changes for {format_window(start_date, window_end)} in shard {shard}...")
+            positions = {}
+            for content, new_version_secrets in self.get_secrets_from_contents(self._get_contents_to_crawl(start_date, window_end, shard, positions)):
+                # The hashes of the raw secrets are kept since the merge deduplicates them again against the complete history.
+                # The shard caches are copied between machines so they never hold the plaintext secrets.
+                versions = [(VersionInfo(s.version.id, s.version.by, None, s.version.url), {hash_secret(content.id, secret) for secret in s.secrets})
+                            for s in new_version_secrets]
+                self._cache.set_shard_result(shard.id, start_date, positions[content.id], ContentCrawlResult(content, versions))
+                for s in self._update_crawl_history(content, new_version_secrets, shard):
+                    yield s
+
+            self._cache.set_shard_last_crawl_date(shard.id, window_end)
+
+    def find_secrets_in_shards(self, shard_count, app_kwargs, split_spaces=False) -> Iterable[VersionSecrets]:
+        """
+        Crawls the shards in parallel processes, each with its own cache file next to this cache, and merges them.
+        The shard plan is saved so that an interrupted run resumes every shard where it stopped.
+        """
+        shards = self._cache.get_shard_plan()
+        if not shards:
+            shards = self.plan_shards(shard_count, split_spaces)
+            self._cache.set_shard_plan(shards)
+
+        cache_locations = [f"{self._cache.file_name}.{shard.id}" for shard in shards]
+        # At most shard_count shards are crawled at once, the shards of the other spaces wait for a free process. The
+        # processes share the request rate and the connections of the crawl.
+        processes = max(1, min(len(shards), shard_count))
+        app_kwargs = dict(app_kwargs, max_requests_per_second=self._max_requests_per_second / processes, pool_size=max(1, self._pool_size // processes))
+        # Spawned rather than forked since the metrics, stats and profiler threads may be running.
+        with ProcessPoolExecutor(processes, mp_context=multiprocessing.get_context("spawn")) as executor:
+            futures = [executor.submit(crawl_shard, dict(app_kwargs, cache_location=location), shard) for shard, location in zip(shards, cache_locations)]
+            for f in futures:
+                f.result()
+
+        for s in self.merge_shards(cache_locations):
+            yield s
+
+        self._cache.delete_shard_plan()
+        for location in cache_locations:
+            for file_name in [location, f"{location}-content"]:
+                if os.path.exists(file_name):
+                    os.remove(file_name)
+
+    def merge_shards(self, cache_locations: List[str]) -> Iterable[VersionSecrets]:
+        """
+        Merges the shards crawled in the given cache files into this cache. The secrets are yielded in the order of a
+        sequential crawl and deduplicated against the crawl history of every content. The shards only keep the hashes
+        of the secrets, so the versions holding secrets missing from the crawl history are fetched and scanned again.
+        """
+        results = []
+        shards = []
+        for location in cache_locations:
+            shard_cache = Cache(location, self._domain)
+            try:
+                for shard in shard_cache.get_shards():
+                    complete = shard_cache.get_shard_last_crawl_date(shard.id) == shard.end_date
+                    shards.append((shard, complete))
+                    if not complete:
+                        # Its dates are crawled again from the checkpoint by the next run.
+                        logging.warning(f"Shard {shard} from {location} was not crawled completely, skipping its results.")
+                        continue
+                    results.extend((key, shard.id, result) for key, result in shard_cache.get_shard_results(shard.id))
+            finally:
+                shard_cache.close()
 
-            self._cache.set_last_crawl_date(date)
-            date += datetime.timedelta(days=1)
+        for _, _, result in sorted(results, key=lambda r: (r[0], r[1])):
+            for s in self._merge_shard_result(result):
+                yield s
+
+        last_crawl_date = self._cache.get_last_crawl_date()
+        end_date = Shard.get_completed_end_date(shards, last_crawl_date)
+        if end_date and (not last_crawl_date or end_date > last_crawl_date):
+            self._cache.set_last_crawl_date(end_date)
+
+    def _merge_shard_result(self, result: ContentCrawlResult) -> List[VersionSecrets]:
+        content = result.content
+        crawl_history = self._cache.get_crawl_history(content.id) or ContentCrawlHistory()
+        if crawl_history.latest_version >= content.latest_version:
+            return []
+
+        versions = [(version, secret_hashes) for version, secret_hashes in result.versions if version.id > crawl_history.latest_version]
+        known_hashes = set(crawl_history.secret_hashes)
+        new_hashes = {}
+        for version, secret_hashes in versions:
+            if not secret_hashes <= known_hashes:
+                new_hashes[version.id] = secret_hashes
+                known_hashes.update(secret_hashes)
+
+        new_version_secrets = []
+        for version, lines in self._read_versions(content, list(new_hashes)):
+            secrets = [s for s in dict.fromkeys(self._secret_finder.find_secrets_in_lines(lines)) if hash_secret(content.id, s) in new_hashes[version.id]]
+            secrets = crawl_history.add_secrets(content.id, secrets)
+            if secrets:
+                new_version_secrets.append(VersionSecrets(content, version, secrets))
+
+        # The secrets no longer found, for example since blacklisted, are not reported again by the next versions either.
+        for _, secret_hashes in versions:
+            crawl_history.secret_hashes.update(secret_hashes)
+        crawl_history.latest_version = content.latest_version
+        self._cache.set_crawl_history(content.id, crawl_history)
+        return new_version_secrets
+
+    def _read_versions(self, content, version_ids: List[int]) -> Iterable[Tuple[VersionInfo, List[str]]]:
+        """Fetches the given versions of a content and yields them with their lines."""
+        if not version_ids:
+            return
+        for version in self._repository.get_versions(content, min(version_ids) - 1):
+            if version.id not in version_ids:
+                continue
+            try:
+                with metrics.time("extraction_seconds", mime_type=content.mime_type or "text/html"):
+                    lines = SecretFinder.get_lines(self._text_extractor.extract_text_from_version(content, version))
+            except ExtractionError as e:
+                logging.error(f"{e} Skipping {version.url}")
+                continue
+            metrics.inc("versions_scanned_total")
+            yield version, lines
 
     def find_secrets(self) -> Iterable[VersionSecrets]:
         for s in self.find_secrets_from_date(self._get_start_date()):
             yield s
 
+    def watch(self, events: EventQueue, poll_interval=3600) -> Iterable[VersionSecrets]:
+        """
+        Crawls like find_secrets, then scans the new versions of the contents queued by the webhooks as soon as they are
+        due and crawls the changes since the last crawl date every poll_interval seconds, for the webhooks that were
+        missed. Never returns.
+        """
+        next_poll = time.monotonic()
+        while True:
+            if time.monotonic() >= next_poll:
+                for s in self.find_secrets():
+                    yield s
+                self._start_date = None  # The next polls resume from the last crawl date.
+                next_poll = time.monotonic() + poll_interval
+
+            content_id = events.get(timeout=max(next_poll - time.monotonic(), 0))
+            if content_id:
+                for s in self._find_secrets_for_content(content_id):
+                    yield s
+
+    def _find_secrets_for_content(self, content_id) -> Iterable[VersionSecrets]:
+        content = self._repository.get_content(content_id, self._spaces)
+        if not content:
+            return
+        start_version = self._get_start_version(content, set())
+        if start_version is None:
+            return
+
+        new_version_secrets = list(self.get_secrets_from_versions(content, start_version))
+        for s in self._update_crawl_history(content, new_version_secrets):
+            yield s
+        # Saved right away so that a restarted daemon does not report the secrets again.
+        self._cache.commit()
+
     def _get_start_date(self) -> datetime.date:
         if self._start_date:
             return self._start_date
@@ -91,18 +512,237 @@ class App(object):
         return self._repository.get_oldest_content_creation_date()
 
 
+class AsyncApp(App):
+    """
+    Crawls Confluence with the asyncio backend, which keeps up to max_concurrent_requests downloads in flight without
+    a thread per request. Text extraction and scanning still run on their own thread pools.
+    """
+
+    def __init__(self, *args, max_concurrent_requests=100, **kwargs):
+        self._max_concurrent_requests = max_concurrent_requests
+        super(AsyncApp, self).__init__(*args, **kwargs)
+
+    def _create_repository(self, domain, api_user, api_token, max_attachment_size, pool_size, max_requests_per_second):
+        # Imported here since httpx is only required by this backend.
+        from core.confluence.async_confluence_repository import AsyncConfluenceRepository
+        return AsyncConfluenceRepository(domain, api_user, api_token, max_attachment_size, self._text_extractor.supported_mime_types,
+                                         self._max_concurrent_requests, max_requests_per_second, self._lazy_version_bodies, self._wiki_url,
+                                         self._content_filter)
+
+    async def get_secrets_from_contents_async(self, contents: AsyncIterable[Tuple[ContentInfo, int]]) -> AsyncIterable[Tuple[ContentInfo, List[VersionSecrets]]]:
+        import asyncio
+        loop = asyncio.get_running_loop()
+        with ThreadPoolExecutor(max_workers=self._extract_workers) as extract_executor, ThreadPoolExecutor(max_workers=self._scan_workers) as scan_executor:
+            async def scan_version(task: VersionTask):
+                try:
+                    data = task.version.get_content()
+                    if inspect.isawaitable(data):
+                        data = await data
+                    task.data = data
+                    await loop.run_in_executor(extract_executor, self._load_cached_content, task)
+                except BaseException:
+                    self._release_data(task)
+                    if not task.lines.done():
+                        task.lines.set_result(None)
+                    raise
+
+                await loop.run_in_executor(extract_executor, self._extract_version, task)
+                return (await loop.run_in_executor(scan_executor, self._scan_version, task)).secrets
+
+            async def scan_content(content, start_version):
+                tasks = []
+                previous = None
+                async for v in self._repository.get_versions(content, start_version):
+                    previous = VersionTask(0, content, v, previous)
+                    tasks.append(asyncio.ensure_future(scan_version(previous)))
+                return content, [version_secrets for version_secrets in await asyncio.gather(*tasks) if version_secrets]
+
+            pending = deque()
+            try:
+                async for content, start_version in contents:
+                    pending.append(asyncio.ensure_future(scan_content(content, start_version)))
+                    while len(pending) >= self._max_concurrent_requests:
+                        yield await pending.popleft()
+
+                while pending:
+                    yield await pending.popleft()
+            finally:
+                for task in pending:
+                    task.cancel()
+
+    async def _get_contents_to_crawl_async(self, start_date, end_date) -> AsyncIterable[Tuple[ContentInfo, int]]:
+        seen = set()
+        async for content in self._repository.get_content_for_dates(start_date, end_date, self._spaces):
+            start_version = self._get_start_version(content, seen)
+            if start_version is not None:
+                yield content, start_version
+
+    async def find_secrets_async(self) -> AsyncIterable[VersionSecrets]:
+        async with self._repository:
+            date = self._start_date or self._cache.get_last_crawl_date() or await self._repository.get_oldest_content_creation_date()
+            end_date = self._end_date or datetime.datetime.now().date()
+            async for start_date, window_end in self._repository.get_date_windows(date, end_date, self._search_window_days, self._spaces):
+                logging.info(f"Fetching changes for {format_window(start_date, window_end)}...")
+                async for content, new_version_secrets in self.get_secrets_from_contents_async(self._get_contents_to_crawl_async(start_date, window_end)):
+                    for s in self._update_crawl_history(content, new_version_secrets):
+                        yield s
+
+                self._cache.set_last_crawl_date(window_end)
+
+    def find_secrets(self) -> Iterable[VersionSecrets]:
+        # Imported here since asyncio is only used by this backend.
+        import asyncio
+        loop = asyncio.new_event_loop()
+        secrets = self.find_secrets_async()
+        try:
+            while True:
+                try:
+                    yield loop.run_until_complete(secrets.__anext__())
+                except StopAsyncIteration:
+                    break
+        finally:
+            loop.run_until_complete(secrets.aclose())
+            loop.close()
+
+
+def format_window(start_date: datetime.date, end_date: datetime.date) -> str:
+    return str(start_date) if start_date == end_date else f"{start_date} to {end_date}"
+
+
+def split_list(value) -> Optional[List[str]]:
+    """Returns the items of a comma separated list, or None when it is empty."""
+    items = [s.strip() for s in (value or "").split(",") if s.strip()]
+    return items or None
+
+
+def rescan(archive: Archive, secret_finder: SecretFinder) -> Iterable[VersionSecrets]:
+    """
+    Scans the archived versions again, in parallel when the secret finder has processes, and yields their secrets like a
+    first crawl: each secret is reported with the first version of the content holding it.
+    """
+    versions = deque()
+
+    def read_versions():
+        for content, version, location in archive.get_versions():
+            versions.append((content, version))
+            yield archive.read(location)
+
+    content_id = None
+    crawl_history = None
+    for secrets in secret_finder.map_secrets(read_versions()):
+        content, version = versions.popleft()
+        metrics.inc("versions_scanned_total")
+        if content.id != content_id:
+            content_id, crawl_history = content.id, ContentCrawlHistory()
+        new_secrets = crawl_history.add_secrets(content.id, secrets)
+        if new_secrets:
+            yield VersionSecrets(content, version, new_secrets)
+
+
+def crawl_shard(app_kwargs, shard: Shard):
+    with App(**app_kwargs) as app:
+        for _ in app.find_secrets_for_shard(shard):
+            pass
+
+
+def add_output_arguments(parser):
+    parser.add_argument('-v', action="store_true", dest='verbose', default=False, help="Increases output verbosity.")
+    parser.add_argument('-vv', action="store_true", dest='verbose_debug', default=False, help="Increases output verbosity even more.")
+    parser.add_argument('--json', '-j', action="store_true", dest='json', default=False, help="Outputs the results as json lines. Same as --format jsonl.")
+    parser.add_argument('--format', action="store", dest='output_format', choices=OUTPUT_FORMATS, default=None, help="Format of the results: text, json lines, a SARIF log or CSV with a row per secret. Defaults to text.")
+    parser.add_argument('--output', '-o', action="store", dest='output_file', metavar="FILE", default=None, help="Writes the results to this file instead of stdout. Compressed with gzip, bz2 or xz when the name ends with .gz, .bz2 or .xz.")
+    parser.add_argument('--post-url', action="store", dest='post_url', metavar="URL", default=None, help="Also posts the results as batches of json lines to this URL, for example a local log collector.")
+    parser.add_argument('--output-batch-size', action="store", dest='output_batch_size', type=int, default=100, help="Number of results buffered before they are written. The buffer is also written when a result is found more than a second after the previous write and at the end of the crawl. Defaults to 100.")
+
+
+def configure_logging(args):
+    if args.verbose or args.verbose_debug:
+        logging.getLogger("chardet.charsetprober").setLevel(logging.ERROR)
+        logging.getLogger().setLevel(logging.DEBUG if args.verbose_debug else logging.INFO)
+
+
+def get_output_format(parser, args) -> str:
+    if args.json and args.output_format not in [None, "jsonl"]:
+        parser.error("--json can not be combined with another --format.")
+    return "jsonl" if args.json else args.output_format or "text"
+
+
+def rescan_main(argv):
+    parser = argparse.ArgumentParser(prog=f"{os.path.basename(sys.argv[0])} rescan",
+                                     description="Scans the versions archived by --archive again without the API, for example after changing the blacklist or upgrading detect-secrets. Each secret is reported with the first archived version of the content holding it.")
+    parser.add_argument('archive', action="store", metavar="ARCHIVE", help="Folder of the archive.")
+    parser.add_argument('--blacklist', '-b', action='store', dest='blacklist_file', default=None, help='File containing regexes to blacklist secrets.')
+    add_output_arguments(parser)
+    parser.add_argument('--scan-processes', action="store", dest='scan_processes', type=int, default=os.cpu_count(), help="Number of processes scanning the archive. 0 scans in this process. Defaults to the number of cores.")
+    args = parser.parse_args(argv)
+    configure_logging(args)
+    output_format = get_output_format(parser, args)
+    if not os.path.exists(os.path.join(args.archive, Archive.index_file_name)):
+        parser.error(f"No archive found in {args.archive}.")
+
+    with ExitStack() as stack:
+        archive = stack.enter_context(Archive(args.archive))
+        secret_finder = SecretFinder(args.blacklist_file, args.scan_processes)
+        stack.callback(secret_finder.close)
+        writers = [stack.enter_context(w) for w in open_output(output_format, args.output_file, args.post_url, args.output_batch_size)]
+        for s in rescan(archive, secret_finder):
+            for writer in writers:
+                writer.write(s)
+
+
 def main():
-    parser = argparse.ArgumentParser(description='Confluence Secret Finder')
+    if sys.argv[1:2] == ["rescan"]:
+        rescan_main(sys.argv[2:])
+        return
+
+    parser = argparse.ArgumentParser(description='Confluence Secret Finder', epilog=f"Run {os.path.basename(sys.argv[0])} rescan --help to scan an archive again.")
     parser.add_argument('--domain', '-d', action="store", dest='domain', help="Confluence domain.", required=True)
     parser.add_argument('--user', '-u', action="store", dest='user', help="Confluence user.", required=True)
     parser.add_argument('--token', '-t', action="store", dest='token', help="API token for the user.", required=True)
+    parser.add_argument('--url', action="store", dest='wiki_url', default=None, help="Base URL of the wiki, for example a proxy or a local Confluence stand-in. The domain still names the cache tables. Defaults to https://DOMAIN.atlassian.net/wiki.")
     parser.add_argument('--start-date', '-s', action="store", dest='start_date', help="Date (YYYY-MM-DD) from which to start the crawling. Otherwise, the script will default to the oldest content creation date or resume where it last stopped.", required=False)
     parser.add_argument('--max-attachment-size', '-m', action="store", dest='max_attachment_size', default=10, help="Max attachment size to download in MB. Defaults to 10MB.", required=False)
     parser.add_argument('--blacklist', '-b', action='store', dest='blacklist_file', default=None, help='File containing regexes to blacklist secrets.')
     parser.add_argument('--cache-location', '-c', action='store', dest='cache_location', default=None, help='Specified where the cache sqlite file will be saved.')
-    parser.add_argument('-v', action="store_true", dest='verbose', default=False, help="Increases output verbosity.")
-    parser.add_argument('-vv', action="store_true", dest='verbose_debug', default=False, help="Increases output verbosity even more.")
-    parser.add_argument('--json', '-j', action="store_true", dest='json', default=False, help="Outputs the results as json.")
+    add_output_arguments(parser)
+    parser.add_argument('--fetch-workers', action="store", dest='fetch_workers', type=int, default=4, help="Number of threads downloading versions and attachments. Defaults to 4.")
+    parser.add_argument('--extract-workers', action="store", dest='extract_workers', type=int, default=2, help="Number of threads extracting text from versions and of processes extracting text from attachments. Defaults to 2.")
+    parser.add_argument('--scan-workers', action="store", dest='scan_workers', type=int, default=1, help="Number of threads scanning extracted text for secrets. Defaults to 1.")
+    parser.add_argument('--scan-processes', action="store", dest='scan_processes', type=int, default=0, help="Number of processes scanning extracted text for secrets, for example the number of cores. 0 scans in the crawler process. Defaults to 0.")
+    parser.add_argument('--extraction-timeout', action="store", dest='extraction_timeout', type=float, default=300, help="Seconds after which the process extracting the text of an attachment is killed and the attachment skipped. Defaults to 300.")
+    parser.add_argument('--extraction-memory-limit', action="store", dest='extraction_memory_limit', type=int, default=2048, help="Memory limit in MB of each process extracting the text of attachments, including the tools it starts. 0 disables the limit. Defaults to 2048.")
+    parser.add_argument('--html-parser', action="store", dest='html_parser', choices=HTML_PARSERS, default="html.parser", help="Parser extracting the text of pages. lxml is faster and requires lxml. It reports the same text, plus the text found outside of any tag, but joins the strings around stray end tags. Defaults to html.parser.")
+    parser.add_argument('--backend', action="store", dest='backend', choices=["threads", "async"], default="threads", help="HTTP backend. The async backend requires httpx. Defaults to threads.")
+    parser.add_argument('--max-concurrent-requests', action="store", dest='max_concurrent_requests', type=int, default=100, help="Max number of requests in flight with the async backend. Defaults to 100.")
+    parser.add_argument('--pool-size', action="store", dest='pool_size', type=int, default=10, help="Number of keep-alive HTTP connections to Confluence. Defaults to 10.")
+    parser.add_argument('--max-requests-per-second', action="store", dest='max_requests_per_second', type=float, default=10, help="Upper bound of the request rate. The rate is lowered automatically when Confluence rate limits the requests. Defaults to 10.")
+    parser.add_argument('--end-date', '-e', action="store", dest='end_date', help="Date (YYYY-MM-DD) at which to stop the crawling. Defaults to today.", required=False)
+    parser.add_argument('--search-window-days', action="store", dest='search_window_days', type=int, default=1, help="Searches the contents changed over windows of up to this number of days instead of one search per day. Windows holding more than 1000 contents are halved and the crawl resumes after the last completed window. Defaults to 1.")
+    parser.add_argument('--spaces', action="store", dest='spaces', default=None, help="Comma separated list of space keys to crawl. Defaults to all spaces.")
+    parser.add_argument('--exclude-spaces', action="store", dest='exclude_spaces', default=None, help="Comma separated list of space keys to skip.")
+    parser.add_argument('--exclude-archived-spaces', action="store_true", dest='exclude_archived_spaces', default=False, help="Skips the archived spaces.")
+    parser.add_argument('--types', action="store", dest='types', default=None, help="Comma separated list of content types to crawl, for example page,blogpost,attachment. Defaults to all types.")
+    parser.add_argument('--exclude-types', action="store", dest='exclude_types', default=None, help="Comma separated list of content types to skip, for example comment.")
+    parser.add_argument('--mime-types', action="store", dest='mime_types', default=None, help="Comma separated list of mime types of the attachments to crawl, with wildcards such as text/*. Defaults to all supported types.")
+    parser.add_argument('--exclude-mime-types', action="store", dest='exclude_mime_types', default=None, help="Comma separated list of mime types of the attachments to skip, with wildcards such as application/vnd.ms-*.")
+    parser.add_argument('--shard-count', action="store", dest='shard_count', type=int, default=None, help="Splits the date range in this number of shards crawled in parallel processes and merged at the end. The processes share --max-requests-per-second and --pool-size.")
+    parser.add_argument('--shard-index', action="store", dest='shard_index', type=int, default=None, help="Only crawls this shard (0 based) of --shard-count shards, for example on another machine. The results are merged later with --merge.")
+    parser.add_argument('--split-spaces', action="store_true", dest='split_spaces', default=False, help="Also splits the shards by space. Requires --spaces.")
+    parser.add_argument('--merge', action="store", dest='merge', nargs="+", metavar="CACHE_FILE", default=None, help="Merges the shards crawled in the given cache files into the cache and outputs their secrets.")
+    parser.add_argument('--lazy-version-bodies', action="store_true", dest='lazy_version_bodies', default=False, help="Downloads the body of each page version only when it is scanned instead of with the version list. Lowers the memory used by pages with long histories at the cost of one request per version.")
+    parser.add_argument('--incremental-scan', action="store_true", dest='incremental_scan', default=False, help="Only scans the lines added or changed since the previous version of a content. The output is the same since the secrets of the other lines were already reported with the previous version.")
+    parser.add_argument('--content-cache-size', action="store", dest='content_cache_size', type=int, default=0, help="Number of distinct version contents whose text and secrets are cached so that identical contents are not extracted and scanned again. The cache, next to the --cache file, holds them in plaintext. 0 disables the cache. Defaults to 0.")
+    parser.add_argument('--daemon', action="store_true", dest='daemon', default=False, help="Keeps running after the crawl. The contents named by the Confluence webhooks received on --webhook-port are scanned as soon as they stop changing, and the changes since the last crawl date are crawled every --poll-interval seconds to catch the missed webhooks.")
+    parser.add_argument('--webhook-port', action="store", dest='webhook_port', type=int, default=8000, help="Port receiving the webhooks, such as page_updated or attachment_created, with --daemon. Defaults to 8000.")
+    parser.add_argument('--webhook-address', action="store", dest='webhook_address', default="127.0.0.1", help="Address listening for the webhooks with --daemon. Any other address than localhost requires --webhook-secret. Defaults to 127.0.0.1.")
+    parser.add_argument('--webhook-secret', action="store", dest='webhook_secret', default=None, help="Secret of the webhooks. Webhooks without a valid X-Hub-Signature header are rejected.")
+    parser.add_argument('--debounce', action="store", dest='debounce', type=float, default=30, help="Seconds without a webhook for a content before it is scanned, so that a burst of edits is scanned once. Defaults to 30.")
+    parser.add_argument('--poll-interval', action="store", dest='poll_interval', type=float, default=3600, help="Seconds between the crawls catching the missed webhooks with --daemon. Defaults to 3600.")
+    parser.add_argument('--archive', action="store", dest='archive_location', metavar="FOLDER", default=None, help="Appends the extracted text of the versions crawled to a compressed archive in this folder, which the rescan command scans again without the API.")
+    parser.add_argument('--metrics-port', action="store", dest='metrics_port', type=int, default=None, help="Serves metrics in the Prometheus format at /metrics on this port while crawling: requests, retries, 429s, rate limit waits, bytes downloaded, versions scanned and the time spent extracting, scanning and writing the cache. With --shard-count, only the main process is measured.")
+    parser.add_argument('--metrics-address', action="store", dest='metrics_address', default="127.0.0.1", help="Address serving the metrics of --metrics-port. The metrics are served without authentication. Defaults to 127.0.0.1.")
+    parser.add_argument('--stats-interval', action="store", dest='stats_interval', type=float, default=None, help="Writes the metrics as a JSON line to stderr every given number of seconds and at the end of the crawl.")
+    parser.add_argument('--profile', action="store", dest='profile', metavar="FILE", default=None, help="Samples the stacks of every thread and writes them to this file in the collapsed format of flamegraph.pl and speedscope.")
 
     args = parser.parse_args()
 
@@ -110,18 +750,77 @@ def main():
     if args.start_date:
         start_date = dateutil.parser.parse(args.start_date).date()
 
-    if args.verbose or args.verbose_debug:
-        logging.getLogger("sqlitedict").setLevel(logging.ERROR)
-        logging.getLogger("chardet.charsetprober").setLevel(logging.ERROR)
-        logging.getLogger().setLevel(logging.DEBUG if args.verbose_debug else logging.INFO)
+    configure_logging(args)
+
+    end_date = None
+    if args.end_date:
+        end_date = dateutil.parser.parse(args.end_date).date()
+
+    spaces = split_list(args.spaces)
+    content_filter = ContentFilter(split_list(args.exclude_spaces), split_list(args.types), split_list(args.exclude_types),
+                                   split_list(args.mime_types), split_list(args.exclude_mime_types), not args.exclude_archived_spaces)
+
+    if args.shard_index is not None and (not args.shard_count or not args.start_date or not args.end_date):
+        parser.error("--shard-index requires --shard-count, --start-date and --end-date so that every machine plans the same shards.")
+    if args.split_spaces and not spaces:
+        parser.error("--split-spaces requires --spaces.")
+    if args.backend == "async" and (args.shard_count or args.merge):
+        parser.error("Shards are only supported by the threads backend.")
+    if args.daemon and (args.backend == "async" or args.shard_count or args.merge or args.end_date):
+        parser.error("--daemon is only supported by the threads backend, without shards and without --end-date.")
+    if args.daemon and args.webhook_address not in LOOPBACK_ADDRESSES and not args.webhook_secret:
+        parser.error("--webhook-secret is required to receive webhooks on another address than localhost.")
+    output_format = get_output_format(parser, args)
+
+    app_kwargs = dict(domain=args.domain, api_user=args.user, api_token=args.token, blacklist_file=args.blacklist_file,
+                      max_attachment_size=args.max_attachment_size, cache_location=args.cache_location, start_date=start_date,
+                      fetch_workers=args.fetch_workers, extract_workers=args.extract_workers, scan_workers=args.scan_workers,
+                      pool_size=args.pool_size, max_requests_per_second=args.max_requests_per_second, end_date=end_date, spaces=spaces,
+                      lazy_version_bodies=args.lazy_version_bodies, incremental_scan=args.incremental_scan,
+                      content_cache_size=args.content_cache_size, extraction_timeout=args.extraction_timeout,
+                      extraction_memory_limit=args.extraction_memory_limit, html_parser=args.html_parser,
+                      scan_processes=args.scan_processes, wiki_url=args.wiki_url, search_window_days=args.search_window_days,
+                      content_filter=content_filter, archive_location=args.archive_location)
+    if args.backend == "async":
+        app = AsyncApp(max_concurrent_requests=args.max_concurrent_requests, **app_kwargs)
+    else:
+        app = App(**app_kwargs)
+
+    with ExitStack() as stack:
+        if args.metrics_port is not None:
+            stack.enter_context(MetricsServer(args.metrics_port, args.metrics_address))
+        if args.stats_interval:
+            stack.enter_context(StatsReporter(args.stats_interval))
+        if args.profile:
+            stack.enter_context(Profiler(args.profile))
+        stack.enter_context(app)
+        # The daemon writes each result as soon as it is found.
+        batch_size = 1 if args.daemon else args.output_batch_size
+        writers = [stack.enter_context(w) for w in open_output(output_format, args.output_file, args.post_url, batch_size)]
+
+        if args.daemon:
+            events = EventQueue(args.debounce)
+            stack.enter_context(WebhookServer(args.webhook_port, events, args.webhook_address, args.webhook_secret))
+            # Stopped like with Ctrl+C so that the cache and the output are closed.
+            signal.signal(signal.SIGTERM, lambda *_: sys.exit(0))
+            secrets = app.watch(events, args.poll_interval)
+        elif args.merge:
+            secrets = app.merge_shards(args.merge)
+        elif args.shard_index is not None:
+            secrets = app.find_secrets_for_shard(app.plan_shards(args.shard_count, args.split_spaces)[args.shard_index])
+        elif args.shard_count:
+            secrets = app.find_secrets_in_shards(args.shard_count, app_kwargs, args.split_spaces)
+        else:
+            secrets = app.find_secrets()
 
-    with App(args.domain, args.user, args.token, args.blacklist_file, args.max_attachment_size, args.cache_location, start_date) as app:
-        for s in app.find_secrets():
-            if args.json:
-                j = to_json(s)
-                print(j)
-            else:
-                print(f"{s.content.space}): {s.version}: {s.secrets}")
+        try:
+            for s in secrets:
+                for writer in writers:
+                    writer.write(s)
+        except KeyboardInterrupt:
+            if not args.daemon:
+                raise
+            logging.info("Daemon stopped.")
 
 
 if __name__ == "__main__":